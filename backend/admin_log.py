@@ -0,0 +1,78 @@
+# Bounded admin request log
+#
+# Entries go into a fixed-capacity deque (oldest dropped first). Every entry
+# carries a monotonically increasing 'seq', which readers use as a pagination
+# cursor; seq is assigned and the entry appended under one small lock, so the
+# deque is always in seq order with no gaps. Readers take no lock: they copy
+# the deque and index into it by seq. An optional spill writes
+# each entry as a JSON line to a rotating file from a background thread.
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+
+DEFAULT_CAPACITY = 10000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class AdminLog:
+    def __init__(self, capacity=DEFAULT_CAPACITY, spill_path=None, spill_max_bytes=10 * 1024 * 1024, spill_backups=5):
+        self._entries = deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+        self._append_lock = threading.Lock()
+        self._listener = None
+        self._spill_queue = None
+        if spill_path:
+            handler = logging.handlers.RotatingFileHandler(spill_path, maxBytes=spill_max_bytes, backupCount=spill_backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._spill_queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self._spill_queue, handler)
+            self._listener.start()
+
+    @property
+    def capacity(self):
+        return self._entries.maxlen
+
+    def record(self, endpoint, input_data, output_data, status):
+        with self._append_lock:
+            entry = {
+                'seq': next(self._seq),
+                'time': time.time(),
+                'endpoint': endpoint,
+                'input': input_data,
+                'output': output_data,
+                'status': status,
+            }
+            self._entries.append(entry)
+        if self._spill_queue is not None:
+            self._spill_queue.put_nowait(logging.makeLogRecord({'msg': json.dumps(entry, default=str)}))
+        return entry
+
+    def page(self, cursor=None, limit=DEFAULT_PAGE_SIZE):
+        # Entries with seq > cursor, oldest first, at most limit of them.
+        # Returns (entries, next_cursor); pass next_cursor back to continue.
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        snapshot = self._entries.copy()  # copies references only
+        if not snapshot:
+            return [], cursor or 0
+        first = snapshot[0]['seq']
+        start = 0 if cursor is None else max(0, int(cursor) + 1 - first)
+        entries = list(itertools.islice(snapshot, start, start + limit))
+        next_cursor = entries[-1]['seq'] if entries else max(int(cursor or 0), snapshot[-1]['seq'])
+        return entries, next_cursor
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,194 @@
+# Approximate nearest-neighbour rule index (IVF)
+#
+# Drop-in alternative to SimpleVectorStore's exact scan for large corpora,
+# with the same add/search/search_batch interface and results. Vectors are
+# normalized and partitioned by spherical k-means into n_lists inverted
+# lists; a query scores the centroids, then scans only the nprobe closest
+# lists. nprobe is the recall/latency knob: 1 is fastest, n_lists is exact.
+# Until enough rows have arrived to train the quantizer, search is exact;
+# with n_lists left automatic (~sqrt(rows)) the quantizer is retrained each
+# time the corpus grows RETRAIN_GROWTH-fold, so lists stay balanced at an
+# amortized constant cost per added row.
+# Metadata filters and deletion stay with SimpleVectorStore.
+import numpy as np
+
+from backend.utils_embedding import _normalize_rows
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+TRAIN_SAMPLE = 50000
+MIN_ROWS_PER_LIST = 8  # rows per list needed before training
+RETRAIN_GROWTH = 4
+
+
+class _InvertedList:
+    # Growable float32 rows plus their global row ids
+    def __init__(self, dim):
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+    def append(self, rows, ids):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(16, len(self.ids))
+            while capacity < needed:
+                capacity *= 2
+            vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:self.size] = self.vectors[:self.size]
+            grown = np.zeros(capacity, dtype=np.int64)
+            grown[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = vectors, grown
+        self.vectors[self.size:needed] = rows
+        self.ids[self.size:needed] = ids
+        self.size = needed
+
+
+def spherical_kmeans(rows, k, iterations=KMEANS_ITERATIONS, seed=0):
+    # Unit-norm centroids maximizing cosine similarity to their rows
+    rng = np.random.default_rng(seed)
+    k = min(k, len(rows))
+    centroids = rows[rng.choice(len(rows), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(rows @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, rows)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty lists on random rows rather than losing them
+            sums[empty] = rows[rng.choice(len(rows), size=int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, n_lists=None, nprobe=DEFAULT_NPROBE, train_sample=TRAIN_SAMPLE, seed=0):
+        self.n_lists = n_lists
+        self._auto_lists = n_lists is None  # ~sqrt(rows) at each training
+        self._trained_rows = 0
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.seed = seed
+        self.texts = []
+        self.centroids = None
+        self._lists = []
+        self._pending = []  # normalized rows added before training
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def dim(self):
+        if self.centroids is not None:
+            return self.centroids.shape[1]
+        return self._pending[0].shape[1] if self._pending else None
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def add(self, texts, embeddings):
+        rows = _normalize_rows(embeddings)
+        if len(texts) != rows.shape[0]:
+            raise ValueError("texts and embeddings must have the same length")
+        if self.dim is not None and rows.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {rows.shape[1]} does not match index dimension {self.dim}")
+        start = len(self.texts)
+        self.texts.extend(texts)
+        if self.trained:
+            self._assign(rows, np.arange(start, start + len(rows)))
+            if self._auto_lists and len(self.texts) >= RETRAIN_GROWTH * self._trained_rows:
+                self.train()
+            return
+        self._pending.append(rows)
+        lists = int(np.sqrt(len(self.texts))) if self._auto_lists else self.n_lists
+        if lists > 1 and len(self.texts) >= lists * MIN_ROWS_PER_LIST:
+            self.train()
+
+    def _rows(self):
+        # Every normalized row, in insertion order
+        if not self.trained:
+            return np.vstack(self._pending) if self._pending else None
+        rows = np.zeros((len(self.texts), self.dim), dtype=np.float32)
+        for inverted in self._lists:
+            rows[inverted.ids[:inverted.size]] = inverted.vectors[:inverted.size]
+        return rows
+
+    def train(self):
+        # Fit the coarse quantizer on a sample, then file every row
+        rows = self._rows()
+        if rows is None:
+            return
+        k = max(1, int(np.sqrt(len(rows)))) if self._auto_lists else self.n_lists
+        rng = np.random.default_rng(self.seed)
+        sample = rows if len(rows) <= self.train_sample else rows[rng.choice(len(rows), self.train_sample, replace=False)]
+        self.centroids = spherical_kmeans(sample, k, seed=self.seed)
+        self.n_lists = len(self.centroids)
+        self._lists = [_InvertedList(rows.shape[1]) for _ in range(self.n_lists)]
+        self._pending = []
+        self._trained_rows = len(rows)
+        self._assign(rows, np.arange(len(rows)))
+
+    def _assign(self, rows, ids):
+        assignment = np.argmax(rows @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        for list_id in range(self.n_lists):
+            picked = order[bounds[list_id]:bounds[list_id + 1]]
+            if len(picked):
+                self._lists[list_id].append(rows[picked], ids[picked])
+
+    def list_sizes(self):
+        return [inverted.size for inverted in self._lists]
+
+    def search(self, query_embedding, top_k=1, nprobe=None, **filters):
+        # Returns [(text, cosine_distance), ...] best first
+        results = self.search_batch(query_embedding, top_k=top_k, nprobe=nprobe, **filters)
+        return results[0] if results else []
+
+    def search_batch(self, query_matrix, top_k=1, nprobe=None, where=None, exclude=None):
+        if where or exclude:
+            raise ValueError("IVFIndex does not filter on metadata; use SimpleVectorStore")
+        queries = _normalize_rows(query_matrix)
+        if not self.texts:
+            return [[] for _ in range(queries.shape[0])]
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {self.dim}")
+        if not self.trained:
+            rows = self._rows()
+            return [self._rank(scores, np.arange(len(rows)), top_k) for scores in queries @ rows.T]
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        results = []
+        for query, lists in zip(queries, probes):
+            scores, ids = [], []
+            for list_id in lists:
+                inverted = self._lists[list_id]
+                if inverted.size:
+                    scores.append(inverted.vectors[:inverted.size] @ query)
+                    ids.append(inverted.ids[:inverted.size])
+            if not ids:
+                results.append([])
+                continue
+            results.append(self._rank(np.concatenate(scores), np.concatenate(ids), top_k))
+        return results
+
+    def _rank(self, scores, ids, top_k):
+        # Best score first, ties broken by insertion order, as the exact store
+        top_k = min(top_k, len(ids))
+        if top_k < len(ids):
+            cand = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            cand = np.arange(len(ids))
+        order = cand[np.lexsort((ids[cand], -scores[cand]))]
+        distances = np.clip(1.0 - scores[order], 0.0, 2.0)
+        return [(self.texts[i], float(d)) for i, d in zip(ids[order], distances)]
+
+
+def recall_at_k(approximate, exact):
+    # Mean fraction of each query's exact top-k found by the approximate top-k
+    if not exact:
+        return 1.0
+    hits = [len({t for t, _ in a} & {t for t, _ in e}) / max(1, len(e)) for a, e in zip(approximate, exact)]
+    return float(np.mean(hits))
@@ -0,0 +1,50 @@
+# IVF vs exact rule search: python -m backend.benchmarks.bench_ann [n] [dim]
+# Reports build time, per-query latency and recall@k against the exact scan
+# for a sweep of nprobe values.
+import sys
+import time
+
+import numpy as np
+
+from backend.ann_index import IVFIndex, recall_at_k
+from backend.utils_embedding import SimpleVectorStore
+
+TOP_K = 10
+QUERIES = 200
+NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def corpus(n, dim, seed=0):
+    # Clustered vectors (topics) with enough noise that neighbours straddle lists
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(1, n // 500), dim))
+    rows = topics[rng.integers(0, len(topics), n)] + rng.normal(scale=1.5, size=(n, dim))
+    queries = topics[rng.integers(0, len(topics), QUERIES)] + rng.normal(scale=1.5, size=(QUERIES, dim))
+    return rows.astype(np.float32), queries.astype(np.float32)
+
+
+def main(n=200000, dim=128):
+    rows, queries = corpus(n, dim)
+    texts = [f"chunk {i}" for i in range(n)]
+    exact = SimpleVectorStore()
+    exact.add(texts, rows)
+    start = time.perf_counter()
+    truth = exact.search_batch(queries, top_k=TOP_K)
+    exact_ms = (time.perf_counter() - start) * 1e3 / QUERIES
+    start = time.perf_counter()
+    index = IVFIndex()
+    index.add(texts, rows)
+    build = time.perf_counter() - start
+    print(f"{n} rows x {dim} dims, {index.n_lists} lists, built in {build:.2f} s")
+    print(f"{'exact':<12} {exact_ms:10.3f} ms/query  recall@{TOP_K} 1.000")
+    for nprobe in NPROBES:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        found = index.search_batch(queries, top_k=TOP_K, nprobe=nprobe)
+        ms = (time.perf_counter() - start) * 1e3 / QUERIES
+        print(f"{'nprobe=' + str(nprobe):<12} {ms:10.3f} ms/query  recall@{TOP_K} {recall_at_k(found, truth):.3f}")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
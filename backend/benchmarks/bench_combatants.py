@@ -0,0 +1,23 @@
+# Group skill check benchmark: python -m backend.benchmarks.bench_combatants [n]
+import sys
+import time
+
+from backend.engine import Engine
+
+
+def main(n=10000):
+    engine = Engine([])
+    group = engine.spawn("Goblin", n, modifier=1)
+    start = time.perf_counter()
+    for c in group:
+        engine.skill_check(c, dc=13)
+    looped = time.perf_counter() - start
+    start = time.perf_counter()
+    engine.group_skill_check(group, dc=13, seed=0)
+    vectorized = time.perf_counter() - start
+    print(f"{'skill_check loop (' + str(n) + ')':<32} {looped * 1e3:10.2f} ms")
+    print(f"{'group_skill_check (' + str(n) + ')':<32} {vectorized * 1e3:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,35 @@
+# Initiative tracker benchmark: python -m backend.benchmarks.bench_initiative [n]
+import random
+import sys
+import time
+
+from backend.engine import Character, Engine
+
+
+def timed(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed / repeat * 1e6:10.2f} us/op")
+
+
+def main(n=10000):
+    rng = random.Random(0)
+    chars = [Character(f"Goblin{i % 500}", rng.randint(-2, 5)) for i in range(n)]
+    engine = Engine(chars)
+    start = time.perf_counter()
+    engine.assign_initiative(seed=1)
+    print(f"{'assign_initiative(' + str(n) + ')':<32} {(time.perf_counter() - start) * 1e3:10.2f} ms")
+    timed("next_turn", engine.next_turn, 10000)
+    summons = iter([Character(f"Summon{i}", 0) for i in range(2000)])
+    timed("add_combatant (mid-round)", lambda: engine.add_combatant(next(summons), initiative=rng.randint(1, 25)), 2000)
+    victims = iter(rng.sample(chars, 2000))
+    timed("remove_combatant", lambda: engine.remove_combatant(next(victims)), 2000)
+    delayed = iter(rng.sample([c for c in chars if c in engine.tracker], 2000))
+    timed("delay_combatant", lambda: engine.delay_combatant(next(delayed), rng.randint(1, 25)), 2000)
+    timed("current turn (format prompt)", engine.tracker.current, 10000)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
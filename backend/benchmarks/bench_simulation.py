@@ -0,0 +1,25 @@
+# Encounter simulation benchmark: python -m backend.benchmarks.bench_simulation [trials] [workers]
+import sys
+import time
+
+from backend.simulation import CombatantSpec, simulate
+
+ENCOUNTER = [
+    CombatantSpec('Fighter', 'party', 30, 17, 5, '1d8+3', 1),
+    CombatantSpec('Wizard', 'party', 16, 12, 5, '1d10', 2),
+    CombatantSpec('Cleric', 'party', 24, 16, 4, '1d8+2'),
+    *[CombatantSpec('Goblin', 'enemies', 7, 15, 4, '1d6+2', 2) for _ in range(6)],
+    CombatantSpec('Bugbear', 'enemies', 27, 16, 4, '2d8+2', 2),
+]
+
+
+def main(trials=10000, workers=None):
+    start = time.perf_counter()
+    result = simulate(ENCOUNTER, trials=trials, seed=1, workers=workers)
+    print(f"{trials} trials in {(time.perf_counter() - start) * 1e3:.0f} ms")
+    print(f"win rates: {result['win_rates']}")
+    print(f"rounds: mean {result['rounds']['mean']:.2f}, median {result['rounds']['median']}, p90 {result['rounds']['p90']}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else None)
@@ -0,0 +1,238 @@
+# Hierarchical campaign memory, stored per session in the session store
+#
+#   memory     the most recent turns, verbatim
+#   summaries  compacted older turns: once SEGMENT_TURNS turns overflow the
+#              recent window they become one level-1 summary, and every
+#              FANOUT summaries of a level merge into one of the next level
+#   archive    every compacted turn verbatim, for vector recall of past events,
+#              kept as rows of its own (see DatabaseArchive) rather than in
+#              the session, so a turn never rewrites thousands of old ones
+#
+# Compaction only runs when a segment fills, so most turns just append, and
+# the prompt holds a bounded number of summaries however long the campaign.
+# Turns are recorded with SessionStore.modify, so two workers answering the
+# same session at once both keep their turn.
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from backend.prompt_assembler import _clip, render_turn
+from backend.utils_embedding import HashingEmbedder, SimpleVectorStore, embed_texts, retrieve_rules
+
+RECENT_TURNS = 8
+SEGMENT_TURNS = 8
+FANOUT = 4
+SUMMARY_TOKENS = 120
+MAX_ARCHIVE_TURNS = 5000
+RECALL_INDEX_CACHE = 256  # sessions whose recall index stays built in-process
+
+
+def _first_sentence(text: str) -> str:
+    for mark in ('. ', '! ', '? '):
+        if mark in text:
+            text = text.split(mark, 1)[0] + mark.strip()
+    return text.strip()
+
+
+def extractive_summary(parts: Sequence[str], max_tokens: int = SUMMARY_TOKENS) -> str:
+    # Offline summarizer: keep the gist of each part, sharing the token budget
+    share = max(1, max_tokens // max(1, len(parts)))
+    return ' | '.join(_clip(_first_sentence(p) if len(parts) > 1 else p, share) for p in parts)
+
+
+def _summarize_turns(turns: Sequence, summarize: Callable, max_tokens: int) -> str:
+    lines = []
+    for turn in turns:
+        if isinstance(turn, dict) and 'player' in turn:
+            lines.append(f"{turn.get('player', '')}: {_first_sentence(turn.get('gm', ''))}")
+        else:
+            lines.append(render_turn(turn))
+    return summarize(lines, max_tokens)
+
+
+class InMemoryArchive:
+    # Process-local archive, for tests and single-process development
+    def __init__(self, max_turns: int = MAX_ARCHIVE_TURNS):
+        self.max_turns = max_turns
+        self._turns: Dict = {}  # session_id -> OrderedDict(position -> text)
+        self._lock = threading.Lock()
+
+    def append(self, session_id, first: int, texts: Sequence[str]):
+        # Turns first, first+1, ...; only the newest max_turns are kept
+        with self._lock:
+            turns = self._turns.setdefault(session_id, OrderedDict())
+            for position, text in enumerate(texts, start=first):
+                turns.setdefault(position, text)
+            while len(turns) > self.max_turns:
+                turns.popitem(last=False)
+
+    def bounds(self, session_id) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            turns = self._turns.get(session_id)
+            return (next(iter(turns)), next(reversed(turns))) if turns else None
+
+    def load(self, session_id, after: int = 0) -> List[str]:
+        with self._lock:
+            return [t for p, t in self._turns.get(session_id, {}).items() if p > after]
+
+
+class DatabaseArchive:
+    # Rows of the campaign_archive_turn table, shared by every worker
+    def __init__(self, max_turns: int = MAX_ARCHIVE_TURNS):
+        self.max_turns = max_turns
+
+    def append(self, session_id, first: int, texts: Sequence[str]):
+        from sqlalchemy.exc import IntegrityError
+        from backend.app import db
+        from backend.models import CampaignArchiveTurn
+        db.session.add_all(CampaignArchiveTurn(session_id=session_id, position=position, text=text)
+                           for position, text in enumerate(texts, start=first))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # already archived
+        last = first + len(texts) - 1
+        CampaignArchiveTurn.query.filter(CampaignArchiveTurn.session_id == session_id,
+                                         CampaignArchiveTurn.position <= last - self.max_turns).delete()
+        db.session.commit()
+
+    def bounds(self, session_id) -> Optional[Tuple[int, int]]:
+        from sqlalchemy import func
+        from backend.app import db
+        from backend.models import CampaignArchiveTurn
+        first, last = db.session.query(func.min(CampaignArchiveTurn.position), func.max(CampaignArchiveTurn.position)) \
+            .filter(CampaignArchiveTurn.session_id == session_id).one()
+        return (first, last) if first is not None else None
+
+    def load(self, session_id, after: int = 0) -> List[str]:
+        from backend.models import CampaignArchiveTurn
+        rows = CampaignArchiveTurn.query.with_entities(CampaignArchiveTurn.text) \
+            .filter(CampaignArchiveTurn.session_id == session_id, CampaignArchiveTurn.position > after) \
+            .order_by(CampaignArchiveTurn.position)
+        return [r.text for r in rows]
+
+
+class _RecallIndex:
+    # One session's recall index; its lock only serializes that session
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = self.embedder = None
+        self.first = self.last = None
+
+
+class CampaignMemory:
+    def __init__(self, store, recent_turns: int = RECENT_TURNS, segment_turns: int = SEGMENT_TURNS,
+                 fanout: int = FANOUT, summary_tokens: int = SUMMARY_TOKENS,
+                 summarize: Optional[Callable] = None, archive=None):
+        self.store = store
+        self.archive = archive if archive is not None else InMemoryArchive()
+        self.recent_turns = recent_turns
+        self.segment_turns = segment_turns
+        self.fanout = fanout
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize or extractive_summary
+        self._recall_indexes: OrderedDict = OrderedDict()  # session_id -> _RecallIndex
+        self._lock = threading.Lock()
+
+    def record(self, session_id, player: str, gm: str) -> Optional[Dict]:
+        compacted = []  # (first turn, rendered turns) to archive once saved
+
+        def change(data):
+            compacted.clear()
+            memory = list(data.get('memory', [])) + [{'player': player, 'gm': gm}]
+            summaries = list(data.get('summaries', []))
+            turns = data.get('turns', len(memory) - 1) + 1
+            legacy = data.pop('archive', None)  # sessions from before archive rows
+            if legacy:
+                last = turns - len(memory)
+                compacted.append((last - len(legacy) + 1, legacy))
+            if len(memory) >= self.recent_turns + self.segment_turns:
+                segment, memory = memory[:self.segment_turns], memory[self.segment_turns:]
+                first = turns - len(memory) - len(segment) + 1
+                summaries.append({'level': 1, 'first': first, 'last': first + len(segment) - 1,
+                                  'summary': _summarize_turns(segment, self.summarize, self.summary_tokens)})
+                compacted.append((first, [render_turn(t) for t in segment]))
+                summaries = self._merge(summaries)
+            data.update({'memory': memory, 'summaries': summaries, 'turns': turns})
+            return data
+
+        data = self.store.modify(session_id, change)
+        if data is not None:
+            for first, texts in compacted:
+                self.archive.append(session_id, first, texts)
+        return data
+
+    def _merge(self, summaries: List[Dict]) -> List[Dict]:
+        # Fold FANOUT consecutive summaries of one level into the next level up
+        level = 1
+        while True:
+            same = [s for s in summaries if s['level'] == level]
+            if len(same) < self.fanout:
+                return summaries
+            group = same[:self.fanout]
+            merged = {'level': level + 1, 'first': group[0]['first'], 'last': group[-1]['last'],
+                      'summary': self.summarize([s['summary'] for s in group], self.summary_tokens)}
+            folded = {id(s) for s in group}
+            position = next(i for i, s in enumerate(summaries) if id(s) in folded)
+            summaries = [s for s in summaries if id(s) not in folded]
+            summaries.insert(position, merged)
+            level += 1
+
+    def recall(self, session_id, query: str, top_k: int = 3) -> List[str]:
+        # Past events most similar to query, from compacted turns only (the
+        # recent window is already in the prompt). The per-session index only
+        # loads and embeds turns archived since the last recall.
+        bounds = self.archive.bounds(session_id)
+        if bounds is None or not query:
+            return []
+        with self._lock:
+            entry = self._recall_indexes.get(session_id)
+            if entry is None:
+                entry = self._recall_indexes[session_id] = _RecallIndex()
+            self._recall_indexes.move_to_end(session_id)
+            while len(self._recall_indexes) > RECALL_INDEX_CACHE:
+                self._recall_indexes.popitem(last=False)
+        # Loading and embedding hold only this session's lock, so recall for
+        # other sessions never waits on them
+        with entry.lock:
+            if entry.index is not None and (entry.first != bounds[0] or entry.last > bounds[1]):
+                entry.index = None  # archive was trimmed; start over
+            if entry.index is None:
+                archive = self.archive.load(session_id)
+                entry.index, entry.embedder = SimpleVectorStore(), HashingEmbedder()
+                entry.index.add(archive, embed_texts(archive, entry.embedder)[0])
+            elif entry.last < bounds[1]:
+                # Embed just the newly compacted turns and append them
+                fresh = self.archive.load(session_id, after=entry.last)
+                entry.index.add(fresh, embed_texts(fresh, entry.embedder)[0])
+            entry.first, entry.last = bounds
+            index, embedder = entry.index, entry.embedder
+        return retrieve_rules(index, embedder, [query], top_k=top_k)[0]
+
+    def prompt_memory(self, session_id, query: Optional[str] = None, top_k: int = 3) -> List:
+        # Memory items for the prompt assembler, oldest first: summaries,
+        # recalled events, then the verbatim recent turns
+        data = self.store.get(session_id) or {}
+        items = [{'summary': s['summary']} for s in data.get('summaries', [])]
+        if query:
+            items.extend(f"Earlier: {event}" for event in self.recall(session_id, query, top_k=top_k))
+        return items + list(data.get('memory', []))
+
+
+def get_campaign_memory(app=None):
+    # One per Flask app, on top of its session store; the archive lives next
+    # to the sessions (database rows unless sessions are in memory)
+    from backend.session_store import DatabaseSessionBackend, get_session_store
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    memory = app.extensions.get('campaign_memory')
+    if memory is None:
+        store = get_session_store(app)
+        archive = DatabaseArchive() if isinstance(store.backend, DatabaseSessionBackend) else InMemoryArchive()
+        memory = CampaignMemory(store,
+                                recent_turns=app.config.get('MEMORY_RECENT_TURNS', RECENT_TURNS),
+                                segment_turns=app.config.get('MEMORY_SEGMENT_TURNS', SEGMENT_TURNS),
+                                archive=archive)
+        app.extensions['campaign_memory'] = memory
+    return memory
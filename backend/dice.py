@@ -0,0 +1,446 @@
+# Dice expression parser and roller
+#
+# Grammar (case-insensitive, whitespace ignored):
+#   expr  := ['+'|'-'] term (('+'|'-') term)*
+#   term  := dice | INT
+#   dice  := [INT] 'd' (INT | '%') mod*
+#   mod   := '!'                 exploding: a die showing its max rolls again and adds
+#          | ('kh'|'kl') [INT]   keep highest/lowest N (default 1)
+#          | ('dh'|'dl') [INT]   drop highest/lowest N (default 1)
+#          | 'adv' | 'dis'       advantage/disadvantage: 2 dice, keep highest/lowest 1
+#
+# e.g. "4d6kh3+2d8+5", "1d20adv+3", "3d6!". Compiled expressions are cached,
+# so parsing an expression the hot path has seen before is one dict hit.
+import random
+import re
+import threading
+from functools import lru_cache
+from math import comb
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+MAX_DICE_PER_TERM = 1000
+MAX_SIDES = 1000
+MAX_EXPLOSIONS = 20  # per die; bounds the loop for pathological luck
+FFT_MIN_SIZE = 64  # convolve with FFT once both operands are at least this long
+MAX_KEEP_DP_WORK = 50_000_000  # bound on keep-highest/lowest PMF work
+SAMPLE_CHUNK_DICE = 1 << 20  # dice drawn per block when sampling many trials
+MAX_PMF_SUPPORT = 250_000  # bound on the length of an exact distribution
+PMF_CACHE_SIZE = 4096
+PMF_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class DiceError(ValueError):
+    pass
+
+
+class DiceTerm(NamedTuple):
+    count: int
+    sides: int
+    explode: bool = False
+    keep: Optional[Tuple[str, int]] = None  # ('h' | 'l', n)
+
+    def __str__(self):
+        if self.keep is not None and self.count == 2 and self.keep[1] == 1 and not self.explode:
+            return f"1d{self.sides}{'adv' if self.keep[0] == 'h' else 'dis'}"
+        text = f"{self.count}d{self.sides}" + ('!' if self.explode else '')
+        if self.keep is not None:
+            text += f"k{self.keep[0]}{self.keep[1]}"
+        return text
+
+    @property
+    def kept(self):
+        return self.keep[1] if self.keep is not None else self.count
+
+    def roll(self, rng: random.Random) -> Tuple[int, List[int]]:
+        # One roll with a stdlib RNG; returns (kept total, every face rolled)
+        faces = []
+        values = []
+        for _ in range(self.count):
+            face = rng.randint(1, self.sides)
+            faces.append(face)
+            value = face
+            explosions = 0
+            while self.explode and face == self.sides and explosions < MAX_EXPLOSIONS:
+                face = rng.randint(1, self.sides)
+                faces.append(face)
+                value += face
+                explosions += 1
+            values.append(value)
+        return _keep_total(values, self.keep), faces
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        # n independent rolls; returns kept totals, shape (n,). Drawn in blocks
+        # of about SAMPLE_CHUNK_DICE dice so the trials x dice matrix stays small.
+        rows = max(1, SAMPLE_CHUNK_DICE // self.count)
+        if n <= rows:
+            return self._sample_block(n, rng)
+        totals = np.empty(n, dtype=np.int64)
+        for start in range(0, n, rows):
+            stop = min(n, start + rows)
+            totals[start:stop] = self._sample_block(stop - start, rng)
+        return totals
+
+    def _sample_block(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        values = rng.integers(1, self.sides + 1, size=(n, self.count), dtype=np.int64)
+        if self.explode:
+            active = values == self.sides
+            for _ in range(MAX_EXPLOSIONS):
+                idx = np.nonzero(active)
+                if idx[0].size == 0:
+                    break
+                extra = rng.integers(1, self.sides + 1, size=idx[0].size, dtype=np.int64)
+                values[idx] += extra
+                active = np.zeros_like(active)
+                active[idx] = extra == self.sides
+        if self.keep is None:
+            return values.sum(axis=1)
+        values.sort(axis=1)
+        mode, k = self.keep
+        kept = values[:, -k:] if mode == 'h' else values[:, :k]
+        return kept.sum(axis=1)
+
+
+def _keep_total(values, keep):
+    if keep is None:
+        return sum(values)
+    mode, k = keep
+    ordered = sorted(values)
+    return sum(ordered[-k:] if mode == 'h' else ordered[:k])
+
+
+class DiceExpression(NamedTuple):
+    terms: Tuple[Tuple[int, DiceTerm], ...]  # (sign, term)
+    constant: int = 0
+
+    def __str__(self):
+        parts = []
+        for sign, term in self.terms:
+            parts.append(('-' if sign < 0 else '+') + str(term))
+        if self.constant or not parts:
+            parts.append(f"{self.constant:+d}")
+        text = ''.join(parts)
+        return text[1:] if text.startswith('+') else text
+
+    @property
+    def dice_count(self):
+        return sum(term.count for _, term in self.terms)
+
+    def roll(self, rng: Optional[random.Random] = None, seed: Optional[int] = None) -> dict:
+        # Single roll: {'rolls': faces in roll order, 'total': int}
+        rng = rng or random.Random(seed)
+        total = self.constant
+        rolls = []
+        for sign, term in self.terms:
+            value, faces = term.roll(rng)
+            total += sign * value
+            rolls.extend(faces)
+        return {'rolls': rolls, 'total': total}
+
+    def sample(self, n: int, seed: Optional[int] = None, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        # n trials evaluated with one NumPy draw per term; int64 totals
+        rng = rng if rng is not None else np.random.default_rng(seed)
+        totals = np.full(n, self.constant, dtype=np.int64)
+        for sign, term in self.terms:
+            totals += sign * term.sample(n, rng)
+        return totals
+
+
+_TOKEN = re.compile(r'(?P<sign>[+-])?(?:(?P<count>\d*)d(?P<sides>\d+|%)(?P<mods>(?:!|k[hl]\d*|d[hl]\d*|adv|dis)*)|(?P<const>\d+))')
+_MOD = re.compile(r'!|k[hl]\d*|d[hl]\d*|adv|dis')
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', '', str(text)).lower()
+
+
+@lru_cache(maxsize=1024)
+def _compile(text: str) -> DiceExpression:
+    if not text:
+        raise DiceError("Empty dice expression")
+    terms = []
+    constant = 0
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None or match.end() == pos or (pos > 0 and match.group('sign') is None):
+            raise DiceError(f"Invalid dice expression: {text!r}")
+        sign = -1 if match.group('sign') == '-' else 1
+        if match.group('const') is not None:
+            constant += sign * int(match.group('const'))
+        else:
+            terms.append((sign, _dice_term(match)))
+        pos = match.end()
+    return DiceExpression(tuple(terms), constant)
+
+
+def _dice_term(match) -> DiceTerm:
+    count = int(match.group('count')) if match.group('count') else 1
+    sides = 100 if match.group('sides') == '%' else int(match.group('sides'))
+    if not 1 <= count <= MAX_DICE_PER_TERM:
+        raise DiceError(f"Dice count must be between 1 and {MAX_DICE_PER_TERM}")
+    if not 1 <= sides <= MAX_SIDES:
+        raise DiceError(f"Die sides must be between 1 and {MAX_SIDES}")
+    explode = False
+    keep = None
+    for mod in _MOD.findall(match.group('mods') or ''):
+        if mod == '!':
+            if sides == 1:
+                raise DiceError("A d1 cannot explode")
+            explode = True
+        elif mod in ('adv', 'dis'):
+            if count != 1:
+                raise DiceError("Advantage/disadvantage applies to a single die")
+            count, keep = 2, ('h' if mod == 'adv' else 'l', 1)
+        else:
+            n = int(mod[2:]) if len(mod) > 2 else 1
+            if mod[0] == 'd':
+                # Dropping the highest N is keeping the lowest count - N
+                n, mode = count - n, ('l' if mod[1] == 'h' else 'h')
+            else:
+                mode = mod[1]
+            if not 1 <= n <= count:
+                raise DiceError("Keep/drop must leave between 1 and all of the dice")
+            keep = (mode, n) if n < count else None
+    return DiceTerm(count, sides, explode, keep)
+
+
+def compile_expression(text: str) -> DiceExpression:
+    return _compile(normalize(text))
+
+
+def summarize(totals: np.ndarray) -> dict:
+    # Distribution summary of sampled totals
+    values, counts = np.unique(totals, return_counts=True)
+    p5, p25, p50, p75, p95 = np.percentile(totals, [5, 25, 50, 75, 95])
+    return {
+        'mean': float(totals.mean()),
+        'std': float(totals.std()),
+        'min': int(values[0]),
+        'max': int(values[-1]),
+        'percentiles': {'5': float(p5), '25': float(p25), '50': float(p50), '75': float(p75), '95': float(p95)},
+        'histogram': {str(int(v)): int(c) for v, c in zip(values, counts)},
+    }
+
+
+# --- Exact distributions -------------------------------------------------
+
+class Distribution(NamedTuple):
+    # probs[i] is P(total == offset + i)
+    offset: int
+    probs: np.ndarray
+
+    @property
+    def values(self) -> np.ndarray:
+        return np.arange(self.offset, self.offset + len(self.probs))
+
+    def mean(self) -> float:
+        return float(self.values @ self.probs)
+
+    def prob_at_least(self, target: int) -> float:
+        index = target - self.offset
+        if index <= 0:
+            return 1.0
+        if index >= len(self.probs):
+            return 0.0
+        return float(min(1.0, self.probs[index:].sum()))
+
+    def as_dict(self) -> Dict[int, float]:
+        return {int(v): float(p) for v, p in zip(self.values, self.probs) if p > 0}
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if min(len(a), len(b)) < FFT_MIN_SIZE:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    out = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    return np.clip(out, 0.0, None)
+
+
+def _add(x: Distribution, y: Distribution) -> Distribution:
+    return Distribution(x.offset + y.offset, _convolve(x.probs, y.probs))
+
+
+def _power(d: Distribution, n: int) -> Distribution:
+    # n-fold sum of independent copies, by repeated squaring
+    result = Distribution(0, np.ones(1))
+    while n:
+        if n & 1:
+            result = _add(result, d)
+        n >>= 1
+        if n:
+            d = _add(d, d)
+    return result
+
+
+def _die(sides: int, explode: bool) -> Distribution:
+    # One die, matching DiceTerm.roll/sample exactly (explosions capped at
+    # MAX_EXPLOSIONS, after which the last face is kept as rolled)
+    if not explode:
+        return Distribution(1, np.full(sides, 1.0 / sides))
+    probs = np.zeros((MAX_EXPLOSIONS + 1) * sides)
+    for k in range(MAX_EXPLOSIONS):
+        # k max faces, then a non-max face r: value k*sides + r
+        probs[k * sides:k * sides + sides - 1] = sides ** -(k + 1.0)
+    probs[MAX_EXPLOSIONS * sides:] = sides ** -(MAX_EXPLOSIONS + 1.0)
+    return Distribution(1, probs)
+
+
+def _keep(die: Distribution, count: int, keep: Tuple[str, int]) -> Distribution:
+    # Exact PMF of the sum of the kept dice. Faces are visited best-first
+    # (highest for 'h'); choosing c of the remaining dice to show a face has
+    # weight C(remaining, c) p^c, and the first k dice placed are the kept ones.
+    mode, k = keep
+    faces = [(int(v), float(p)) for v, p in zip(die.values, die.probs) if p > 0]
+    if mode == 'h':
+        faces.reverse()
+    max_sum = k * faces[0][0] if mode == 'h' else k * die.values[-1]
+    if len(faces) * count * count * (max_sum + 1) > MAX_KEEP_DP_WORK:
+        raise DiceError("Expression is too large for an exact distribution")
+    dp = np.zeros((count + 1, max_sum + 1))
+    dp[0, 0] = 1.0
+    for value, p in faces:
+        nxt = np.zeros_like(dp)
+        for placed in range(count + 1):
+            row = dp[placed]
+            if not row.any():
+                continue
+            for c in range(count - placed + 1):
+                weight = comb(count - placed, c) * p ** c
+                if weight == 0.0:
+                    break
+                shift = min(c, max(0, k - placed)) * value
+                nxt[placed + c, shift:] += weight * row[:max_sum + 1 - shift]
+        dp = nxt
+    probs = dp[count]
+    return Distribution(0, probs)
+
+
+def _trim(d: Distribution) -> Distribution:
+    nonzero = np.flatnonzero(d.probs > 0)
+    if nonzero.size == 0:
+        return Distribution(0, np.ones(1))
+    return Distribution(d.offset + int(nonzero[0]), d.probs[nonzero[0]:nonzero[-1] + 1])
+
+
+def term_distribution(term: DiceTerm) -> Distribution:
+    die = _die(term.sides, term.explode)
+    if term.keep is None:
+        return _trim(_power(die, term.count))
+    return _trim(_keep(die, term.count, term.keep))
+
+
+def _negate(d: Distribution) -> Distribution:
+    return Distribution(-(d.offset + len(d.probs) - 1), d.probs[::-1].copy())
+
+
+def _support(term: DiceTerm) -> int:
+    # Length of a term's distribution (its possible totals, before trimming)
+    faces = term.sides * (MAX_EXPLOSIONS + 1) if term.explode else term.sides
+    return term.kept * (faces - 1) + 1
+
+
+def _distribution(expr: DiceExpression, skip: Optional[int] = None) -> Distribution:
+    # Sum of every term (except terms[skip]) plus the constant
+    if sum(_support(term) for _, term in expr.terms) > MAX_PMF_SUPPORT:
+        raise DiceError("Expression is too large for an exact distribution")
+    total = Distribution(expr.constant, np.ones(1))
+    for i, (sign, term) in enumerate(expr.terms):
+        if i == skip:
+            continue
+        d = term_distribution(term)
+        total = _add(total, d if sign > 0 else _negate(d))
+    return total
+
+
+# Flat dict caches: a repeat lookup of the same expression text is one dict hit.
+# The PMF cache is bounded by the bytes of its arrays as well as its entries.
+_pmf_cache: Dict[str, Distribution] = {}
+_pmf_cache_bytes = 0
+_pmf_lock = threading.Lock()
+_odds_cache: Dict[Tuple[str, int], float] = {}
+
+
+def _remember(cache, key, value):
+    if len(cache) >= PMF_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+    return value
+
+
+def _remember_pmf(key, d: Distribution) -> Distribution:
+    # Oldest first out, until the new entry fits both bounds; a PMF larger
+    # than the whole byte budget is not cached at all
+    global _pmf_cache_bytes
+    if d.probs.nbytes > PMF_CACHE_BYTES:
+        return d
+    with _pmf_lock:
+        old = _pmf_cache.pop(key, None)
+        if old is not None:
+            _pmf_cache_bytes -= old.probs.nbytes
+        while _pmf_cache and (len(_pmf_cache) >= PMF_CACHE_SIZE
+                              or _pmf_cache_bytes + d.probs.nbytes > PMF_CACHE_BYTES):
+            _pmf_cache_bytes -= _pmf_cache.pop(next(iter(_pmf_cache))).probs.nbytes
+        _pmf_cache[key] = d
+        _pmf_cache_bytes += d.probs.nbytes
+    return d
+
+
+def pmf(text: str) -> Distribution:
+    # Exact distribution of an expression's total
+    cached = _pmf_cache.get(text)
+    if cached is not None:
+        return cached
+    key = normalize(text)
+    cached = _pmf_cache.get(key)
+    if cached is None:
+        d = _distribution(_compile(key))
+        d.probs.flags.writeable = False
+        cached = _remember_pmf(key, d)
+    return cached if text == key else _remember_pmf(text, cached)
+
+
+def _natural_d20(expr: DiceExpression) -> Optional[int]:
+    # Index of the d20 term whose face is "natural" for check rules: a lone,
+    # non-exploding, added 1d20 (optionally with advantage/disadvantage)
+    d20 = [i for i, (sign, term) in enumerate(expr.terms) if term.sides == 20]
+    if len(d20) != 1:
+        return None
+    sign, term = expr.terms[d20[0]]
+    if sign < 0 or term.explode or term.kept != 1:
+        return None
+    return d20[0]
+
+
+def success_probability(text: str, dc: int) -> float:
+    # P(check succeeds) scored like Engine.skill_check: a natural 1 always
+    # fails and a natural 20 always succeeds; otherwise total >= dc
+    cached = _odds_cache.get((text, dc))
+    if cached is not None:
+        return cached
+    key = normalize(text)
+    cached = _odds_cache.get((key, dc))
+    if cached is None:
+        expr = _compile(key)
+        index = _natural_d20(expr)
+        if index is None:
+            cached = pmf(key).prob_at_least(dc)
+        else:
+            natural = term_distribution(expr.terms[index][1])
+            rest = _distribution(expr, skip=index)
+            cached = 0.0
+            for face, p in zip(natural.values, natural.probs):
+                if face == 20:
+                    cached += p
+                elif face != 1:
+                    cached += p * rest.prob_at_least(dc - int(face))
+            cached = float(cached)
+        _remember(_odds_cache, (key, dc), cached)
+    return _remember(_odds_cache, (text, dc), cached)
+
+
+def check_probability(modifier: int, dc: int, advantage: Optional[str] = None) -> float:
+    # Chance a d20 + modifier check beats dc; advantage is 'adv', 'dis' or None
+    return success_probability(f"1d20{advantage or ''}{modifier:+d}", dc)
@@ -1,56 +1,239 @@
 import random
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Sequence
+
+import numpy as np
+
+from backend.dice import compile_expression, check_probability
+from backend.initiative import InitiativeTracker
+
+def resolve_checks(rolls, modifiers, dc):
+    # d20 checks: natural 1 always fails and natural 20 always succeeds.
+    # Arrays broadcast, so one call can resolve a whole group or many trials.
+    # Returns (totals, results).
+    totals = rolls + modifiers
+    return totals, (rolls == 20) | ((rolls != 1) & (totals >= dc))
+
+
+class CombatantTable:
+    # Struct-of-arrays store for combatants: one NumPy column per field, so a
+    # whole group can be checked in a single vectorized pass. Characters are
+    # thin views (table, row) onto it. Columns grow by doubling.
+    INITIAL_CAPACITY = 8
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        capacity = max(1, capacity)
+        self.names: List[str] = []
+        self.modifier = np.zeros(capacity, dtype=np.int32)
+        self.initiative = np.zeros(capacity, dtype=np.int32)
+        self.has_initiative = np.zeros(capacity, dtype=bool)
+        self.last_roll = np.zeros(capacity, dtype=np.int16)  # 0 = no check yet
+        self.last_total = np.zeros(capacity, dtype=np.int32)
+        self.last_result = np.zeros(capacity, dtype=bool)
+
+    _COLUMNS = ('modifier', 'initiative', 'has_initiative', 'last_roll', 'last_total', 'last_result')
+
+    def __len__(self):
+        return len(self.names)
+
+    def _reserve(self, extra: int):
+        needed = len(self.names) + extra
+        capacity = len(self.modifier)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for column in self._COLUMNS:
+            old = getattr(self, column)
+            grown = np.zeros(capacity, dtype=old.dtype)
+            grown[:len(self.names)] = old[:len(self.names)]
+            setattr(self, column, grown)
+
+    def append(self, name: str, modifier: int = 0) -> int:
+        self._reserve(1)
+        row = len(self.names)
+        self.names.append(name)
+        self.modifier[row] = modifier
+        return row
+
+    def extend(self, names: List[str], modifiers) -> List['Character']:
+        # Bulk-add rows and return their views
+        self._reserve(len(names))
+        start = len(self.names)
+        self.names.extend(names)
+        self.modifier[start:len(self.names)] = modifiers
+        return [Character._view(self, row) for row in range(start, len(self.names))]
+
+    def adopt(self, char: 'Character'):
+        # Move a character (and its state) into this table; no-op if already here
+        if char._table is self:
+            return
+        old, old_row = char._table, char._row
+        row = self.append(old.names[old_row])
+        for column in self._COLUMNS:
+            getattr(self, column)[row] = getattr(old, column)[old_row]
+        char._table, char._row = self, row
+
+    def check(self, rows: np.ndarray, dc: int, rolls: np.ndarray) -> np.ndarray:
+        totals, results = resolve_checks(rolls, self.modifier[rows], dc)
+        self.last_roll[rows] = rolls
+        self.last_total[rows] = totals
+        self.last_result[rows] = results
+        return results
+
+    def check_result(self, row: int) -> Optional[Dict]:
+        roll = int(self.last_roll[row])
+        if roll == 0:
+            return None
+        total = int(self.last_total[row])
+        result = bool(self.last_result[row])
+        if roll == 1:
+            desc = 'Automatic fail'
+        elif roll == 20:
+            desc = 'Automatic success'
+        else:
+            desc = 'Success' if result else 'Failure'
+        return {'roll': roll, 'modifier': total - roll, 'total': total, 'result': result, 'desc': desc}
+
 
 class Character:
+    # A view onto one CombatantTable row. A standalone Character gets a
+    # one-row table of its own; Engine adopts it into the shared table.
+    __slots__ = ('_table', '_row')
+
     def __init__(self, name: str, modifier: int = 0):
-        self.name = name
-        self.modifier = modifier
-        self.initiative: Optional[int] = None
-        self.last_check_result: Optional[Dict] = None
+        self._table = CombatantTable(1)
+        self._row = self._table.append(name, modifier)
+
+    @classmethod
+    def _view(cls, table: CombatantTable, row: int) -> 'Character':
+        char = cls.__new__(cls)
+        char._table, char._row = table, row
+        return char
+
+    @property
+    def name(self) -> str:
+        return self._table.names[self._row]
+
+    @name.setter
+    def name(self, value: str):
+        self._table.names[self._row] = value
+
+    @property
+    def modifier(self) -> int:
+        return int(self._table.modifier[self._row])
+
+    @modifier.setter
+    def modifier(self, value: int):
+        self._table.modifier[self._row] = value
+
+    @property
+    def initiative(self) -> Optional[int]:
+        if not self._table.has_initiative[self._row]:
+            return None
+        return int(self._table.initiative[self._row])
+
+    @initiative.setter
+    def initiative(self, value: Optional[int]):
+        self._table.has_initiative[self._row] = value is not None
+        self._table.initiative[self._row] = value or 0
+
+    @property
+    def last_check_result(self) -> Optional[Dict]:
+        return self._table.check_result(self._row)
+
+    @last_check_result.setter
+    def last_check_result(self, value: Optional[Dict]):
+        table, row = self._table, self._row
+        table.last_roll[row] = value['roll'] if value else 0
+        table.last_total[row] = value['total'] if value else 0
+        table.last_result[row] = bool(value['result']) if value else False
 
 class Engine:
     def __init__(self, characters: List[Character]):
         self.characters = characters
-        self.initiative_order: List[Character] = []
+        self.table = CombatantTable(len(characters))
+        for c in characters:
+            self.table.adopt(c)
+        self.tracker = InitiativeTracker()
         self.turn_index = 0
         self.state_log = []
 
+    @property
+    def initiative_order(self) -> List[Character]:
+        return list(self.tracker)
+
+    @initiative_order.setter
+    def initiative_order(self, order: List[Character]):
+        self.tracker = InitiativeTracker(order)
+
     def assign_initiative(self, seed: Optional[int] = None):
         rng = random.Random(seed)
         for c in self.characters:
             c.initiative = rng.randint(1, 20) + c.modifier
-        self.initiative_order = sorted(self.characters, key=lambda c: (-c.initiative, c.name))
+        self.tracker = InitiativeTracker(self.characters)
+        self.turn_index = 0
 
     def next_turn(self) -> Character:
-        char = self.initiative_order[self.turn_index % len(self.initiative_order)]
+        char = self.tracker.next_turn()
         self.turn_index += 1
         return char
 
+    def add_combatant(self, char: Character, initiative: Optional[int] = None, seed: Optional[int] = None):
+        # Join mid-fight (summons, reinforcements) without disturbing the turn cursor
+        if initiative is None:
+            initiative = random.Random(seed).randint(1, 20) + char.modifier
+        self.table.adopt(char)
+        self.characters.append(char)
+        self.tracker.join(char, initiative)
+
+    def spawn(self, name: str, count: int, modifier: int = 0) -> List[Character]:
+        # Add `count` identical combatants to the roster in one bulk append
+        group = self.table.extend([f"{name} {i + 1}" for i in range(count)], modifier)
+        self.characters.extend(group)
+        return group
+
+    def remove_combatant(self, char: Character):
+        # Leaves the initiative order; the character stays in self.characters (the roster)
+        self.tracker.leave(char)
+
+    def delay_combatant(self, char: Character, initiative: int):
+        self.tracker.delay(char, initiative)
+
     def skill_check(self, char: Character, dc: int, roll: Optional[int] = None) -> bool:
         if roll is None:
             roll = random.randint(1, 20)
-        total = roll + char.modifier
-        if roll == 1:
-            result = False
-            desc = 'Automatic fail'
-        elif roll == 20:
-            result = True
-            desc = 'Automatic success'
-        else:
-            result = total >= dc
-            desc = 'Success' if result else 'Failure'
-        char.last_check_result = {'roll': roll, 'modifier': char.modifier, 'total': total, 'result': result, 'desc': desc}
-        return result
+        self.table.adopt(char)
+        return bool(self.table.check(np.array([char._row]), dc, np.array([roll]))[0])
+
+    def group_skill_check(self, chars: Sequence[Character], dc: int, rolls=None,
+                          seed: Optional[int] = None) -> np.ndarray:
+        # One vectorized check for a whole group (e.g. 200 goblins making a
+        # DC 13 save); returns a boolean array aligned with chars
+        for c in chars:
+            if c._table is not self.table:
+                self.table.adopt(c)
+        rows = np.fromiter((c._row for c in chars), dtype=np.intp, count=len(chars))
+        if rolls is None:
+            rolls = np.random.default_rng(seed).integers(1, 21, size=len(rows))
+        return self.table.check(rows, dc, np.asarray(rolls, dtype=np.int32))
 
     def roll_dice(self, dice: str, modifier: int = 0, seed: Optional[int] = None) -> Dict:
-        rng = random.Random(seed)
-        num, die = map(int, dice.lower().split('d'))
-        rolls = [rng.randint(1, die) for _ in range(num)]
-        return {'rolls': rolls, 'total': sum(rolls) + modifier}
+        # Accepts the full dice grammar (see backend.dice), e.g. '4d6kh3+2'
+        result = compile_expression(dice).roll(seed=seed)
+        result['total'] += modifier
+        return result
+
+    def roll_dice_bulk(self, dice: str, trials: int, modifier: int = 0, seed: Optional[int] = None):
+        # Totals for `trials` independent rolls, drawn in one vectorized pass
+        return compile_expression(dice).sample(trials, seed=seed) + modifier
+
+    def success_chance(self, char: Character, dc: int, advantage: Optional[str] = None) -> float:
+        # Exact odds that skill_check(char, dc) succeeds; advantage is 'adv', 'dis' or None
+        return check_probability(char.modifier, dc, advantage)
 
     def format_gpt_prompt(self) -> str:
-        order = ', '.join(f'{c.name}({c.initiative})' for c in self.initiative_order)
-        current = self.initiative_order[self.turn_index % len(self.initiative_order)]
+        order = ', '.join(f'{c.name}({c.initiative})' for c in self.tracker)
+        current = self.tracker.current()
         last = getattr(current, 'last_check_result', None)
         outcome = f"{current.name}: {last}" if last else "No action yet"
         return f"Initiative: {order}\nCurrent: {current.name}\nOutcome: {outcome}"
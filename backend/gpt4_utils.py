@@ -1,24 +1,244 @@
 # gpt4_utils.py
 
+import asyncio
+import json
 import os
+import random
+import re
+import threading
+import time
 import openai
+import httpx
 
 def format_prompt(character_sheet, memory, player_input):
     prompt = f"Character: {character_sheet}\nMemory: {memory}\nPlayer: {player_input}"
     return prompt
 
+NO_RULES_FALLBACK = "No relevant rules found."
+
+def format_prompt_with_rules(character_sheet, memory, player_input, rule_chunks):
+    # Prepend retrieved rule chunks (e.g. one row of retrieve_rules) to the prompt
+    rules = "\n".join(rule_chunks) if rule_chunks else NO_RULES_FALLBACK
+    return f"Rules:\n{rules}\n---\n" + format_prompt(character_sheet, memory, player_input)
+
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+def _openai_client(api_key):
+    # One v1 client (and connection pool) per key and base URL, rather than
+    # rebinding the global openai.api_key
+    base_url = os.environ.get("OPENAI_BASE_URL") or None
+    with _openai_clients_lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = _openai_clients[(api_key, base_url)] = openai.OpenAI(api_key=api_key, base_url=base_url)
+        return client
+
 def call_gpt4_api(prompt):
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY environment variable not set.")
-    openai.api_key = api_key
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
+    response = _openai_client(api_key).chat.completions.create(
         messages=[{"role": "system", "content": prompt}],
-        max_tokens=256,
-        temperature=0.7
+        **model_params()
     )
-    return response['choices'][0]['message']['content']
+    return response.choices[0].message.content
+
+def model_params():
+    # Settings of every real GM completion, which the response cache also
+    # keys on; OPENAI_MODEL swaps the model
+    return {'model': os.environ.get("OPENAI_MODEL") or DEFAULT_MODEL, 'max_tokens': 256, 'temperature': 0.7}
+
+def call_gpt4_api_cached(prompt, universe_id=None, embedder=None, cache=None):
+    # call_gpt4_api behind the response cache, namespaced per universe; pass
+    # an embedder (e.g. vectorizer_embedder) to enable similarity reuse
+    from backend.response_cache import get_response_cache
+    if cache is None:
+        cache = get_response_cache()
+    return cache.get_or_call(prompt, call_gpt4_api, namespace=universe_id, embedder=embedder, **model_params())
+
+# --- Async client ---
+# One httpx connection pool per event loop, a semaphore bounding in-flight
+# requests, and retries with full-jitter exponential backoff on 429/5xx and
+# transport errors. Speaks the OpenAI chat completions wire format, so
+# OPENAI_BASE_URL can point it at a local stub or a compatible proxy.
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_MODEL = "gpt-4"
+MAX_CONCURRENCY = 16
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class GPT4APIError(RuntimeError):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class AsyncGPT4Client:
+    def __init__(self, api_key=None, base_url=None, max_concurrency=MAX_CONCURRENCY, timeout=30.0,
+                 connect_timeout=5.0, max_retries=3, backoff=0.5, max_backoff=8.0, transport=None):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        if not self.api_key:
+            raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+        self.base_url = (base_url or os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    @property
+    def closed(self):
+        return self._http.is_closed
+
+    def _delay(self, attempt, retry_after=None):
+        # Honour a numeric Retry-After, else full jitter on a capped exponential
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.max_backoff)
+        except ValueError:
+            pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _post(self, path, payload):
+        # The semaphore bounds requests on the wire; a backoff sleep releases
+        # it so retries don't hold fresh requests back
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            async with self._semaphore:
+                try:
+                    response = await self._http.post(path, json=payload)
+                except httpx.TransportError as e:  # includes timeouts
+                    if last:
+                        raise GPT4APIError(f"Request failed: {e}") from e
+                    response = None
+            if response is None:
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and not last:
+                await asyncio.sleep(self._delay(attempt, response.headers.get("retry-after")))
+                continue
+            if response.status_code >= 400:
+                raise GPT4APIError(f"API returned {response.status_code}", status=response.status_code)
+            return response.json()
+
+    async def complete(self, prompt, model=DEFAULT_MODEL, max_tokens=256, temperature=0.7):
+        data = await self._post("/chat/completions", {
+            "model": model,
+            "messages": [{"role": "system", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        })
+        return data['choices'][0]['message']['content']
+
+_async_clients = {}
+_closing = set()
+
+async def _close_quietly(client):
+    try:
+        await client.aclose()
+    except Exception:  # its connections belonged to a loop that is gone
+        pass
+
+def get_async_client(**kwargs):
+    # Shared client per running event loop (pools cannot cross loops) and per
+    # AsyncGPT4Client settings; clients of closed loops are closed here
+    loop = asyncio.get_running_loop()
+    key = (loop, tuple(sorted(kwargs.items())))
+    client = _async_clients.get(key)
+    if client is None or client.closed:
+        for stale in [k for k in _async_clients if k[0].is_closed()]:
+            task = loop.create_task(_close_quietly(_async_clients.pop(stale)))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+        client = _async_clients[key] = AsyncGPT4Client(**kwargs)
+    return client
+
+async def call_gpt4_api_async(prompt, **kwargs):
+    return await get_async_client().complete(prompt, **kwargs)
+
+# --- Streaming ---
+# Token streams for the SSE chat endpoint. stream_gpt4_api reads the
+# model's server-sent deltas over a shared sync connection pool;
+# fake_stream is an offline stand-in for dev and tests.
+
+_sync_http = None
+_sync_http_lock = threading.Lock()
+
+def _stream_client(base_url):
+    global _sync_http
+    with _sync_http_lock:
+        if _sync_http is None or _sync_http.is_closed or str(_sync_http.base_url).rstrip('/') != base_url:
+            if _sync_http is not None:
+                _sync_http.close()
+            _sync_http = httpx.Client(base_url=base_url, timeout=httpx.Timeout(30.0, connect=5.0))
+        return _sync_http
+
+def stream_gpt4_api(prompt, **settings):
+    # settings override model_params() (model, max_tokens, temperature)
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+    base_url = (os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip('/')
+    payload = {
+        **model_params(),
+        **settings,
+        "messages": [{"role": "system", "content": prompt}],
+        "stream": True,
+    }
+    with _stream_client(base_url).stream("POST", "/chat/completions", json=payload,
+                                         headers={"Authorization": f"Bearer {api_key}"}) as response:
+        if response.status_code >= 400:
+            raise GPT4APIError(f"API returned {response.status_code}", status=response.status_code)
+        for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get('choices') or [{}]
+            token = (choices[0].get('delta') or {}).get('content')
+            if token:
+                yield token
+
+def fake_stream(prompt, delay=0.0):
+    # Echoes the player's line back word by word, like the frontend placeholder
+    player = prompt.rsplit("Player: ", 1)[-1]
+    for token in re.findall(r"\S+\s*", f"AI says: {player}"):
+        if delay:
+            time.sleep(delay)
+        yield token
+
+STREAMERS = {'openai': stream_gpt4_api, 'fake': fake_stream}
+
+def get_streamer(name=None):
+    # GM_MODEL picks the streamer; without an API key we fall back to the fake
+    name = name or os.environ.get("GM_MODEL") or ('openai' if os.environ.get("OPENAI_API_KEY") else 'fake')
+    if name not in STREAMERS:
+        raise ValueError(f"Unknown GM model streamer: {name}")
+    return STREAMERS[name]
+
+def streamer_params(streamer):
+    # Response-cache params for a streamer's replies: the real model's
+    # settings, shared with call_gpt4_api_cached, or a stand-in's own name
+    if streamer is stream_gpt4_api:
+        return model_params()
+    return {'model': getattr(streamer, '__name__', 'gm')}
 
 def truncate_memory(memory, max_messages=5):
     return memory[-max_messages:]
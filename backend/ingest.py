@@ -0,0 +1,136 @@
+# Streaming rulebook ingestion: block copy -> page generator -> chunks
+from backend.utils_embedding import chunk_text
+
+COPY_BLOCK_SIZE = 64 * 1024
+CHUNK_WORDS = 200
+CHUNK_BATCH_SIZE = 256
+
+
+def copy_upload(stream, dest, block_size=COPY_BLOCK_SIZE, hasher=None):
+    # Copy an upload stream to an open file in fixed-size blocks, optionally
+    # feeding each block to a hashlib hasher; returns bytes written
+    written = 0
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        dest.write(block)
+        if hasher is not None:
+            hasher.update(block)
+        written += len(block)
+    dest.flush()
+    return written
+
+
+def iter_pages(file_path, ext):
+    # Looked up on backend.utils at call time so tests can patch the parsers
+    from backend import utils
+    if ext == 'pdf':
+        return utils.iter_pdf_pages(file_path)
+    if ext == 'docx':
+        return utils.iter_docx_pages(file_path)
+    if ext == 'txt':
+        return utils.iter_txt_pages(file_path)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+
+def table_chunk(table):
+    rows = '; '.join(' '.join(str(cell) for cell in row) for row in table.get('rows', []))
+    return f"{table.get('name', 'Table')}: {rows}".strip()
+
+
+def section_title(block):
+    # First non-empty line of a section block, as stored in RulebookSection.title
+    for line in block.splitlines():
+        if line.strip():
+            return line.strip()[:255]
+    return None
+
+
+def page_chunks(page, chunk_size=CHUNK_WORDS):
+    # Chunk records for one page: {'text', 'section', 'kind'}. Text is split
+    # into section blocks first so every chunk belongs to exactly one section.
+    from backend.utils import SECTION_SPLIT
+    text = page.get('text', page.get('rules')) or ''
+    chunks = []
+    if isinstance(text, str):
+        for block in SECTION_SPLIT.split(text):
+            if not block.strip():
+                continue
+            title = section_title(block)
+            chunks.extend({'text': c, 'section': title, 'kind': 'text'} for c in chunk_text(block, chunk_size=chunk_size))
+    for table in page.get('tables') or []:
+        chunks.append({'text': table_chunk(table), 'section': (table.get('name') or None), 'kind': 'table'})
+    return chunks
+
+
+def chunk_texts(chunks):
+    return [c['text'] for c in chunks]
+
+
+def chunk_metadata(chunks):
+    # Per-chunk metadata columns for the vector store
+    return [{'section': c.get('section'), 'kind': c.get('kind') or 'text'} for c in chunks]
+
+
+def ingest_pages(pages, on_chunks=None, batch_size=CHUNK_BATCH_SIZE):
+    # Consume pages one at a time, handing chunk records to on_chunks in
+    # batches of batch_size. Returns the merged parse result and chunk count.
+    result = {}
+    text_parts = {}
+    pending = []
+    chunk_count = 0
+    for page in pages:
+        if not isinstance(page, dict):
+            continue
+        for key, value in page.items():
+            if key in ('text', 'rules'):
+                if isinstance(value, str):
+                    text_parts.setdefault(key, []).append(value)
+            elif key in ('sections', 'tables'):
+                result.setdefault(key, []).extend(value or [])
+            else:
+                result.setdefault(key, value)
+        pending.extend(page_chunks(page))
+        while len(pending) >= batch_size:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            chunk_count += len(batch)
+            if on_chunks is not None:
+                on_chunks(batch)
+    if pending:
+        chunk_count += len(pending)
+        if on_chunks is not None:
+            on_chunks(pending)
+    for key, parts in text_parts.items():
+        result[key] = ''.join(parts)
+    return result, chunk_count
+
+
+def build_response(result):
+    # Normalize a merged parse result into the upload response shape.
+    # Returns None when text, sections and tables are all empty.
+    if not isinstance(result, dict):
+        return None
+    text_val = result.get('text', '')
+    sections_val = result.get('sections', [])
+    tables_val = result.get('tables', [])
+    has_text = isinstance(text_val, str) and text_val.strip() != ''
+    has_sections = isinstance(sections_val, list) and len(sections_val) > 0
+    has_tables = isinstance(tables_val, list) and len(tables_val) > 0
+    if not (has_text or has_sections or has_tables):
+        return None
+    response = dict(result)
+    if 'text' in result and 'rules' not in response:
+        response['rules'] = result['text']
+    response.setdefault('rules', '')
+    response.setdefault('sections', [])
+    response.setdefault('tables', [])
+    return response
+
+
+def parse_error(exc):
+    # Map a parser exception to (error message, HTTP status)
+    msg = str(exc).lower()
+    if 'encrypted' in msg or 'locked' in msg:
+        return 'PDF is encrypted or locked', 400
+    return 'An internal error has occurred', 500
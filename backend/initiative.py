@@ -0,0 +1,95 @@
+# Initiative queue for large battles
+#
+# Combatants are kept in a SortedList keyed by (-initiative, name, seq), the
+# same ordering Engine has always used, with a join sequence number so
+# duplicate names (a pile of "Goblin" tokens) stay distinct. The turn cursor
+# is the key of the last combatant to act rather than a list index, so joins,
+# removals and delays are O(log n) and never shift whose turn is next.
+import itertools
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from sortedcontainers import SortedList
+
+Key = Tuple[int, str, int]
+
+
+def turn_key(initiative: int, name: str, seq: int) -> Key:
+    # Highest initiative first, then name, then join order
+    return (-initiative, name, seq)
+
+
+def turn_order(initiatives: np.ndarray, names: Sequence[str]) -> np.ndarray:
+    # turn_key ordering for many fights at once: initiatives is (trials, n)
+    # with columns in join order; returns each row's column indexes in turn
+    # order
+    n = len(names)
+    tiebreak = np.empty(n, dtype=np.int64)
+    tiebreak[sorted(range(n), key=lambda i: turn_key(0, names[i], i))] = np.arange(n)
+    return np.lexsort((np.broadcast_to(tiebreak, initiatives.shape), -initiatives), axis=-1)
+
+
+class InitiativeTracker:
+    def __init__(self, combatants: Iterable = ()):
+        self._order = SortedList()
+        self._keys: Dict[int, Key] = {}  # id(combatant) -> key
+        self._by_key: Dict[Key, object] = {}
+        self._seq = itertools.count()
+        self._last: Optional[Key] = None  # key of the last combatant to act
+        self.round = 1
+        for c in combatants:
+            self.join(c)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self) -> Iterator:
+        return (self._by_key[k] for k in self._order)
+
+    def __contains__(self, combatant):
+        return id(combatant) in self._keys
+
+    def join(self, combatant, initiative: Optional[int] = None):
+        # Add a combatant; one sorting ahead of the cursor acts next round
+        if initiative is not None:
+            combatant.initiative = initiative
+        if combatant.initiative is None:
+            raise ValueError(f"{combatant.name} has no initiative")
+        if id(combatant) in self._keys:
+            raise ValueError(f"{combatant.name} is already in the initiative order")
+        key = turn_key(combatant.initiative, combatant.name, next(self._seq))
+        self._keys[id(combatant)] = key
+        self._by_key[key] = combatant
+        self._order.add(key)
+
+    def leave(self, combatant):
+        key = self._keys.pop(id(combatant))
+        del self._by_key[key]
+        self._order.remove(key)
+
+    def delay(self, combatant, initiative: int):
+        # Move a combatant to a new initiative count (e.g. a readied or delayed action)
+        self.leave(combatant)
+        self.join(combatant, initiative)
+
+    def _next_index(self) -> int:
+        if self._last is None:
+            return 0
+        return self._order.bisect_right(self._last)
+
+    def current(self):
+        # The combatant whose turn is next, without advancing
+        if not self._order:
+            return None
+        index = self._next_index()
+        return self._by_key[self._order[index if index < len(self._order) else 0]]
+
+    def next_turn(self):
+        if not self._order:
+            raise IndexError("No combatants in the initiative order")
+        index = self._next_index()
+        if index >= len(self._order):
+            index = 0
+            self.round += 1
+        self._last = self._order[index]
+        return self._by_key[self._last]
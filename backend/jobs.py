@@ -0,0 +1,215 @@
+# Background rulebook ingestion (parse -> chunk -> embed) on a local process pool
+#
+# Job status lives in one small JSON file per job under the jobs directory,
+# so any gunicorn worker can answer a status poll, not just the one that
+# accepted the upload. No external broker is needed. A job sees itself through
+# to the end inside its pool process, database write and index publish
+# included, so it does not depend on the accepting web worker surviving; a
+# job whose status stops moving for JOB_STALL_SECONDS is reported failed.
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from backend.ingest import copy_upload, iter_pages, ingest_pages, build_response, parse_error
+
+DEFAULT_JOBS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'instance', 'rulebook_jobs'))
+DEFAULT_WORKERS = 2
+JOB_TTL_SECONDS = 24 * 60 * 60
+JOB_STALL_SECONDS = 30 * 60
+IN_FLIGHT = ('queued', 'parsing', 'storing')
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def write_status(directory, job_id, **status):
+    status['job_id'] = job_id
+    status['updated_at'] = time.time()
+    fd, tmp = tempfile.mkstemp(prefix=f".{job_id}-", dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+    os.replace(tmp, os.path.join(directory, f"{job_id}.json"))
+
+
+def read_status(directory, job_id):
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    try:
+        with open(os.path.join(directory, f"{job_id}.json"), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+_worker_apps = {}
+
+
+def _worker_app(database_uri, cache_dir=None):
+    # Minimal app bound to the web app's database, one per pool process
+    app = _worker_apps.get((database_uri, cache_dir))
+    if app is None:
+        from flask import Flask
+        from backend.app import db
+        app = Flask(__name__)
+        app.config.update(SQLALCHEMY_DATABASE_URI=database_uri, SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                          RULEBOOK_CACHE_DIR=cache_dir)
+        db.init_app(app)
+        _worker_apps[(database_uri, cache_dir)] = app
+    return app
+
+
+def _store_upload(finalize, response, chunks, staged, index_root=None):
+    from backend.routes.upload_rulebook import persist_upload
+    with _worker_app(finalize['database_uri'], finalize.get('cache_dir')).app_context():
+        rulebook = persist_upload(finalize['filename'], finalize['digest'], response, chunks,
+                                  staged_index=staged, index_root=index_root)
+        return {'rulebook_id': rulebook.id}
+
+
+def summarize(response):
+    # What a status poll reports about a finished parse; the content itself
+    # is fetched from the stored rulebook (GET /rulebooks/<rulebook_id>)
+    return {'rpg_system': response.get('rpg_system'), 'sections': len(response.get('sections') or []),
+            'tables': len(response.get('tables') or []), 'characters': len(response.get('rules') or '')}
+
+
+def run_ingest_job(directory, job_id, path, ext, index_root=None, finalize=None):
+    # Runs inside a pool process and records every outcome in the status file.
+    # With finalize ({'database_uri', 'cache_dir', 'filename', 'digest'}) it
+    # also upserts the rulebook, its chunks and index before reporting done.
+    # Returns only the small final fields, never the chunks.
+    from backend.rulebook_index import ChunkIndexWriter
+    progress = {'pages': 0, 'chunks': 0}
+    # Chunks are embedded and spooled to disk as they are parsed, only when
+    # they will be stored
+    writer = ChunkIndexWriter(root=index_root) if finalize is not None else None
+
+    def on_chunks(batch):
+        if writer is not None:
+            writer.add(batch)
+        progress['chunks'] += len(batch)
+
+    def counted(pages):
+        for page in pages:
+            yield page
+            progress['pages'] += 1
+            write_status(directory, job_id, status='parsing', **progress)
+
+    try:
+        write_status(directory, job_id, status='parsing', **progress)
+        result, _ = ingest_pages(counted(iter_pages(path, ext)), on_chunks=on_chunks)
+        response = build_response(result)
+        if response is None:
+            write_status(directory, job_id, status='error', error='Empty parse result', http_status=400, **progress)
+            return None
+        extra = {}
+        if writer is not None:
+            write_status(directory, job_id, status='storing', **progress)
+            extra = _store_upload(finalize, response, writer.chunks(), writer.finish(), index_root=index_root)
+        write_status(directory, job_id, status='done', summary=summarize(response), **progress, **extra)
+        return extra
+    except Exception as e:
+        logging.error(str(e))
+        message, http_status = parse_error(e)
+        write_status(directory, job_id, status='error', error=message, http_status=http_status, **progress)
+        return None
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        # Spools and anything that was not published are discarded
+        if writer is not None:
+            writer.close()
+
+
+class JobQueue:
+    def __init__(self, directory=None, max_workers=None, stall_seconds=JOB_STALL_SECONDS):
+        self.directory = directory or os.environ.get("RULEBOOK_JOBS_DIR") or DEFAULT_JOBS_DIR
+        self.max_workers = max_workers or int(os.environ.get("RULEBOOK_JOB_WORKERS", DEFAULT_WORKERS))
+        self.stall_seconds = stall_seconds
+        os.makedirs(self.directory, exist_ok=True)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a threaded web worker
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def spool(self, stream, ext, hasher=None):
+        # Copy an upload into the jobs directory; returns the spooled path
+        fd, path = tempfile.mkstemp(prefix=".upload-", suffix='.' + ext, dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            copy_upload(stream, f, hasher=hasher)
+        return path
+
+    def submit_spooled(self, path, ext, index_root=None, finalize=None):
+        # Queue a spooled upload (the job deletes it) and return the job id at
+        # once; see run_ingest_job for finalize
+        self.prune()
+        job_id = uuid.uuid4().hex
+        write_status(self.directory, job_id, status='queued', pages=0, chunks=0)
+        future = self._pool().submit(run_ingest_job, self.directory, job_id, path, ext, index_root, finalize)
+        future.add_done_callback(lambda f: self._crashed(job_id, f))
+        return job_id
+
+    def _crashed(self, job_id, future):
+        # Only the pool process dying needs reporting from here;
+        # run_ingest_job records its own outcome
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(str(e))
+            write_status(self.directory, job_id, status='error', error='An internal error has occurred', http_status=500)
+
+    def status(self, job_id):
+        # An in-flight job nobody has advanced for stall_seconds lost its
+        # process (a recycled worker takes its pool with it): report it failed
+        status = read_status(self.directory, job_id)
+        if status and status.get('status') in IN_FLIGHT and time.time() - status.get('updated_at', 0) > self.stall_seconds:
+            logging.error(f"Upload job {job_id} stalled in {status['status']}")
+            write_status(self.directory, job_id, status='error', error='Job stalled', http_status=500,
+                         pages=status.get('pages', 0), chunks=status.get('chunks', 0))
+            status = read_status(self.directory, job_id)
+        return status
+
+    def prune(self, max_age=JOB_TTL_SECONDS):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue(directory=None, max_workers=None):
+    # Process-wide queue; recreated if a different jobs directory is requested
+    global _queue
+    with _queue_lock:
+        wanted = directory or os.environ.get("RULEBOOK_JOBS_DIR") or DEFAULT_JOBS_DIR
+        if _queue is None or _queue.directory != wanted:
+            if _queue is not None:
+                _queue.shutdown(wait=False)
+            _queue = JobQueue(wanted, max_workers=max_workers)
+        return _queue
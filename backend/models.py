@@ -1,3 +1,4 @@
+from sqlalchemy.orm import deferred
 try:
     from backend.app import db
 except ImportError:
@@ -13,10 +14,38 @@ class Rulebook(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False, unique=True)
     rpg_system = db.Column(db.String(100), nullable=True)
-    rules = db.Column(db.JSON, nullable=False)
+    # Full parse result, kept for backwards compatibility; deferred so listing
+    # rulebooks or fetching chunks never deserializes the whole book
+    rules = deferred(db.Column(db.JSON, nullable=False))
     universe_id = db.Column(db.Integer, db.ForeignKey('universe.id'), nullable=True)  # Link to Universe
+    # SHA-256 of the uploaded bytes this row's chunks and index were built from
+    content_digest = db.Column(db.String(64), nullable=True, index=True)
+    sections = db.relationship('RulebookSection', backref='rulebook', lazy='dynamic', cascade='all, delete-orphan', order_by='RulebookSection.position')
+    chunks = db.relationship('RuleChunk', backref='rulebook', lazy='dynamic', cascade='all, delete-orphan', order_by='RuleChunk.position')
     # Optionally: store upload timestamp, uploader, etc.
 
+class RulebookSection(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    rulebook_id = db.Column(db.Integer, db.ForeignKey('rulebook.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    __table_args__ = (
+        db.Index('ix_rulebook_section_rulebook_id_title', 'rulebook_id', 'title'),
+    )
+
+class RuleChunk(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    rulebook_id = db.Column(db.Integer, db.ForeignKey('rulebook.id'), nullable=False)
+    universe_id = db.Column(db.Integer, db.ForeignKey('universe.id'), nullable=True)  # Copied from Rulebook for per-universe retrieval
+    section = db.Column(db.String(255), nullable=True)
+    position = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='text')  # 'text' or 'table'
+    text = db.Column(db.Text, nullable=False)
+    __table_args__ = (
+        db.Index('ix_rule_chunk_rulebook_id_section', 'rulebook_id', 'section'),
+        db.Index('ix_rule_chunk_universe_id', 'universe_id'),
+    )
+
 class Universe(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -27,3 +56,18 @@ class UserUniverseShare(db.Model):
     universe_id = db.Column(db.Integer, db.ForeignKey('universe.id'), nullable=False)
     user_id = db.Column(db.String(36), nullable=False)
     # Optionally: permissions, timestamps, etc.
+
+class GameSession(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # bumped by every save
+    updated_at = db.Column(db.Float, nullable=False)  # time.time() of last save
+
+class CampaignArchiveTurn(db.Model):
+    # One compacted campaign turn, verbatim, for recall; kept out of the
+    # session's JSON so every turn does not rewrite the whole archive
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(36), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # turn number, from 1
+    text = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.UniqueConstraint('session_id', 'position', name='uq_campaign_archive_turn'),)
@@ -0,0 +1,148 @@
+# Token-budgeted prompt assembly
+#
+# Segments (character sheet, combat state, memory turns, rule chunks) are
+# packed greedily by priority into a fixed token budget, then laid out in a
+# stable order ending with the player's line. Token counts are memoized per
+# segment text, so the sheet, older memory turns and rule chunks that repeat
+# from turn to turn are only counted once.
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # optional; fall back to the offline approximation
+    tiktoken = None
+
+DEFAULT_BUDGET = 3000
+TOKEN_CACHE_SIZE = 16384
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Lower packs first. Memory turns (newest first) and rule chunks (best
+# first) interleave so neither crowds the other out.
+CHARACTER_PRIORITY = 10
+COMBAT_PRIORITY = 20
+CONTEXT_PRIORITY = 30
+
+_encoding = None  # False once fetching it has failed; not retried
+
+
+def _approximate(text: str) -> int:
+    # ~4 characters per token for words, one token per punctuation mark
+    return sum(1 + (len(t) - 1) // 4 for t in _TOKEN.findall(text))
+
+
+def _tiktoken_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # encoding files unavailable offline
+            _encoding = False
+    return _encoding or None
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def count_tokens(text: str) -> int:
+    if tiktoken is not None and os.environ.get("PROMPT_TOKENIZER", "tiktoken") == "tiktoken":
+        encoding = _tiktoken_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text))
+    return _approximate(text)
+
+
+def _clip(text: str, budget: int) -> str:
+    # Longest word-boundary prefix of text that fits the budget
+    words = text.split(' ')
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(' '.join(words[:mid])) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return ' '.join(words[:lo])
+
+
+def render_sheet(character_sheet) -> str:
+    if isinstance(character_sheet, (dict, list)):
+        return json.dumps(character_sheet, sort_keys=True)
+    return str(character_sheet)
+
+
+def render_turn(turn) -> str:
+    if isinstance(turn, dict) and ('player' in turn or 'gm' in turn):
+        return f"Player: {turn.get('player', '')} / GM: {turn.get('gm', '')}"
+    if isinstance(turn, dict) and 'summary' in turn:
+        return f"Summary: {turn['summary']}"
+    return str(turn)
+
+
+class Segment(NamedTuple):
+    section: str
+    text: str
+    priority: float
+    order: int  # position within its section in the final layout
+
+
+class AssembledPrompt(NamedTuple):
+    text: str
+    tokens: int
+    dropped: int  # segments that did not fit
+
+
+class PromptAssembler:
+    SECTIONS = ('rules', 'combat', 'character', 'memory')
+    HEADERS = {'rules': 'Rules:', 'combat': 'Combat:', 'character': 'Character:', 'memory': 'Memory:'}
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+
+    def segments(self, character_sheet=None, memory: Sequence = (), rule_chunks: Iterable[str] = (),
+                 combat_state: Optional[str] = None) -> List[Segment]:
+        segments = []
+        if character_sheet:
+            segments.append(Segment('character', render_sheet(character_sheet), CHARACTER_PRIORITY, 0))
+        if combat_state:
+            segments.append(Segment('combat', combat_state, COMBAT_PRIORITY, 0))
+        for age, turn in enumerate(reversed(list(memory))):
+            segments.append(Segment('memory', render_turn(turn), CONTEXT_PRIORITY + 2 * age, -age))
+        for rank, chunk in enumerate(rule_chunks):
+            segments.append(Segment('rules', chunk, CONTEXT_PRIORITY + 2 * rank + 1, rank))
+        return segments
+
+    def assemble(self, player_input: str, character_sheet=None, memory: Sequence = (),
+                 rule_chunks: Iterable[str] = (), combat_state: Optional[str] = None) -> AssembledPrompt:
+        tail = f"Player: {player_input}"
+        remaining = self.budget - count_tokens(tail)
+        chosen, dropped = [], 0
+        opened = set()
+        for seg in sorted(self.segments(character_sheet, memory, rule_chunks, combat_state),
+                          key=lambda s: (s.priority, s.order)):
+            cost = count_tokens(seg.text)
+            header = 0 if seg.section in opened else count_tokens(self.HEADERS[seg.section])
+            if cost + header > remaining and seg.section == 'character' and remaining - header > 0:
+                # The sheet is worth keeping in part rather than dropping
+                seg = seg._replace(text=_clip(seg.text, remaining - header))
+                cost = count_tokens(seg.text)
+            if not seg.text or cost + header > remaining:
+                dropped += 1
+                continue
+            remaining -= cost + header
+            opened.add(seg.section)
+            chosen.append(seg)
+        lines = []
+        for section in self.SECTIONS:
+            picked = sorted((s for s in chosen if s.section == section), key=lambda s: s.order)
+            if picked:
+                lines.append(self.HEADERS[section])
+                lines.extend(s.text for s in picked)
+        lines.append(tail)
+        return AssembledPrompt('\n'.join(lines), self.budget - remaining, dropped)
+
+
+def assemble_prompt(player_input: str, budget: Optional[int] = None, **parts) -> AssembledPrompt:
+    budget = budget or int(os.environ.get("PROMPT_TOKEN_BUDGET", DEFAULT_BUDGET))
+    return PromptAssembler(budget).assemble(player_input, **parts)
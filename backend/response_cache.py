@@ -0,0 +1,195 @@
+# Response cache in front of the GM model
+#
+# Two tiers, both namespaced per universe and bounded by one LRU with a TTL:
+#   exact    SHA-256 of the normalized prompt plus the model parameters
+#   similar  optional; cosine similarity of prompt embeddings (e.g. the
+#            rulebook's vectorizer) against earlier prompts sent with the same
+#            parameters, reused above a threshold
+# Hit/miss counters are kept per tier for the admin stats endpoint.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 60 * 60
+DEFAULT_NAMESPACE = 'global'
+_WS = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WS.sub(' ', prompt).strip().lower()
+
+
+def _params_key(params: Dict) -> str:
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def cache_key(prompt: str, **params) -> str:
+    payload = normalize_prompt(prompt) + '\0' + _params_key(params)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def vectorizer_embedder(vectorizer) -> Callable:
+    # Embed prompts with a fitted rule vectorizer (anything with .transform)
+    def embed(texts):
+        matrix = vectorizer.transform(texts)
+        return matrix.toarray() if hasattr(matrix, 'toarray') else np.asarray(matrix)
+    return embed
+
+
+class _SimilarityIndex:
+    # Unit-normalized prompt embeddings for one (namespace, params) group
+    def __init__(self):
+        self.keys = []
+        self.rows = []
+        self._matrix = None
+
+    def add(self, key, vector):
+        self.keys.append(key)
+        self.rows.append(vector)
+        self._matrix = None
+
+    def discard(self, key):
+        if key in self.keys:
+            i = self.keys.index(key)
+            del self.keys[i]
+            del self.rows[i]
+            self._matrix = None
+
+    def best(self, vector):
+        if not self.keys:
+            return None, 0.0
+        if self._matrix is None:
+            self._matrix = np.vstack(self.rows)
+        scores = self._matrix @ vector
+        i = int(np.argmax(scores))
+        return self.keys[i], float(scores[i])
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 similarity_threshold: Optional[float] = None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.clock = clock
+        # (namespace, key) -> (response, expires_at, group)
+        self._entries: OrderedDict = OrderedDict()
+        self._similar: Dict = {}  # (namespace, params) -> _SimilarityIndex
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def _embed(self, embedder, prompt):
+        vector = np.asarray(embedder([normalize_prompt(prompt)]), dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _drop(self, entry_key):
+        _, _, group = self._entries.pop(entry_key)
+        index = self._similar.get(group)
+        if index is not None:
+            index.discard(entry_key[1])
+            if not index.keys:
+                del self._similar[group]
+
+    def _live(self, entry_key):
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return None
+        if entry[1] <= self.clock():
+            self._drop(entry_key)
+            self._stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(entry_key)
+        return entry[0]
+
+    def get(self, prompt: str, namespace=None, embedder: Optional[Callable] = None, **params) -> Optional[str]:
+        namespace = str(namespace or DEFAULT_NAMESPACE)
+        key = cache_key(prompt, **params)
+        vector = None
+        if embedder is not None and self.similarity_threshold is not None:
+            vector = self._embed(embedder, prompt)  # outside the lock
+        with self._lock:
+            hit = self._live((namespace, key))
+            if hit is not None:
+                self._stats['exact_hits'] += 1
+                return hit
+            index = self._similar.get((namespace, _params_key(params)))
+            if vector is not None and index is not None:
+                match, score = index.best(vector)
+                if score >= self.similarity_threshold:
+                    hit = self._live((namespace, match))
+                    if hit is not None:
+                        self._stats['similar_hits'] += 1
+                        return hit
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, prompt: str, response: str, namespace=None, embedder: Optional[Callable] = None, **params):
+        namespace = str(namespace or DEFAULT_NAMESPACE)
+        key = cache_key(prompt, **params)
+        group = (namespace, _params_key(params))
+        vector = None
+        if embedder is not None and self.similarity_threshold is not None:
+            vector = self._embed(embedder, prompt)
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._drop((namespace, key))
+            self._entries[(namespace, key)] = (response, self.clock() + self.ttl, group)
+            if vector is not None:
+                self._similar.setdefault(group, _SimilarityIndex()).add(key, vector)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def get_or_call(self, prompt: str, call: Callable[[str], str], namespace=None,
+                    embedder: Optional[Callable] = None, **params) -> str:
+        hit = self.get(prompt, namespace=namespace, embedder=embedder, **params)
+        if hit is not None:
+            return hit
+        response = call(prompt)
+        self.put(prompt, response, namespace=namespace, embedder=embedder, **params)
+        return response
+
+    def clear(self, namespace=None):
+        with self._lock:
+            doomed = [k for k in self._entries if namespace is None or k[0] == str(namespace)]
+            for entry_key in doomed:
+                self._drop(entry_key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['similar_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['exact_hits'] + stats['similar_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    # Process-wide cache configured from RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+    # and RESPONSE_CACHE_SIMILARITY (unset disables the similarity tier)
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            threshold = os.environ.get('RESPONSE_CACHE_SIMILARITY')
+            _cache = ResponseCache(
+                max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)),
+                ttl=float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)),
+                similarity_threshold=float(threshold) if threshold else None,
+            )
+        return _cache
@@ -1,29 +1,38 @@
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+import json
+import logging
+import os
 import uuid
-import random
 import threading
 from backend.app import limiter
+from backend.admin_log import AdminLog, DEFAULT_CAPACITY, DEFAULT_PAGE_SIZE
+from backend.dice import compile_expression, summarize, pmf, success_probability, DiceError
+from backend.session_store import get_session_store
+from backend.gpt4_utils import get_streamer, streamer_params
+from backend.campaign_memory import get_campaign_memory
+from backend.prompt_assembler import assemble_prompt
+from backend.universe_shards import get_shard_manager
+from backend.utils_embedding import METADATA_FIELDS
 
 api_bp = Blueprint('api', __name__)
 
-# In-memory session store for demonstration
-sessions = {}
+MAX_DICE_PER_ROLL = 100
+MAX_BATCH_TRIALS = 1_000_000
+MAX_BATCH_RAW_TRIALS = 10_000
+MAX_BATCH_DICE = 10_000_000  # dice x trials per batch request
+
 # In-memory kill switch and logs (thread-safe)
 _kill_switch = {'enabled': False}
 _kill_switch_lock = threading.Lock()
-_admin_logs = []
-_admin_logs_lock = threading.Lock()
+_admin_log = AdminLog(
+    capacity=int(os.environ.get('ADMIN_LOG_CAPACITY', DEFAULT_CAPACITY)),
+    spill_path=os.environ.get('ADMIN_LOG_SPILL_PATH'),
+)
 
 def log_admin(endpoint, input_data, output_data, status):
-    with _admin_logs_lock:
-        _admin_logs.append({
-            'endpoint': endpoint,
-            'input': input_data,
-            'output': output_data,
-            'status': status
-        })
+    _admin_log.record(endpoint, input_data, output_data, status)
 
 @api_bp.route('/kill_switch', methods=['GET', 'POST'])
 def kill_switch():
@@ -35,49 +44,226 @@ def kill_switch():
 
 @api_bp.route('/admin_logs', methods=['GET', 'POST'])
 def admin_logs():
-    with _admin_logs_lock:
-        if request.method == 'POST' and (request.get_json() or {}).get('clear'):
-            _admin_logs.clear()
-            return jsonify({'logs': []}), 200
-        return jsonify({'logs': list(_admin_logs)}), 200
+    if request.method == 'POST' and (request.get_json(silent=True) or {}).get('clear'):
+        _admin_log.clear()
+        return jsonify({'logs': [], 'next_cursor': 0}), 200
+    cursor = request.args.get('cursor', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    logs, next_cursor = _admin_log.page(cursor=cursor, limit=limit)
+    return jsonify({'logs': logs, 'next_cursor': next_cursor}), 200
+
+@api_bp.route('/response_cache', methods=['GET', 'POST'])
+def response_cache():
+    from backend.response_cache import get_response_cache
+    cache = get_response_cache()
+    data = request.get_json(silent=True) or {}
+    if request.method == 'POST' and data.get('clear'):
+        cache.clear(data.get('universe_id'))
+    return jsonify(cache.stats()), 200
 
 @api_bp.route('/start_session', methods=['POST'])
 def start_session():
     session_id = str(uuid.uuid4())
-    sessions[session_id] = {'active': True}
-    log_admin('start_session', {}, {'session_id': session_id}, 200)
+    data = request.get_json(silent=True) or {}
+    session = {'active': True}
+    if data.get('user_id'):
+        # Scopes rule search to this user's universes. Client-supplied and
+        # unauthenticated: a convenience for picking a table's rules, not a
+        # security boundary.
+        session['user_id'] = str(data['user_id'])
+    if data.get('universe_id') is not None:
+        try:
+            session['universe_id'] = int(data['universe_id'])  # namespaces cached GM replies
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid universe ID'}), 400
+    get_session_store().save(session_id, session)
+    log_admin('start_session', data, {'session_id': session_id}, 200)
     return jsonify({'session_id': session_id}), 200
 
 @api_bp.route('/continue_session', methods=['POST'])
 def continue_session():
     data = request.get_json()
     session_id = data.get('session_id')
-    if session_id in sessions:
+    if get_session_store().get(session_id) is not None:
         log_admin('continue_session', data, {'message': 'Session continued', 'session_id': session_id}, 200)
         return jsonify({'message': 'Session continued', 'session_id': session_id}), 200
     else:
         log_admin('continue_session', data, {'error': 'Invalid session ID'}, 404)
         return jsonify({'error': 'Invalid session ID'}), 404
 
-@api_bp.route('/roll_dice', methods=['POST'])
-@limiter.limit("5 per minute")
-def roll_dice():
+@api_bp.route('/rules/search', methods=['POST'])
+def rules_search():
+    # Rule chunks from the universes the session's user owns or is shared
+    # into, optionally narrowed to universe_ids and filtered on chunk
+    # metadata, e.g. {"where": {"kind": "text"}, "exclude": {"section": "Gear"}}.
+    # The user_id is whatever the client gave start_session: this scopes a
+    # table's retrieval, it is not access control.
+    data = request.get_json(silent=True) or {}
+    query = str(data.get('query') or '').strip()
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    session = get_session_store().get(data.get('session_id')) if data.get('session_id') else None
+    if session is None or not session.get('user_id'):
+        return jsonify({'error': 'Session with a user is required'}), 400
+    universe_ids = data.get('universe_ids')
+    where, exclude = data.get('where') or None, data.get('exclude') or None
+    try:
+        top_k = max(1, min(int(data.get('top_k', 3)), 20))
+        if universe_ids is not None:
+            universe_ids = [int(u) for u in universe_ids]
+        for filters in (where, exclude):
+            if filters is not None and (not isinstance(filters, dict) or not set(filters) <= set(METADATA_FIELDS)):
+                raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid search parameters'}), 400
+    hits = get_shard_manager().search_for_user(session['user_id'], query, universe_ids=universe_ids,
+                                               top_k=top_k, where=where, exclude=exclude)
+    return jsonify({'results': hits}), 200
+
+@api_bp.route('/rules/shards', methods=['GET'])
+def rules_shards():
+    return jsonify(get_shard_manager().stats()), 200
+
+def _generation_blocked(endpoint):
     with _kill_switch_lock:
         if _kill_switch['enabled']:
-            log_admin('roll_dice', request.get_json(), {'error': 'Generation is disabled by admin.'}, 403)
+            log_admin(endpoint, request.get_json(silent=True), {'error': 'Generation is disabled by admin.'}, 403)
             return jsonify({'error': 'Generation is disabled by admin.'}), 403
+    return None
+
+@api_bp.route('/roll_dice', methods=['POST'])
+@limiter.limit("5 per minute")
+def roll_dice():
+    blocked = _generation_blocked('roll_dice')
+    if blocked:
+        return blocked
     data = request.get_json()
     expr = data.get('expression', '')
     try:
-        num, die = expr.lower().split('d')
-        num = int(num)
-        die = int(die)
-        if num < 1 or die < 1 or num > 100:
+        compiled = compile_expression(expr)
+        if compiled.dice_count < 1 or compiled.dice_count > MAX_DICE_PER_ROLL:
             raise ValueError
-        rolls = [random.randint(1, die) for _ in range(num)]
-        result = {'rolls': rolls, 'total': sum(rolls)}
+        result = compiled.roll()
         log_admin('roll_dice', data, result, 200)
         return jsonify(result), 200
     except Exception:
         log_admin('roll_dice', data, {'error': 'Invalid dice expression'}, 400)
         return jsonify({'error': 'Invalid dice expression'}), 400
+
+@api_bp.route('/roll_dice/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+def roll_dice_batch():
+    # Simulate many rolls at once; returns a distribution summary by default,
+    # or the raw totals with {"summary": false}
+    blocked = _generation_blocked('roll_dice_batch')
+    if blocked:
+        return blocked
+    data = request.get_json(silent=True) or {}
+    try:
+        compiled = compile_expression(data.get('expression', ''))
+        trials = int(data.get('trials', 1000))
+        seed = data.get('seed')
+        seed = int(seed) if seed is not None else None
+        summary = bool(data.get('summary', True))
+        limit = MAX_BATCH_TRIALS if summary else MAX_BATCH_RAW_TRIALS
+        if not 1 <= compiled.dice_count <= MAX_DICE_PER_ROLL or not 1 <= trials <= limit:
+            raise ValueError
+        if compiled.dice_count * trials > MAX_BATCH_DICE:
+            raise ValueError
+    except Exception:
+        log_admin('roll_dice_batch', data, {'error': 'Invalid dice expression or trial count'}, 400)
+        return jsonify({'error': 'Invalid dice expression or trial count'}), 400
+    totals = compiled.sample(trials, seed=seed)
+    result = {'expression': str(compiled), 'trials': trials}
+    if summary:
+        result['summary'] = summarize(totals)
+    else:
+        result['totals'] = totals.tolist()
+    log_admin('roll_dice_batch', data, {'expression': result['expression'], 'trials': trials}, 200)
+    return jsonify(result), 200
+
+@api_bp.route('/roll_dice/odds', methods=['POST'])
+@limiter.limit("30 per minute")
+def roll_dice_odds():
+    # Exact distribution of an expression, plus the chance of meeting a DC
+    # (scored like a skill check when the expression is a single d20 roll)
+    data = request.get_json(silent=True) or {}
+    try:
+        expression = str(compile_expression(data.get('expression', '')))
+        dist = pmf(expression)
+        result = {'expression': expression, 'mean': dist.mean(),
+                  'min': int(dist.offset), 'max': int(dist.offset + len(dist.probs) - 1)}
+        if data.get('include_pmf'):
+            result['pmf'] = {str(v): p for v, p in dist.as_dict().items()}
+        if data.get('dc') is not None:
+            result['dc'] = int(data['dc'])
+            result['probability'] = success_probability(expression, result['dc'])
+    except (DiceError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid dice expression'}), 400
+    return jsonify(result), 200
+
+def _sse(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+@api_bp.route('/chat/stream', methods=['POST'])
+@limiter.limit("30 per minute")
+def chat_stream():
+    # Server-sent events: one {"token"} event per model token as it arrives,
+    # then "done" with the full text (or "error"). Replies are cached per
+    # session universe; a repeated prompt replays the cached text as one token.
+    blocked = _generation_blocked('chat_stream')
+    if blocked:
+        return blocked
+    data = request.get_json(silent=True) or {}
+    message = str(data.get('message') or '').strip()
+    if not message:
+        return jsonify({'error': 'Message is required'}), 400
+    store = get_session_store()
+    session_id = data.get('session_id')
+    session = store.get(session_id) if session_id else None
+    if session_id and session is None:
+        return jsonify({'error': 'Invalid session ID'}), 404
+    campaign = get_campaign_memory()
+    memory = campaign.prompt_memory(session_id, query=message) if session_id else []
+    rule_chunks = []
+    if session and session.get('user_id'):
+        rule_chunks = [h['text'] for h in get_shard_manager().search_for_user(session['user_id'], message)]
+    prompt = assemble_prompt(message, budget=current_app.config.get('PROMPT_TOKEN_BUDGET'),
+                             character_sheet=data.get('character'), memory=memory,
+                             rule_chunks=rule_chunks).text
+    try:
+        streamer = get_streamer(current_app.config.get('GM_MODEL'))
+    except ValueError as e:
+        logging.error(str(e))
+        return jsonify({'error': 'Model is not configured'}), 500
+    from backend.response_cache import get_response_cache
+    cache = get_response_cache()
+    namespace = session.get('universe_id') if session else None
+    params = streamer_params(streamer)
+    cached = cache.get(prompt, namespace=namespace, **params)
+
+    def events():
+        if cached is not None:
+            text = cached
+            yield _sse({'token': text})
+        else:
+            parts = []
+            try:
+                for token in streamer(prompt):
+                    parts.append(token)
+                    yield _sse({'token': token})
+            except Exception as e:
+                logging.error(str(e))
+                log_admin('chat_stream', data, {'error': 'An internal error has occurred'}, 500)
+                yield _sse({'error': 'An internal error has occurred'}, event='error')
+                return
+            text = ''.join(parts)
+            cache.put(prompt, text, namespace=namespace, **params)
+        if session_id:
+            campaign.record(session_id, message, text)
+        log_admin('chat_stream', data, {'text': text}, 200)
+        yield _sse({'text': text}, event='done')
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -9,14 +9,12 @@ except ImportError:
 import logging
 import sys
 from backend.app import limiter
+from backend.ingest import copy_upload, iter_pages, ingest_pages, build_response, parse_error
+from backend.universe_shards import refresh_rulebook_shards
 
 upload_rulebook_bp = Blueprint('upload_rulebook', __name__)
 
-# In-memory deduplication store (filename+size: result)
-_rulebook_cache = {}
-
-# Disable cache entirely in pytest (test) environments
-import sys
+# Disable cache (and DB upserts) entirely in pytest (test) environments
 if "pytest" in sys.modules or os.environ.get("FLASK_ENV") in ("testing", "test"):
     def use_cache():
         return False
@@ -31,10 +29,133 @@ MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def upsert_rulebook(filename, response, digest=None):
+    rpg_system = response.get('rpg_system') or None
+    # If rpg_system is not in the response, try to infer from filename (optional, simple heuristic)
+    if not rpg_system and filename:
+        base = filename.rsplit('.', 1)[0]
+        rpg_system = base if base else None
+    # Upsert by filename
+    rulebook = Rulebook.query.filter_by(filename=filename).first()
+    if rulebook:
+        rulebook.rules = response
+        rulebook.rpg_system = rpg_system
+        rulebook.content_digest = digest
+    else:
+        rulebook = Rulebook(filename=filename, rpg_system=rpg_system, rules=response, content_digest=digest)
+        db.session.add(rulebook)
+    db.session.commit()
+    return rulebook
+
+def _wants_async():
+    flag = request.args.get('async') or request.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes')
+
+def _upload_cache():
+    from backend.rulebook_cache import RulebookCache
+    return RulebookCache(current_app.config.get('RULEBOOK_CACHE_DIR'))
+
+def _remember_upload(digest, response):
+    # Entries hold only what is derived from the bytes; which rows currently
+    # hold those bytes is Rulebook.content_digest's business
+    _upload_cache().put(digest, {'response': response})
+
+def persist_upload(filename, digest, response, chunks, staged_index=None, index_root=None):
+    # Upsert the rulebook with its chunks and embedding index and remember the
+    # upload by content. Used by the sync path and, inside their pool process,
+    # by upload jobs. With staged_index (see rulebook_index.ChunkIndexWriter)
+    # chunks may be a one-pass iterable.
+    from backend.ingest import chunk_metadata, chunk_texts
+    from backend.rule_chunks import replace_chunks
+    from backend.rulebook_index import index_chunks, publish_index
+    if not staged_index:
+        chunks = list(chunks)
+    rulebook = upsert_rulebook(filename, response, digest)
+    replace_chunks(rulebook, chunks)
+    if staged_index:
+        publish_index(staged_index, rulebook.id, root=index_root)
+    else:
+        index_chunks(rulebook.id, chunk_texts(chunks), root=index_root, metadata=chunk_metadata(chunks))
+    _remember_upload(digest, response)
+    return rulebook
+
+def _serve_cached(filename, digest, cached):
+    # Same bytes were ingested before: upsert under this filename and reuse
+    # the chunks and index of a row still built from these bytes, with no
+    # parsing or embedding
+    from backend.ingest import chunk_metadata, chunk_texts, page_chunks
+    from backend.rule_chunks import chunk_records, replace_chunks
+    from backend.rulebook_index import copy_index, index_chunks
+    response = cached['response']
+    current = Rulebook.query.filter_by(filename=filename).first()
+    if current is not None and current.content_digest == digest:
+        return jsonify(response), 200
+    rulebook = upsert_rulebook(filename, response, digest)
+    source = Rulebook.query.filter(Rulebook.content_digest == digest, Rulebook.id != rulebook.id).first()
+    # No row holds these bytes any more (all re-uploaded with other content):
+    # rebuild from the cached parse result
+    chunks = (chunk_records(source.id) if source is not None else []) or page_chunks(response)
+    replace_chunks(rulebook, chunks)
+    if source is None or copy_index(source.id, rulebook.id) is None:
+        index_chunks(rulebook.id, chunk_texts(chunks), metadata=chunk_metadata(chunks))
+    refresh_rulebook_shards(rulebook)
+    return jsonify(response), 200
+
+def _submit_upload_job(path, digest, filename, ext):
+    # Hand parse -> chunk -> embed -> store to the background pool and return
+    # at once. The job writes the database itself; this worker's loaded shards
+    # pick the new index up from the universe signature.
+    from backend.rulebook_index import index_root
+    finalize = None
+    if use_cache():
+        finalize = {'database_uri': db.engine.url.render_as_string(hide_password=False),
+                    'cache_dir': current_app.config.get('RULEBOOK_CACHE_DIR'),
+                    'filename': filename, 'digest': digest}
+    job_id = _job_queue().submit_spooled(path, ext, index_root=index_root(), finalize=finalize)
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/upload_rulebook/{job_id}'}), 202
+
+def _job_queue():
+    from backend.jobs import get_queue
+    return get_queue(current_app.config.get('RULEBOOK_JOBS_DIR'), current_app.config.get('RULEBOOK_JOB_WORKERS'))
+
+@upload_rulebook_bp.route('/upload_rulebook/<job_id>', methods=['GET'])
+@limiter.exempt
+def upload_rulebook_status(job_id):
+    status = _job_queue().status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job ID'}), 404
+    return jsonify(status), 200
+
+@upload_rulebook_bp.route('/rulebooks/<int:rulebook_id>', methods=['GET'])
+def get_rulebook(rulebook_id):
+    # The parsed content of a stored rulebook, e.g. once its upload job is done
+    rulebook = db.session.get(Rulebook, rulebook_id)
+    if rulebook is None:
+        return jsonify({'error': 'Unknown rulebook ID'}), 404
+    return jsonify({'id': rulebook.id, 'filename': rulebook.filename, 'rpg_system': rulebook.rpg_system,
+                    'rules': rulebook.rules}), 200
+
+@upload_rulebook_bp.route('/rulebooks/<int:rulebook_id>/sections/<path:title>', methods=['DELETE'])
+@limiter.limit("30 per minute")
+def delete_rulebook_section(rulebook_id, title):
+    # Take a section out of retrieval: its chunk rows go and its rows in the
+    # published index are deleted for every worker (rulebook_index.delete_rows)
+    from backend.rule_chunks import delete_section
+    from backend.rulebook_index import delete_rows
+    rulebook = db.session.get(Rulebook, rulebook_id)
+    if rulebook is None:
+        return jsonify({'error': 'Unknown rulebook ID'}), 404
+    removed = delete_section(rulebook, title)
+    if not removed:
+        return jsonify({'error': 'Unknown section'}), 404
+    delete_rows(rulebook_id, {'section': title})
+    refresh_rulebook_shards(rulebook)
+    return jsonify({'rulebook_id': rulebook_id, 'section': title, 'chunks_deleted': removed}), 200
+
 @upload_rulebook_bp.route('/upload_rulebook', methods=['POST'])
 @limiter.limit("3 per minute")
 def upload_rulebook():
-    from backend.utils import parse_pdf, parse_docx  # Import here for patching to work in tests
+    from backend.rulebook_cache import new_hasher
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
@@ -51,72 +172,49 @@ def upload_rulebook():
         return jsonify({'error': 'File is empty'}), 400
     if file_length > MAX_FILE_SIZE:
         return jsonify({'error': 'File too large'}), 413
-    cache_key = f"{filename}:{file_length}"
-    if use_cache() and cache_key in _rulebook_cache:
-        return jsonify(_rulebook_cache[cache_key]), 200
     ext = filename.rsplit('.', 1)[1].lower()
+    hasher = new_hasher()
+    if _wants_async():
+        # Spool (hashing as we go), then either answer from cache or queue
+        path = _job_queue().spool(file.stream, ext, hasher=hasher)
+        digest = hasher.hexdigest()
+        cached = _upload_cache().get(digest) if use_cache() else None
+        if cached is not None:
+            os.remove(path)
+            return _serve_cached(filename, digest, cached)
+        return _submit_upload_job(path, digest, filename, ext)
+    writer = None
     try:
         with tempfile.NamedTemporaryFile(delete=True, suffix='.'+ext) as tmp:
-            file.seek(0)
-            tmp.write(file.read())
-            tmp.flush()
-            if ext == 'pdf':
-                result = parse_pdf(tmp.name)
-            elif ext == 'docx':
-                result = parse_docx(tmp.name)
-            elif ext == 'txt':
-                with open(tmp.name, 'r', encoding='utf-8', errors='replace') as f:
-                    text = f.read()
-                # Section split: split on two or more newlines, and also on lines with only dashes or equals
-                import re
-                sections = [s.strip() for s in re.split(r'\n{2,}|^[-=]{2,}$', text, flags=re.MULTILINE) if s.strip()]
-                result = {'rules': text, 'sections': sections, 'tables': []}
-            else:
-                return jsonify({'error': 'Unsupported file type'}), 400
-        # Accept result if any of text, sections, or tables is non-empty
-        text_val = result.get('text', '') if isinstance(result, dict) else ''
-        sections_val = result.get('sections', []) if isinstance(result, dict) else []
-        tables_val = result.get('tables', []) if isinstance(result, dict) else []
-        has_text = isinstance(text_val, str) and text_val.strip() != ''
-        has_sections = isinstance(sections_val, list) and len(sections_val) > 0
-        has_tables = isinstance(tables_val, list) and len(tables_val) > 0
-        if not (has_text or has_sections or has_tables):
+            # Stream to disk in fixed-size blocks (hashing as we go) and parse page by page
+            copy_upload(file.stream, tmp, hasher=hasher)
+            digest = hasher.hexdigest()
+            cached = _upload_cache().get(digest) if use_cache() else None
+            if cached is not None:
+                return _serve_cached(filename, digest, cached)
+            if use_cache():
+                # Embed each chunk batch as it is parsed, spooling rows to disk
+                from backend.rulebook_index import ChunkIndexWriter
+                writer = ChunkIndexWriter()
+            result, _ = ingest_pages(iter_pages(tmp.name, ext), on_chunks=writer.add if writer else None)
+        response = build_response(result)
+        if response is None:
             logging.error('Empty parse result')
             return jsonify({'error': 'Empty parse result'}), 400
-        response = dict(result) if result else {}
-        if 'text' in result and 'rules' not in response:
-            response['rules'] = result['text']
-        if 'rules' not in response:
-            response['rules'] = ''
-        if 'sections' not in response:
-            response['sections'] = []
-        if 'tables' not in response:
-            response['tables'] = []
         # Save rulebook to DB (upsert by filename)
-        if use_cache():
-            rpg_system = response.get('rpg_system') or None
-            # If rpg_system is not in the response, try to infer from filename (optional, simple heuristic)
-            if not rpg_system and filename:
-                base = filename.rsplit('.', 1)[0]
-                rpg_system = base if base else None
-            # Upsert by filename
-            rulebook = Rulebook.query.filter_by(filename=filename).first()
-            if rulebook:
-                rulebook.rules = response
-                rulebook.rpg_system = rpg_system
-            else:
-                rulebook = Rulebook(filename=filename, rpg_system=rpg_system, rules=response)
-                db.session.add(rulebook)
-            db.session.commit()
-            _rulebook_cache[cache_key] = response
+        if writer is not None:
+            # Persist chunk embeddings so workers can memory-map them instead of re-embedding
+            rulebook = persist_upload(filename, digest, response, writer.chunks(), staged_index=writer.finish())
+            refresh_rulebook_shards(rulebook)
         # In test mode, do not upsert or fetch from DB, always return fresh result
         return jsonify(response), 200
     except Exception as e:
-        msg = str(e).lower()
         logging.error(str(e))
         # Always log error for empty file or parse errors
-        if 'empty' in msg:
+        if 'empty' in str(e).lower():
             logging.error('File is empty')
-        if 'encrypted' in msg or 'locked' in msg:
-            return jsonify({'error': 'PDF is encrypted or locked'}), 400
-        return jsonify({'error': 'An internal error has occurred'}), 500
+        message, status = parse_error(e)
+        return jsonify({'error': message}), status
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,60 @@
+# Per-section / per-chunk rulebook rows, so retrieval and the prompt builder
+# fetch only the chunks they need instead of deserializing Rulebook.rules
+from backend.app import db
+from backend.models import RuleChunk, RulebookSection
+
+INSERT_BATCH_SIZE = 1000
+
+
+def replace_chunks(rulebook, chunks):
+    # Bulk-replace a rulebook's chunk and section rows with chunk records
+    # ({'text', 'section', 'kind'}, as produced by ingest.page_chunks).
+    # chunks may be any iterable, read once; rows are inserted in batches.
+    RuleChunk.query.filter_by(rulebook_id=rulebook.id).delete(synchronize_session=False)
+    RulebookSection.query.filter_by(rulebook_id=rulebook.id).delete(synchronize_session=False)
+    titles = {}
+    batch = []
+    for i, c in enumerate(chunks):
+        if c.get('kind', 'text') == 'text' and c.get('section'):
+            titles.setdefault(c['section'], len(titles))
+        batch.append({'rulebook_id': rulebook.id, 'universe_id': rulebook.universe_id, 'section': c.get('section'),
+                      'position': i, 'kind': c.get('kind', 'text'), 'text': c['text']})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(db.insert(RuleChunk), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(RuleChunk), batch)
+    if titles:
+        db.session.execute(db.insert(RulebookSection), [
+            {'rulebook_id': rulebook.id, 'position': i, 'title': title} for title, i in titles.items()
+        ])
+    db.session.commit()
+
+
+def delete_section(rulebook, title):
+    # Remove a section's chunk rows (text and tables filed under it) and its
+    # section row; returns how many chunks went
+    removed = RuleChunk.query.filter_by(rulebook_id=rulebook.id, section=title).delete(synchronize_session=False)
+    RulebookSection.query.filter_by(rulebook_id=rulebook.id, title=title).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def fetch_chunks(rulebook_id, section=None, kind=None):
+    query = RuleChunk.query.filter_by(rulebook_id=rulebook_id)
+    if section is not None:
+        query = query.filter_by(section=section)
+    if kind is not None:
+        query = query.filter_by(kind=kind)
+    return query.order_by(RuleChunk.position).all()
+
+
+def universe_chunks(universe_id, kind=None):
+    query = RuleChunk.query.filter_by(universe_id=universe_id)
+    if kind is not None:
+        query = query.filter_by(kind=kind)
+    return query.order_by(RuleChunk.rulebook_id, RuleChunk.position).all()
+
+
+def chunk_records(rulebook_id):
+    return [{'text': c.text, 'section': c.section, 'kind': c.kind} for c in fetch_chunks(rulebook_id)]
@@ -0,0 +1,74 @@
+# Content-addressed rulebook upload cache shared by every worker process
+#
+# Entries are JSON files named by the SHA-256 of the uploaded bytes, so the
+# same book re-uploaded under any name is a hit and different books can never
+# collide. Reads bump the file mtime; eviction drops the least recently used
+# entries once the entry count or total size exceeds its bound.
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'instance', 'rulebook_cache'))
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+class RulebookCache:
+    def __init__(self, directory=None, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or os.environ.get("RULEBOOK_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, digest):
+        if not _DIGEST.match(digest or ''):
+            raise ValueError("Cache keys must be hex SHA-256 digests")
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+            return value
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, digest, value):
+        path = self._path(digest)
+        fd, tmp = tempfile.mkstemp(prefix=f".{digest}-", dir=self.directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name.startswith('.'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # removed by another worker
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def __len__(self):
+        return sum(1 for n in os.listdir(self.directory) if n.endswith('.json') and not n.startswith('.'))
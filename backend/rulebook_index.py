@@ -0,0 +1,431 @@
+# Persistent, memory-mapped rule embedding indexes keyed by Rulebook.id
+#
+# Layout on disk (one directory per rulebook):
+#   <root>/<rulebook_id>/texts.json       chunk texts
+#   <root>/<rulebook_id>/embedder.json    HashingEmbedder dim and document count
+#   <root>/<rulebook_id>/doc_freq.npy     its document frequencies
+#   <root>/<rulebook_id>/embeddings.npy   normalized float32 embedding matrix
+#   <root>/<rulebook_id>/metadata.json    per-chunk section/kind columns
+#   <root>/<rulebook_id>/deleted.npy      rows deleted since it was written
+#
+# <root>/<rulebook_id> is a symlink to an immutable version directory under
+# <root>/.versions; publishing swaps the link with one os.replace, so readers
+# always see a complete index, old or new.
+#
+# delete_rows() deletes chunks durably: a new version hard-links the old
+# one's files and adds the deleted.npy tombstones, which every loader skips;
+# once tombstones pass COMPACT_RATIO the live rows are rewritten instead.
+#
+# Workers open embeddings.npy with np.load(mmap_mode='r'), so every process
+# shares one page-cache copy and startup does no embedding work. All indexes
+# share the hashed space, so their vectors are directly comparable. Older
+# indexes written with a TF-IDF vectorizer.json/idf.npy still load.
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from backend.ingest import page_chunks, chunk_metadata, chunk_texts
+from backend.utils_embedding import embed_texts, HashingEmbedder, SimpleVectorStore
+
+DEFAULT_INDEX_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'instance', 'rulebook_index'))
+VERSIONS_DIR = '.versions'
+LOAD_RETRIES = 3
+WRITE_BLOCK_ROWS = 4096  # embedding rows copied per block when writing an index
+COMPACT_RATIO = SimpleVectorStore.COMPACT_RATIO
+
+# Compactions done by this process, for ShardManager.stats()
+_metrics = {'compactions': 0, 'compaction_seconds_total': 0.0}
+_metrics_lock = threading.Lock()
+
+# Per-process cache of opened indexes: rulebook_id -> (store, embedder).
+# A hit is only served while the link still resolves to the version it was
+# mapped from, so a republish by another worker is picked up.
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def index_root(root=None):
+    return root or os.environ.get("RULEBOOK_INDEX_DIR") or DEFAULT_INDEX_ROOT
+
+
+def _index_dir(rulebook_id, root=None):
+    return os.path.join(index_root(root), str(int(rulebook_id)))
+
+
+def rulebook_chunks(rules, chunk_size=200):
+    # Flatten a Rulebook.rules JSON blob into chunk texts
+    return chunk_texts(page_chunks(rules or {}, chunk_size=chunk_size))
+
+
+def _persisted_columns(store):
+    # rulebook_id is implied by the directory (and differs for copied indexes)
+    return {field: column for field, column in store.columns.items() if field != 'rulebook_id'}
+
+
+def _write_index(path, texts, store, vectorizer, rows=None):
+    # rows: write only these rows of store (e.g. its live rows), in order
+    if rows is not None:
+        texts = [texts[i] for i in rows]
+    with open(os.path.join(path, 'texts.json'), 'w', encoding='utf-8') as f:
+        json.dump(list(texts), f)
+    dim = _write_vectorizer(path, vectorizer)
+    columns = _persisted_columns(store)
+    if rows is not None:
+        columns = {field: [column[i] for i in rows] for field, column in columns.items()}
+    if columns:
+        with open(os.path.join(path, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(columns, f)
+    _write_embeddings(os.path.join(path, 'embeddings.npy'), store.embeddings, dim, rows)
+
+
+def _write_vectorizer(path, vectorizer):
+    # Returns the embedding dimension
+    if isinstance(vectorizer, HashingEmbedder):
+        with open(os.path.join(path, 'embedder.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': vectorizer.dim, 'n_docs': vectorizer.n_docs}, f)
+        np.save(os.path.join(path, 'doc_freq.npy'), vectorizer.doc_freq)
+        return vectorizer.dim
+    with open(os.path.join(path, 'vectorizer.json'), 'w', encoding='utf-8') as f:
+        json.dump({k: int(v) for k, v in vectorizer.vocabulary_.items()}, f)
+    np.save(os.path.join(path, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float32))
+    return len(vectorizer.vocabulary_)
+
+
+def _write_embeddings(path, embeddings, dim, rows=None):
+    # Copy block by block into the new file, so a (memory-mapped) source is
+    # never gathered into one in-memory matrix
+    count = (0 if embeddings is None else embeddings.shape[0]) if rows is None else len(rows)
+    if count == 0:
+        np.save(path, np.zeros((0, dim if embeddings is None else embeddings.shape[1]), dtype=np.float32))
+        return
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(count, embeddings.shape[1]))
+    for start in range(0, count, WRITE_BLOCK_ROWS):
+        stop = min(count, start + WRITE_BLOCK_ROWS)
+        out[start:stop] = embeddings[start:stop] if rows is None else embeddings[rows[start:stop]]
+    out.flush()
+    del out
+
+
+class ChunkIndexWriter:
+    # Builds a staged index while chunk records stream in from ingest_pages:
+    # each batch is embedded as it arrives, its rows appended to a spool file
+    # and its records to a JSON-lines spool, so neither chunk texts nor
+    # embeddings are held for the whole document. finish() writes the index
+    # files into a staging directory for publish_index(); chunks() reads the
+    # records back, e.g. for rule_chunks.replace_chunks. close() removes the
+    # spools and anything left unpublished.
+    def __init__(self, root=None, embedder=None):
+        base = index_root(root)
+        os.makedirs(base, exist_ok=True)
+        self.embedder = embedder or HashingEmbedder()
+        self.count = 0
+        self.staging = None
+        self._spool = tempfile.mkdtemp(prefix=".spool-", dir=base)
+        self._rows = open(os.path.join(self._spool, 'embeddings.f32'), 'wb')
+        self._records = open(os.path.join(self._spool, 'chunks.jsonl'), 'w', encoding='utf-8')
+
+    def add(self, chunks):
+        if not chunks:
+            return
+        self._rows.write(self.embedder.embed_documents(chunk_texts(chunks)).astype(np.float32).tobytes())
+        self._records.writelines(json.dumps(chunk) + '\n' for chunk in chunks)
+        self.count += len(chunks)
+
+    def chunks(self):
+        self._records.flush()
+        with open(self._records.name, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def finish(self):
+        # Staging directory of the complete index, or None with no chunks
+        self._rows.close()
+        if not self.count:
+            return None
+        base = os.path.dirname(self._spool)
+        self.staging = tempfile.mkdtemp(prefix=".staged-", dir=base)
+        with open(os.path.join(self.staging, 'texts.json'), 'w', encoding='utf-8') as f:
+            _dump_list(f, (chunk['text'] for chunk in self.chunks()))
+        with open(os.path.join(self.staging, 'metadata.json'), 'w', encoding='utf-8') as f:
+            f.write('{"section": ')
+            _dump_list(f, (chunk.get('section') for chunk in self.chunks()))
+            f.write(', "kind": ')
+            _dump_list(f, (chunk.get('kind') or 'text' for chunk in self.chunks()))
+            f.write('}')
+        dim = _write_vectorizer(self.staging, self.embedder)
+        rows = np.memmap(self._rows.name, dtype=np.float32, mode='r', shape=(self.count, dim))
+        _write_embeddings(os.path.join(self.staging, 'embeddings.npy'), rows, dim)
+        del rows
+        return self.staging
+
+    def close(self):
+        self._rows.close()
+        self._records.close()
+        shutil.rmtree(self._spool, ignore_errors=True)
+        # publish_index moves the staging directory away
+        if self.staging and os.path.isdir(self.staging):
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def _dump_list(f, values):
+    # A JSON array written one value at a time
+    f.write('[')
+    for i, value in enumerate(values):
+        f.write((', ' if i else '') + json.dumps(value))
+    f.write(']')
+
+
+def stage_index(texts, store, vectorizer, root=None):
+    # Write an index into a fresh staging directory under root; publish it
+    # later with publish_index() once the owning rulebook id is known
+    base = index_root(root)
+    os.makedirs(base, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staged-", dir=base)
+    try:
+        _write_index(staging, texts, store, vectorizer)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return staging
+
+
+def publish_index(staging, rulebook_id, root=None):
+    # Swap a staged index in as the index of rulebook_id by repointing its
+    # symlink, so readers never see a missing or half-written index
+    base = index_root(root)
+    target = _index_dir(rulebook_id, root)
+    versions = os.path.join(base, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    version = os.path.join(versions, f"{int(rulebook_id)}-{uuid.uuid4().hex}")
+    os.replace(staging, version)
+    previous = os.path.realpath(target) if os.path.islink(target) else None
+    if os.path.isdir(target) and not os.path.islink(target):
+        # Plain directory from before versioning: a directory can't be
+        # atomically replaced by a link, so this one-time migration has a gap
+        previous = os.path.join(versions, f"{int(rulebook_id)}-legacy-{uuid.uuid4().hex}")
+        os.replace(target, previous)
+    link = os.path.join(base, f".link-{int(rulebook_id)}-{uuid.uuid4().hex}")
+    os.symlink(os.path.relpath(version, base), link)
+    os.replace(link, target)
+    if previous and previous != version:
+        # Readers that already mapped it keep their mapping; load_index
+        # retries one that resolved the old version just before this
+        shutil.rmtree(previous, ignore_errors=True)
+    with _loaded_lock:
+        _loaded.pop(int(rulebook_id), None)
+    return target
+
+
+def save_index(rulebook_id, texts, store, vectorizer, root=None):
+    return publish_index(stage_index(texts, store, vectorizer, root=root), rulebook_id, root=root)
+
+
+def build_index(rulebook_id, rules, root=None):
+    # Chunk and embed a Rulebook.rules blob, then persist it
+    chunks = page_chunks(rules or {})
+    return index_chunks(rulebook_id, chunk_texts(chunks), root=root, metadata=chunk_metadata(chunks))
+
+
+def embed_chunks(texts, embedder=None, metadata=None):
+    # Embed chunk texts into a fresh store; returns (store, embedder) or None
+    if not texts:
+        return None
+    embeddings, embedder = embed_texts(texts, embedder or HashingEmbedder())
+    store = SimpleVectorStore()
+    store.add(texts, embeddings, metadata)
+    return store, embedder
+
+
+def index_chunks(rulebook_id, texts, root=None, metadata=None):
+    # Embed already-chunked texts and persist them as one index
+    index = embed_chunks(texts, metadata=metadata)
+    if index is not None:
+        index[0].tag(rulebook_id=int(rulebook_id))
+        save_index(rulebook_id, texts, index[0], index[1], root=root)
+    return index
+
+
+def compact_index(rulebook_id, store, vectorizer, root=None):
+    # Publish a loaded index minus its tombstoned rows as a new version.
+    # Returns False, writing nothing, if the rulebook was republished since
+    # store was loaded.
+    started = time.perf_counter()
+    staging = _stage_from(rulebook_id, store, root)
+    if staging is None:
+        return False
+    try:
+        _write_index(staging, store.texts, store, vectorizer, rows=store.live_rows())
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if not _publish_if_current(staging, rulebook_id, store, root):
+        return False
+    with _metrics_lock:
+        _metrics['compactions'] += 1
+        _metrics['compaction_seconds_total'] += time.perf_counter() - started
+    return True
+
+
+def _stage_from(rulebook_id, store, root=None):
+    # A staging directory for a new version of the index store was loaded
+    # from, or None if that is no longer the published version
+    if store.source is None or os.path.realpath(_index_dir(rulebook_id, root)) != store.source:
+        return None
+    return tempfile.mkdtemp(prefix=".staged-", dir=index_root(root))
+
+
+def _publish_if_current(staging, rulebook_id, store, root=None):
+    if os.path.realpath(_index_dir(rulebook_id, root)) != store.source:
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    publish_index(staging, rulebook_id, root=root)
+    return True
+
+
+def _publish_tombstones(rulebook_id, store, root=None):
+    # New version sharing the loaded one's files, with store's tombstones
+    staging = _stage_from(rulebook_id, store, root)
+    if staging is None:
+        return False
+    try:
+        for name in os.listdir(store.source):
+            if name == 'deleted.npy':
+                continue
+            source, target = os.path.join(store.source, name), os.path.join(staging, name)
+            try:
+                os.link(source, target)
+            except OSError:  # no hard links on this filesystem
+                shutil.copyfile(source, target)
+        np.save(os.path.join(staging, 'deleted.npy'), store.dead_rows())
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return _publish_if_current(staging, rulebook_id, store, root)
+
+
+def delete_rows(rulebook_id, where, root=None, compact_ratio=COMPACT_RATIO):
+    # Durably delete the chunks matching where (e.g. {'section': 'Magic'})
+    # from a published index; returns how many rows were deleted. A publish
+    # racing this one is retried on top of.
+    if not where:
+        raise ValueError("delete_rows needs a filter")
+    for attempt in range(LOAD_RETRIES):
+        index = load_index(rulebook_id, root=root)
+        if index is None:
+            return 0
+        store, vectorizer = index
+        deleted = store.delete_where(where)
+        if not deleted:
+            return 0
+        if store.tombstone_ratio >= compact_ratio:
+            published = compact_index(rulebook_id, store, vectorizer, root=root)
+        else:
+            published = _publish_tombstones(rulebook_id, store, root=root)
+        if published:
+            return deleted
+    raise RuntimeError(f"Index of rulebook {rulebook_id} kept changing while deleting from it")
+
+
+def index_metrics():
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def load_index(rulebook_id, root=None):
+    # Open a persisted index read-only; returns (store, embedder) or None
+    link = _index_dir(rulebook_id, root)
+    for attempt in range(LOAD_RETRIES):
+        if not os.path.isfile(os.path.join(link, 'embeddings.npy')):
+            return None
+        # Resolve the link once so every file comes from the same version
+        try:
+            return _load_version(os.path.realpath(link), rulebook_id)
+        except FileNotFoundError:
+            # That version was retired under us by a publish; take the new one
+            if attempt == LOAD_RETRIES - 1:
+                raise
+
+
+def _load_version(path, rulebook_id):
+    with open(os.path.join(path, 'texts.json'), encoding='utf-8') as f:
+        texts = json.load(f)
+    if os.path.isfile(os.path.join(path, 'embedder.json')):
+        with open(os.path.join(path, 'embedder.json'), encoding='utf-8') as f:
+            state = json.load(f)
+        vectorizer = HashingEmbedder(state['dim'], np.load(os.path.join(path, 'doc_freq.npy')), state['n_docs'])
+    else:
+        with open(os.path.join(path, 'vectorizer.json'), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        vectorizer = TfidfVectorizer(vocabulary=vocabulary)
+        vectorizer.idf_ = np.load(os.path.join(path, 'idf.npy'))
+    embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+    store = SimpleVectorStore.from_normalized(texts, embeddings)
+    if os.path.isfile(os.path.join(path, 'metadata.json')):
+        with open(os.path.join(path, 'metadata.json'), encoding='utf-8') as f:
+            for field, column in json.load(f).items():
+                store.set_column(field, column)
+    # Persisted indexes compact to disk (delete_rows), never into the heap
+    store.compact_ratio = None
+    if os.path.isfile(os.path.join(path, 'deleted.npy')):
+        store.delete(np.load(os.path.join(path, 'deleted.npy')))
+    store.tag(rulebook_id=int(rulebook_id))
+    store.source = path
+    return store, vectorizer
+
+
+def copy_index(source_id, rulebook_id, root=None):
+    # Reuse another rulebook's index files (same content) without re-embedding
+    source = os.path.realpath(_index_dir(source_id, root))
+    if not os.path.isfile(os.path.join(source, 'embeddings.npy')):
+        return None
+    staging = tempfile.mkdtemp(prefix=".staged-", dir=index_root(root))
+    try:
+        for name in os.listdir(source):
+            shutil.copyfile(os.path.join(source, name), os.path.join(staging, name))
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return publish_index(staging, rulebook_id, root=root)
+
+
+def delete_index(rulebook_id, root=None):
+    with _loaded_lock:
+        _loaded.pop(int(rulebook_id), None)
+    path = _index_dir(rulebook_id, root)
+    if os.path.islink(path):
+        version = os.path.realpath(path)
+        os.unlink(path)
+        shutil.rmtree(version, ignore_errors=True)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_index(rulebook, root=None):
+    # Cached lookup for a Rulebook row: open from disk, or build on first use
+    # from its RuleChunk rows (falling back to the legacy rules blob)
+    key = int(rulebook.id)
+    with _loaded_lock:
+        index = _loaded.get(key)
+    if index is not None and index[0].source == os.path.realpath(_index_dir(key, root)):
+        return index
+    index = load_index(key, root=root)
+    if index is None:
+        from backend.rule_chunks import chunk_records
+        chunks = chunk_records(key)
+        if chunks:
+            built = index_chunks(key, chunk_texts(chunks), root=root, metadata=chunk_metadata(chunks))
+        else:
+            built = build_index(key, rulebook.rules, root=root)
+        # Reopen memory-mapped, which also records the version it came from
+        index = load_index(key, root=root) if built is not None else None
+    if index is not None:
+        with _loaded_lock:
+            _loaded[key] = index
+    return index
@@ -0,0 +1,185 @@
+# Game session storage shared by every worker process
+#
+# A backend owns persistence (the database by default); SessionStore puts a
+# write-through, TTL-bounded LRU cache in front of it so hot sessions are
+# served from memory. Other workers fall through to the backend on a miss,
+# and a cached copy is at most ttl seconds stale. Backends also keep a version
+# per session, so read-modify-write (SessionStore.modify) works on the
+# authoritative copy and is retried rather than lost when workers race.
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300
+MAX_MODIFY_ATTEMPTS = 8
+
+
+class SessionConflict(RuntimeError):
+    pass
+
+
+class InMemorySessionBackend:
+    # Process-local backend, for tests and single-process development
+    def __init__(self):
+        self._data = {}  # session_id -> (version, data)
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        return self.load_versioned(session_id)[0]
+
+    def load_versioned(self, session_id):
+        with self._lock:
+            version, data = self._data.get(session_id, (None, None))
+            return (dict(data) if data is not None else None), version
+
+    def save(self, session_id, data):
+        with self._lock:
+            version = self._data.get(session_id, (0, None))[0]
+            self._data[session_id] = (version + 1, dict(data))
+
+    def save_if(self, session_id, data, version):
+        # Compare-and-swap: only if nobody saved since version was loaded
+        with self._lock:
+            if self._data.get(session_id, (None, None))[0] != version:
+                return False
+            self._data[session_id] = (version + 1, dict(data))
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+
+class DatabaseSessionBackend:
+    # Persists sessions in the game_session table
+    def load(self, session_id):
+        from backend.app import db
+        from backend.models import GameSession
+        row = db.session.get(GameSession, session_id)
+        return dict(row.data) if row is not None else None
+
+    def load_versioned(self, session_id):
+        from backend.app import db
+        from backend.models import GameSession
+        # populate_existing: the row as committed now, not as this request first saw it
+        row = db.session.get(GameSession, session_id, populate_existing=True)
+        return (dict(row.data), row.version) if row is not None else (None, None)
+
+    def save(self, session_id, data):
+        from backend.app import db
+        from backend.models import GameSession
+        row = db.session.get(GameSession, session_id)
+        if row is None:
+            db.session.add(GameSession(id=session_id, data=dict(data), version=1, updated_at=time.time()))
+        else:
+            row.data = dict(data)
+            row.version = (row.version or 0) + 1
+            row.updated_at = time.time()
+        db.session.commit()
+
+    def save_if(self, session_id, data, version):
+        # One conditional UPDATE: it matches no row if another worker saved first
+        from backend.app import db
+        from backend.models import GameSession
+        saved = GameSession.query.filter_by(id=session_id, version=version).update(
+            {'data': dict(data), 'version': version + 1, 'updated_at': time.time()}, synchronize_session=False)
+        db.session.commit()
+        return saved == 1
+
+    def delete(self, session_id):
+        from backend.app import db
+        from backend.models import CampaignArchiveTurn, GameSession
+        CampaignArchiveTurn.query.filter_by(session_id=session_id).delete()
+        GameSession.query.filter_by(id=session_id).delete()
+        db.session.commit()
+
+
+class SessionStore:
+    def __init__(self, backend, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, clock=time.monotonic):
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._cache = OrderedDict()  # session_id -> (expires_at, data)
+        self._lock = threading.Lock()
+
+    def _remember(self, session_id, data):
+        with self._lock:
+            self._cache[session_id] = (self._clock() + self.ttl, dict(data))
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._cache.move_to_end(session_id)
+                    return dict(entry[1])
+                del self._cache[session_id]
+        data = self.backend.load(session_id)
+        if data is not None:
+            self._remember(session_id, data)
+        return data
+
+    def save(self, session_id, data):
+        # Write-through: the backend is updated before the cache
+        self.backend.save(session_id, data)
+        self._remember(session_id, data)
+
+    def modify(self, session_id, change, attempts=MAX_MODIFY_ATTEMPTS):
+        # Read-modify-write on the backend's copy, never the possibly stale
+        # cache. change(data) returns the new data (None leaves the session
+        # alone) and is re-run on a fresh copy if another worker saved first.
+        for _ in range(attempts):
+            data, version = self.backend.load_versioned(session_id)
+            if data is None:
+                return None
+            data = change(data)
+            if data is None:
+                return None
+            if self.backend.save_if(session_id, data, version):
+                self._remember(session_id, data)
+                return dict(data)
+        raise SessionConflict(f"Session {session_id} kept changing; gave up after {attempts} attempts")
+
+    def update(self, session_id, updates):
+        return self.modify(session_id, lambda data: {**data, **updates})
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def cached_count(self):
+        with self._lock:
+            return len(self._cache)
+
+
+BACKENDS = {
+    'db': DatabaseSessionBackend,
+    'memory': InMemorySessionBackend,
+}
+
+
+def get_session_store(app=None):
+    # One store per Flask app, configured by SESSION_BACKEND ('db' or
+    # 'memory'), SESSION_CACHE_SIZE and SESSION_CACHE_TTL
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    store = app.extensions.get('session_store')
+    if store is None:
+        backend = BACKENDS[app.config.get('SESSION_BACKEND', 'db')]()
+        store = SessionStore(backend,
+                             max_size=app.config.get('SESSION_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                             ttl=app.config.get('SESSION_CACHE_TTL', DEFAULT_CACHE_TTL))
+        app.extensions['session_store'] = store
+    return store
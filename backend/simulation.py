@@ -0,0 +1,164 @@
+# Monte Carlo encounter simulation: "is this encounter deadly?"
+#
+# Each trial plays a whole fight, resolved with the engine's own rules rather
+# than a copy of them: turn order is initiative.turn_order (the
+# InitiativeTracker key, vectorized over trials) on d20 + modifier, and every
+# d20 check goes through engine.resolve_checks, the rule behind
+# CombatantTable.check and Engine.skill_check (natural 1 fails, natural 20
+# succeeds). An attacker picks a random living opponent and either makes an
+# attack roll against its AC or, with save_dc set, has it make a saving throw
+# (a skill check with its save modifier) that halves the damage on success.
+# Damage uses the full dice grammar.
+#
+# Trials are vectorized in fixed-size chunks. Chunk i draws from
+# SeedSequence([seed, i]), so a run reproduces exactly for the same seed and
+# trial count, whatever the worker count; without a seed a fresh one is drawn
+# and reported. Chunks fan out over a process pool and their counts are
+# summed, which is order-independent.
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from backend.dice import compile_expression
+from backend.engine import resolve_checks
+from backend.initiative import turn_order
+
+CHUNK_TRIALS = 1000
+DEFAULT_MAX_ROUNDS = 50
+DRAW = 'draw'
+
+
+class CombatantSpec(NamedTuple):
+    name: str
+    side: str
+    hp: int
+    ac: int
+    attack: int = 0  # to-hit modifier
+    damage: str = '1d6'
+    initiative: int = 0  # initiative modifier
+    save: int = 0  # saving throw modifier
+    save_dc: int = 0  # > 0: targets save against this instead of being attacked
+
+
+def run_chunk(combatants: Sequence[CombatantSpec], trials: int, seed: int, chunk: int,
+              max_rounds: int = DEFAULT_MAX_ROUNDS) -> Dict:
+    # Simulate `trials` fights at once; returns summable counts
+    rng = np.random.default_rng(np.random.SeedSequence([seed, chunk]))
+    n = len(combatants)
+    sides = sorted({c.side for c in combatants})
+    side_of = np.array([sides.index(c.side) for c in combatants])
+    side_matrix = np.eye(len(sides), dtype=np.int64)[side_of]  # (n, sides)
+    opponents = side_of[:, None] != side_of[None, :]
+    attack = np.array([c.attack for c in combatants])
+    ac = np.array([c.ac for c in combatants])
+    save = np.array([c.save for c in combatants])
+    save_dc = np.array([c.save_dc for c in combatants])
+    damage = [compile_expression(c.damage) for c in combatants]
+
+    rows = np.arange(trials)
+    hp = np.tile(np.array([c.hp for c in combatants], dtype=np.int64), (trials, 1))
+    initiative = rng.integers(1, 21, size=(trials, n)) + np.array([c.initiative for c in combatants])
+    order = turn_order(initiative, [c.name for c in combatants])
+
+    done = np.zeros(trials, dtype=bool)
+    winner = np.full(trials, -1)
+    rounds = np.full(trials, max_rounds)
+    for rnd in range(1, max_rounds + 1):
+        for turn in range(n):
+            actor = order[:, turn]
+            alive = hp > 0
+            targets = alive & opponents[actor]
+            acting = ~done & alive[rows, actor] & targets.any(axis=1)
+            if not acting.any():
+                continue
+            target = np.where(targets, rng.random((trials, n)), -1.0).argmax(axis=1)
+            # The turn's d20 is the attack roll, or the target's saving throw
+            roll = rng.integers(1, 21, size=trials)
+            saving = save_dc[actor] > 0
+            _, hit = resolve_checks(roll, attack[actor], ac[target])
+            _, saved = resolve_checks(roll, save[target], save_dc[actor])
+            hit = acting & (saving | hit)
+            dealt = np.zeros(trials, dtype=np.int64)
+            for c in range(n):
+                idx = np.flatnonzero(hit & (actor == c))
+                if idx.size:
+                    dealt[idx] = np.maximum(damage[c].sample(idx.size, rng=rng), 0)
+            dealt = np.where(saving & saved, dealt // 2, dealt)
+            hp[rows, target] -= dealt
+            standing = (hp > 0).astype(np.int64) @ side_matrix > 0
+            ended = ~done & (standing.sum(axis=1) <= 1)
+            if ended.any():
+                winner[ended] = np.where(standing[ended].any(axis=1), standing[ended].argmax(axis=1), -1)
+                rounds[ended] = rnd
+                done |= ended
+        if done.all():
+            break
+    return {
+        'wins': np.bincount(winner + 1, minlength=len(sides) + 1),  # slot 0 counts draws
+        'rounds': np.bincount(rounds, minlength=max_rounds + 1),
+        'deaths': (hp <= 0).sum(axis=0),
+    }
+
+
+def _chunks(trials: int):
+    for start in range(0, trials, CHUNK_TRIALS):
+        yield start // CHUNK_TRIALS, min(CHUNK_TRIALS, trials - start)
+
+
+def simulate(combatants: Sequence[CombatantSpec], trials: int = 10000, seed: Optional[int] = None,
+             max_rounds: int = DEFAULT_MAX_ROUNDS, workers: Optional[int] = None,
+             executor: Optional[ProcessPoolExecutor] = None) -> Dict:
+    # Run `trials` fights and aggregate win rates and fight lengths.
+    # death_rates is aligned with the roster (names need not be unique). The
+    # seed used (drawn fresh when None) is reported, to replay the run. Pass
+    # an executor to reuse a warm pool; workers=1 runs in this process.
+    combatants = [CombatantSpec(*c) for c in combatants]
+    sides = sorted({c.side for c in combatants})
+    if len(sides) < 2:
+        raise ValueError("An encounter needs combatants on at least two sides")
+    if trials < 1:
+        raise ValueError("trials must be positive")
+    for c in combatants:
+        compile_expression(c.damage)  # reject bad dice before fanning out
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy)
+    jobs = list(_chunks(trials))
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if executor is None and workers <= 1:
+        parts = [run_chunk(combatants, size, seed, chunk, max_rounds) for chunk, size in jobs]
+    else:
+        # spawn: never fork a threaded web worker
+        pool = executor or ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            futures = [pool.submit(run_chunk, combatants, size, seed, chunk, max_rounds) for chunk, size in jobs]
+            parts = [f.result() for f in futures]
+        finally:
+            if executor is None:
+                pool.shutdown()
+    wins = sum(p['wins'] for p in parts)
+    rounds = sum(p['rounds'] for p in parts)
+    deaths = sum(p['deaths'] for p in parts)
+    return _summary(combatants, sides, trials, seed, wins, rounds, deaths)
+
+
+def _summary(combatants: List[CombatantSpec], sides: List[str], trials: int, seed: int,
+             wins: np.ndarray, rounds: np.ndarray, deaths: np.ndarray) -> Dict:
+    lengths = np.arange(len(rounds))
+    cumulative = np.cumsum(rounds)
+    win_rates = {side: float(wins[i + 1]) / trials for i, side in enumerate(sides)}
+    win_rates[DRAW] = float(wins[0]) / trials
+    return {
+        'trials': trials,
+        'seed': seed,
+        'win_rates': win_rates,
+        'rounds': {
+            'mean': float((lengths * rounds).sum()) / trials,
+            'median': int(np.searchsorted(cumulative, trials / 2)),
+            'p90': int(np.searchsorted(cumulative, trials * 0.9)),
+            'distribution': {int(r): int(count) for r, count in enumerate(rounds) if count},
+        },
+        'death_rates': [float(d) / trials for d in deaths],
+    }
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from backend.ann_index import IVFIndex, recall_at_k, spherical_kmeans
+from backend.utils_embedding import SimpleVectorStore, retrieve_rules, embed_texts
+
+def clustered(n, dim=16, topics=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dim))
+    return centers[rng.integers(0, topics, n)] + 0.3 * rng.normal(size=(n, dim))
+
+def test_untrained_index_matches_exact_search():
+    rows = clustered(20)
+    texts = [f"r{i}" for i in range(20)]
+    index, exact = IVFIndex(), SimpleVectorStore()
+    index.add(texts, rows)
+    exact.add(texts, rows)
+    assert not index.trained
+    assert IVFIndex().search_batch(rows[:3], top_k=5) == [[], [], []]
+    assert index.search_batch(rows[:3], top_k=5) == exact.search_batch(rows[:3], top_k=5)
+
+def test_trains_lists_and_files_every_row():
+    rows = clustered(2000)
+    index = IVFIndex(n_lists=16)
+    for start in range(0, 2000, 250):
+        index.add([f"r{i}" for i in range(start, start + 250)], rows[start:start + 250])
+    assert index.trained and index.n_lists == 16
+    assert sum(index.list_sizes()) == len(index) == 2000
+
+def test_nprobe_trades_latency_for_recall():
+    rows = clustered(3000, seed=1)
+    queries = clustered(50, seed=2)
+    texts = [f"r{i}" for i in range(3000)]
+    index, exact = IVFIndex(n_lists=32, nprobe=1), SimpleVectorStore()
+    index.add(texts, rows)
+    exact.add(texts, rows)
+    truth = exact.search_batch(queries, top_k=10)
+    recalls = [recall_at_k(index.search_batch(queries, top_k=10, nprobe=p), truth) for p in (1, 4, 32)]
+    assert recalls[0] <= recalls[1] <= recalls[2]
+    assert recalls[1] > 0.9
+    # Probing every list is the exact search (up to float rounding)
+    everything = index.search_batch(queries, top_k=10, nprobe=32)
+    assert [[t for t, _ in hits] for hits in everything] == [[t for t, _ in hits] for hits in truth]
+    assert np.allclose([d for hits in everything for _, d in hits], [d for hits in truth for _, d in hits], atol=1e-5)
+
+def test_automatic_lists_retrain_as_corpus_grows():
+    rows = clustered(5000, seed=3)
+    index = IVFIndex()
+    index.add([f"r{i}" for i in range(100)], rows[:100])
+    first = index.n_lists
+    index.add([f"r{i}" for i in range(100, 5000)], rows[100:])
+    assert index.n_lists > first and sum(index.list_sizes()) == 5000
+    assert index.search(rows[4321:4322], top_k=1)[0][0] == "r4321"
+
+def test_spherical_kmeans_returns_unit_centroids():
+    rows = clustered(500)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    centroids = spherical_kmeans(rows.astype(np.float32), 8)
+    assert centroids.shape == (8, 16)
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1.0, atol=1e-5)
+
+def test_drop_in_for_rule_retrieval():
+    from backend.utils_embedding import HashingEmbedder
+    rules = ["Stealth: Roll a d20 to sneak.", "Charisma: Roll to persuade NPCs."]
+    embedder = HashingEmbedder()
+    index = IVFIndex()
+    index.add(rules, embed_texts(rules, embedder)[0])
+    assert retrieve_rules(index, embedder, ["sneak past", "persuade the king"]) == [[rules[0]], [rules[1]]]
+    with pytest.raises(ValueError):
+        index.add(["x"], np.ones((1, 3)))
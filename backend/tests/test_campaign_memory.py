@@ -0,0 +1,165 @@
+from backend.campaign_memory import CampaignMemory, extractive_summary
+from backend.prompt_assembler import assemble_prompt, count_tokens
+from backend.session_store import InMemorySessionBackend, SessionStore
+
+def make_memory(**kwargs):
+    store = SessionStore(InMemorySessionBackend())
+    store.save('s', {'active': True})
+    return store, CampaignMemory(store, recent_turns=4, segment_turns=4, fanout=2, **kwargs)
+
+def play(memory, turns, start=0):
+    for i in range(start, start + turns):
+        memory.record('s', f"Action {i}", f"Outcome {i} happens. Details of turn {i}.")
+
+def test_recent_turns_stay_verbatim_until_a_segment_fills():
+    store, memory = make_memory()
+    play(memory, 7)
+    data = store.get('s')
+    assert len(data['memory']) == 7 and data.get('summaries', []) == []
+    play(memory, 1, start=7)
+    data = store.get('s')
+    assert [t['player'] for t in data['memory']] == ['Action 4', 'Action 5', 'Action 6', 'Action 7']
+    assert data['summaries'] == [{'level': 1, 'first': 1, 'last': 4,
+                                  'summary': extractive_summary([f"Action {i}: Outcome {i} happens." for i in range(4)])}]
+    assert memory.archive.load('s')[0] == "Player: Action 0 / GM: Outcome 0 happens. Details of turn 0."
+    assert 'archive' not in data
+    assert data['turns'] == 8
+
+def test_summaries_fold_into_higher_levels():
+    store, memory = make_memory()
+    play(memory, 4 + 4 * 4)  # four segments compacted
+    summaries = store.get('s')['summaries']
+    assert [(s['level'], s['first'], s['last']) for s in summaries] == [(3, 1, 16)]
+    play(memory, 4, start=20)
+    summaries = store.get('s')['summaries']
+    assert [(s['level'], s['first'], s['last']) for s in summaries] == [(3, 1, 16), (1, 17, 20)]
+
+def test_prompt_cost_stays_flat_over_a_long_campaign():
+    store, memory = make_memory()
+    sizes = []
+    for block in range(8):
+        play(memory, 32, start=block * 32)
+        items = memory.prompt_memory('s', query="Action 5")
+        sizes.append(count_tokens(assemble_prompt("Go", budget=100000, memory=items).text))
+    assert max(sizes[3:]) <= 1.5 * min(sizes[3:])
+    assert store.get('s')['turns'] == 256
+
+def test_recall_finds_compacted_events():
+    store, memory = make_memory()
+    memory.record('s', "I bury the silver amulet under the old oak", "The amulet is hidden.")
+    play(memory, 12)
+    recalled = memory.recall('s', "where is the silver amulet?", top_k=1)
+    assert recalled == ["Player: I bury the silver amulet under the old oak / GM: The amulet is hidden."]
+    items = memory.prompt_memory('s', query="silver amulet")
+    assert items[0].keys() == {'summary'}
+    assert any(isinstance(i, str) and 'silver amulet' in i for i in items)
+    assert memory.recall('missing', "anything") == [] and memory.record('missing', 'a', 'b') is None
+
+def test_custom_summarizer_is_used():
+    seen = []
+    store, memory = make_memory(summarize=lambda parts, max_tokens: seen.append(parts) or f"{len(parts)} events")
+    play(memory, 8)
+    assert store.get('s')['summaries'][0]['summary'] == "4 events"
+    assert seen[0][0] == "Action 0: Outcome 0 happens."
+
+def test_chat_stream_uses_campaign_memory(app, client):
+    app.config.update(GM_MODEL='fake', MEMORY_RECENT_TURNS=2, MEMORY_SEGMENT_TURNS=2)
+    client.post('/api/kill_switch', json={'enabled': False})
+    session_id = client.post('/api/start_session').get_json()['session_id']
+    for line in ['one', 'two', 'three', 'four']:
+        client.post('/api/chat/stream', json={'message': line, 'session_id': session_id}).get_data()
+    from backend.session_store import get_session_store
+    data = get_session_store(app).get(session_id)
+    assert [t['player'] for t in data['memory']] == ['three', 'four']
+    assert len(data['summaries']) == 1 and data['turns'] == 4
+
+def test_recall_embeds_only_newly_compacted_turns(monkeypatch):
+    from backend.utils_embedding import HashingEmbedder
+    store, memory = make_memory()
+    embedded = []
+    original = HashingEmbedder.embed_documents
+    monkeypatch.setattr(HashingEmbedder, 'embed_documents',
+                        lambda self, texts, update=True: embedded.append(len(texts)) or original(self, texts, update))
+    play(memory, 4)
+    memory.record('s', "I feed the griffon", "It purrs.")
+    play(memory, 3, start=5)
+    memory.recall('s', "Action 1")  # indexes turns 0-3
+    play(memory, 4, start=8)  # compacts the griffon's segment
+    assert memory.recall('s', "the griffon", top_k=1) == ["Player: I feed the griffon / GM: It purrs."]
+    assert embedded == [4, 4]
+
+def test_slow_recall_does_not_block_other_sessions():
+    import threading
+    from backend.campaign_memory import InMemoryArchive
+    release, loading = threading.Event(), threading.Event()
+
+    class SlowArchive(InMemoryArchive):
+        def load(self, session_id, after=0):
+            if session_id == 'slow':
+                loading.set()
+                release.wait(5)
+            return super().load(session_id, after)
+    archive = SlowArchive()
+    memory = CampaignMemory(SessionStore(InMemorySessionBackend()), archive=archive)
+    archive.append('slow', 1, ["Player: I open the vault / GM: It is empty."])
+    archive.append('fast', 1, ["Player: I feed the griffon / GM: It purrs."])
+    slow = threading.Thread(target=memory.recall, args=('slow', 'vault'))
+    slow.start()
+    assert loading.wait(5)
+    found = []
+    fast = threading.Thread(target=lambda: found.extend(memory.recall('fast', 'griffon', top_k=1)))
+    fast.start()
+    fast.join(2)
+    finished = not fast.is_alive()
+    release.set()
+    slow.join(5)
+    fast.join(5)
+    assert finished and found == ["Player: I feed the griffon / GM: It purrs."]
+
+def test_workers_with_stale_caches_keep_every_turn():
+    # Two workers' stores over one backend, each with its own cached copy
+    backend = InMemorySessionBackend()
+    worker_a, worker_b = SessionStore(backend), SessionStore(backend)
+    worker_a.save('s', {'active': True})
+    memory_a, memory_b = CampaignMemory(worker_a), CampaignMemory(worker_b)
+    worker_b.get('s')  # cached before worker_a records
+    memory_a.record('s', 'Action A', 'Outcome A.')
+    memory_b.record('s', 'Action B', 'Outcome B.')
+    data = backend.load('s')
+    assert [t['player'] for t in data['memory']] == ['Action A', 'Action B'] and data['turns'] == 2
+
+def test_conflicting_writes_are_retried_on_fresh_data():
+    store, memory = make_memory()
+    original = store.backend.save_if
+    raced = []
+
+    def save_if(session_id, data, version):
+        if not raced:
+            raced.append(True)
+            store.backend.save('s', {**store.backend.load('s'), 'note': 'written meanwhile'})
+        return original(session_id, data, version)
+    store.backend.save_if = save_if
+    memory.record('s', 'Action 0', 'Outcome 0.')
+    data = store.get('s')
+    assert data['note'] == 'written meanwhile' and data['turns'] == 1
+
+def test_database_archive_rows(app, client):
+    from backend.app import db
+    from backend.models import CampaignArchiveTurn, GameSession
+    from backend.session_store import DatabaseSessionBackend
+    from backend.campaign_memory import DatabaseArchive
+    with app.app_context():
+        store = SessionStore(DatabaseSessionBackend())
+        store.save('s', {'active': True, 'archive': ['Player: Old / GM: Legacy turn.'], 'turns': 5,
+                         'memory': [{'player': f"Action {i}", 'gm': 'Fine.'} for i in range(4)]})
+        memory = CampaignMemory(store, recent_turns=4, segment_turns=4, fanout=2, archive=DatabaseArchive(max_turns=6))
+        play(memory, 8, start=4)
+        # The legacy JSON archive (turn 1) moved into rows ahead of the
+        # compacted turns 2-9, then all but the newest six were trimmed
+        assert 'archive' not in db.session.get(GameSession, 's').data
+        assert memory.archive.bounds('s') == (4, 9)
+        assert memory.archive.load('s', after=7) == [f"Player: Action {i} / GM: Outcome {i} happens. Details of turn {i}."
+                                                     for i in (6, 7)]
+        assert memory.recall('s', 'outcome 5 happens, details of turn 5', top_k=1) == ["Player: Action 5 / GM: Outcome 5 happens. Details of turn 5."]
+        store.delete('s')
+        assert CampaignArchiveTurn.query.filter_by(session_id='s').count() == 0
@@ -0,0 +1,145 @@
+import json
+import pytest
+from backend import gpt4_utils
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        event, data = 'message', None
+        for line in block.split('\n'):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+        events.append((event, data))
+    return events
+
+@pytest.fixture
+def stream_client(app, client):
+    app.config['GM_MODEL'] = 'fake'
+    client.post('/api/kill_switch', json={'enabled': False})
+    return client
+
+def test_stream_sends_tokens_then_done(stream_client):
+    response = stream_client.post('/api/chat/stream', json={'message': 'I open the door'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    tokens = [data['token'] for event, data in events if event == 'message']
+    assert len(tokens) > 1
+    assert events[-1] == ('done', {'text': 'AI says: I open the door'})
+    assert ''.join(tokens) == events[-1][1]['text']
+
+def test_stream_is_lazy(app, stream_client):
+    # The first token is sent before the model has finished generating
+    produced = []
+
+    def slow_model(prompt):
+        for token in ['one ', 'two ', 'three']:
+            produced.append(token)
+            yield token
+    gpt4_utils.STREAMERS['slow'] = slow_model
+    app.config['GM_MODEL'] = 'slow'
+    try:
+        response = stream_client.post('/api/chat/stream', json={'message': 'go'}, buffered=False)
+        first = next(response.response)
+        assert b'one' in first and produced == ['one ']
+        response.close()
+    finally:
+        del gpt4_utils.STREAMERS['slow']
+
+def test_stream_records_session_memory(stream_client):
+    session_id = stream_client.post('/api/start_session').get_json()['session_id']
+    stream_client.post('/api/chat/stream', json={'message': 'Hello', 'session_id': session_id}).get_data()
+    captured = {}
+
+    def capture(prompt):
+        captured['prompt'] = prompt
+        yield 'ok'
+    gpt4_utils.STREAMERS['capture'] = capture
+    stream_client.application.config['GM_MODEL'] = 'capture'
+    try:
+        stream_client.post('/api/chat/stream', json={'message': 'Again', 'session_id': session_id}).get_data()
+    finally:
+        del gpt4_utils.STREAMERS['capture']
+    assert "AI says: Hello" in captured['prompt'] and captured['prompt'].endswith('Player: Again')
+
+def test_stream_errors(app, stream_client):
+    assert stream_client.post('/api/chat/stream', json={'message': '  '}).status_code == 400
+    assert stream_client.post('/api/chat/stream', json={'message': 'x', 'session_id': 'nope'}).status_code == 404
+
+    def broken(prompt):
+        yield 'partial '
+        raise RuntimeError('model went away')
+    gpt4_utils.STREAMERS['broken'] = broken
+    app.config['GM_MODEL'] = 'broken'
+    try:
+        events = parse_events(stream_client.post('/api/chat/stream', json={'message': 'x'}).get_data(as_text=True))
+    finally:
+        del gpt4_utils.STREAMERS['broken']
+    assert events[0] == ('message', {'token': 'partial '})
+    assert events[-1] == ('error', {'error': 'An internal error has occurred'})
+    stream_client.post('/api/kill_switch', json={'enabled': True})
+    try:
+        assert stream_client.post('/api/chat/stream', json={'message': 'x'}).status_code == 403
+    finally:
+        stream_client.post('/api/kill_switch', json={'enabled': False})
+
+def test_openai_streamer_parses_deltas(monkeypatch):
+    import httpx
+    body = ''.join(f"data: {json.dumps({'choices': [{'delta': {'content': t}}]})}\n\n" for t in ['Roll ', 'for ', 'it.'])
+    body = "data: " + json.dumps({'choices': [{'delta': {'role': 'assistant'}}]}) + "\n\n" + body + "data: [DONE]\n\n"
+    seen = {}
+
+    def handler(request):
+        seen['payload'] = json.loads(request.content)
+        seen['auth'] = request.headers['authorization']
+        return httpx.Response(200, text=body, headers={'content-type': 'text/event-stream'})
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-stream")
+    monkeypatch.setattr(gpt4_utils, '_sync_http', httpx.Client(base_url=gpt4_utils.DEFAULT_BASE_URL,
+                                                                transport=httpx.MockTransport(handler)))
+    assert list(gpt4_utils.stream_gpt4_api("prompt")) == ['Roll ', 'for ', 'it.']
+    assert seen['payload']['stream'] is True and seen['auth'] == 'Bearer sk-stream'
+    assert gpt4_utils.get_streamer() is gpt4_utils.stream_gpt4_api
+    monkeypatch.delenv("OPENAI_API_KEY")
+    assert gpt4_utils.get_streamer() is gpt4_utils.fake_stream
+    with pytest.raises(ValueError):
+        gpt4_utils.get_streamer('nope')
+
+def test_repeated_prompt_is_served_from_response_cache(app, stream_client):
+    from backend.response_cache import get_response_cache
+    calls = []
+
+    def counted(prompt):
+        calls.append(prompt)
+        yield 'The door creaks '
+        yield 'open.'
+    gpt4_utils.STREAMERS['counted'] = counted
+    app.config['GM_MODEL'] = 'counted'
+    get_response_cache().clear()
+    try:
+        bodies = []
+        for universe_id in (7, 7, 8):
+            session_id = stream_client.post('/api/start_session', json={'universe_id': universe_id}).get_json()['session_id']
+            body = stream_client.post('/api/chat/stream', json={'message': 'I push the door', 'session_id': session_id})
+            bodies.append(parse_events(body.get_data(as_text=True)))
+    finally:
+        del gpt4_utils.STREAMERS['counted']
+    # The second universe-7 session hits; universe 8 is its own namespace
+    assert len(calls) == 2
+    assert bodies[1] == [('message', {'token': 'The door creaks open.'}), ('done', {'text': 'The door creaks open.'})]
+    assert bodies[0][-1] == bodies[2][-1] == ('done', {'text': 'The door creaks open.'})
+    assert stream_client.post('/api/start_session', json={'universe_id': 'x'}).status_code == 400
+
+def test_streamed_replies_share_cache_entries_with_completions(monkeypatch):
+    from backend.response_cache import ResponseCache
+    cache = ResponseCache()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-cache")
+    monkeypatch.setattr(gpt4_utils, 'call_gpt4_api', lambda prompt: "The guard waves you through.")
+    gpt4_utils.call_gpt4_api_cached("I bribe the guard", universe_id=2, cache=cache)
+    params = gpt4_utils.streamer_params(gpt4_utils.stream_gpt4_api)
+    assert cache.get("I bribe the guard", namespace=2, **params) == "The guard waves you through."
+    # Another model is another key
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o")
+    assert cache.get("I bribe the guard", namespace=2, **gpt4_utils.streamer_params(gpt4_utils.stream_gpt4_api)) is None
+    assert gpt4_utils.streamer_params(gpt4_utils.fake_stream) == {'model': 'fake_stream'}
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from backend.engine import Character, CombatantTable, Engine
+
+def test_character_is_a_slotted_view():
+    char = Character('Hero', 2)
+    with pytest.raises(AttributeError):
+        char.hp = 10
+    assert char.initiative is None and char.last_check_result is None
+    char.initiative = 14
+    char.modifier = 3
+    assert (char.name, char.modifier, char.initiative) == ('Hero', 3, 14)
+
+def test_engine_adopts_characters_with_their_state():
+    hero = Character('Hero', 4)
+    hero.initiative = 12
+    Engine([Character('Other')]).skill_check(hero, dc=10, roll=9)
+    engine = Engine([hero])
+    assert hero._table is engine.table
+    assert hero.initiative == 12
+    assert hero.last_check_result == {'roll': 9, 'modifier': 4, 'total': 13, 'result': True, 'desc': 'Success'}
+
+def test_group_skill_check_matches_single_checks():
+    engine = Engine([])
+    goblins = engine.spawn('Goblin', 200, modifier=2)
+    assert len(engine.characters) == 200 and goblins[199].name == 'Goblin 200'
+    rolls = np.random.default_rng(0).integers(1, 21, size=200)
+    results = engine.group_skill_check(goblins, dc=13, rolls=rolls)
+    loner = Engine([Character('Goblin', 2)])
+    for goblin, roll, result in zip(goblins, rolls, results):
+        assert loner.skill_check(loner.characters[0], dc=13, roll=int(roll)) == result
+        assert goblin.last_check_result == loner.characters[0].last_check_result
+
+def test_group_skill_check_is_seeded_and_handles_naturals():
+    engine = Engine([])
+    group = engine.spawn('Orc', 50, modifier=-30)
+    first = engine.group_skill_check(group, dc=5, seed=7).copy()
+    assert np.array_equal(first, engine.group_skill_check(group, dc=5, seed=7))
+    # Only natural 20s succeed with a -30 modifier
+    rolls = np.array([c.last_check_result['roll'] for c in group])
+    assert np.array_equal(first, rolls == 20)
+
+def test_table_grows_past_initial_capacity():
+    table = CombatantTable(2)
+    views = table.extend([f"T{i}" for i in range(100)], np.arange(100))
+    assert len(table) == 100
+    assert [v.modifier for v in views[-3:]] == [97, 98, 99]
@@ -0,0 +1,208 @@
+import random
+import numpy as np
+import pytest
+from backend.dice import compile_expression, DiceError, DiceTerm, summarize
+from backend.engine import Engine
+
+def test_parse_full_grammar():
+    expr = compile_expression("4d6kh3 + 2d8 + 5")
+    assert expr.terms == ((1, DiceTerm(4, 6, False, ('h', 3))), (1, DiceTerm(2, 8)))
+    assert expr.constant == 5
+    assert str(expr) == "4d6kh3+2d8+5"
+    assert compile_expression("1d20ADV").terms[0][1] == DiceTerm(2, 20, False, ('h', 1))
+    assert compile_expression("d20dis-1").terms[0][1].keep == ('l', 1)
+    assert compile_expression("d%").terms[0][1].sides == 100
+    # Drop highest 1 of 4 is keep lowest 3
+    assert compile_expression("4d6dh1").terms[0][1].keep == ('l', 3)
+
+def test_compiled_expressions_are_cached():
+    assert compile_expression("2d6 + 1") is compile_expression("2D6+1")
+
+@pytest.mark.parametrize("bad", ["", "badinput", "0d6", "2d0", "d", "2d6d8", "1d20dh1", "3d1!", "2d20adv", "5+", "2d6+-3"])
+def test_invalid_expressions_raise(bad):
+    with pytest.raises(DiceError):
+        compile_expression(bad)
+
+def test_single_roll_matches_legacy_ndm_rng_sequence():
+    rng = random.Random(123)
+    legacy = [rng.randint(1, 6) for _ in range(2)]
+    assert compile_expression("2d6").roll(seed=123) == {'rolls': legacy, 'total': sum(legacy)}
+
+def test_keep_and_exploding_single_rolls():
+    result = compile_expression("4d6kh3").roll(seed=5)
+    assert len(result['rolls']) == 4
+    assert result['total'] == sum(sorted(result['rolls'])[1:])
+    for seed in range(50):
+        result = compile_expression("1d2!").roll(seed=seed)
+        # Every face but the last is a max (the reason it rolled again)
+        assert all(face == 2 for face in result['rolls'][:-1])
+        assert result['total'] == sum(result['rolls'])
+
+def test_vectorized_sample_is_reproducible_and_in_range():
+    expr = compile_expression("4d6kh3+2d8+5")
+    totals = expr.sample(20000, seed=7)
+    assert totals.shape == (20000,)
+    assert np.array_equal(totals, expr.sample(20000, seed=7))
+    assert totals.min() >= 3 + 2 + 5 and totals.max() <= 18 + 16 + 5
+    # 4d6kh3 averages ~12.24, 2d8 averages 9
+    assert totals.mean() == pytest.approx(12.24 + 9 + 5, abs=0.15)
+
+def test_advantage_and_exploding_sample_statistics():
+    adv = compile_expression("1d20adv").sample(50000, seed=1)
+    dis = compile_expression("1d20dis").sample(50000, seed=1)
+    assert adv.mean() == pytest.approx(13.825, abs=0.15)
+    assert dis.mean() == pytest.approx(7.175, abs=0.15)
+    exploding = compile_expression("1d6!").sample(50000, seed=2)
+    assert exploding.mean() == pytest.approx(4.2, abs=0.1)
+    assert (exploding % 6 != 0).all()
+
+def test_summarize_reports_distribution():
+    summary = summarize(np.array([1, 2, 2, 3]))
+    assert summary['mean'] == 2.0
+    assert summary['min'] == 1 and summary['max'] == 3
+    assert summary['histogram'] == {'1': 1, '2': 2, '3': 1}
+
+def test_engine_roll_dice_accepts_expressions():
+    engine = Engine([])
+    result = engine.roll_dice('2d6+1d4kh1', modifier=1, seed=3)
+    assert result['total'] == sum(result['rolls']) + 1
+    bulk = engine.roll_dice_bulk('1d20', 1000, modifier=2, seed=3)
+    assert bulk.min() >= 3 and bulk.max() <= 22
+
+def test_roll_dice_route_accepts_expressions(client):
+    client.post('/api/kill_switch', json={'enabled': False})
+    resp = client.post('/api/roll_dice', json={'expression': '4d6kh3+2'})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert len(data['rolls']) == 4
+    assert data['total'] == sum(sorted(data['rolls'])[1:]) + 2
+
+def test_roll_dice_batch_route(client):
+    client.post('/api/kill_switch', json={'enabled': False})
+    resp = client.post('/api/roll_dice/batch', json={'expression': '2d6', 'trials': 5000, 'seed': 11})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['expression'] == '2d6' and data['trials'] == 5000
+    assert data['summary']['mean'] == pytest.approx(7.0, abs=0.15)
+    assert sum(data['summary']['histogram'].values()) == 5000
+    raw = client.post('/api/roll_dice/batch', json={'expression': '1d4', 'trials': 10, 'summary': False, 'seed': 11}).get_json()
+    assert len(raw['totals']) == 10
+    bad = client.post('/api/roll_dice/batch', json={'expression': '1d4', 'trials': 0})
+    assert bad.status_code == 400
+
+def test_roll_dice_batch_caps_dice_and_work(client):
+    client.post('/api/kill_switch', json={'enabled': False})
+    too_many_dice = client.post('/api/roll_dice/batch', json={'expression': '1000d6', 'trials': 1})
+    assert too_many_dice.status_code == 400
+    too_much_work = client.post('/api/roll_dice/batch', json={'expression': '100d6', 'trials': 1_000_000})
+    assert too_much_work.status_code == 400
+
+def test_large_samples_are_drawn_in_blocks(monkeypatch):
+    from backend import dice
+    monkeypatch.setattr(dice, 'SAMPLE_CHUNK_DICE', 64)
+    totals = compile_expression("10d6kh3+1").sample(1000, seed=5)
+    assert totals.shape == (1000,)
+    assert totals.min() >= 4 and totals.max() <= 19
+    assert totals.mean() == pytest.approx(dice.pmf("10d6kh3+1").mean(), abs=0.2)
+
+def brute_force(expression):
+    # Enumerate every outcome of a tiny expression with itertools.product
+    import itertools
+    from collections import Counter
+    expr = compile_expression(expression)
+    per_term = []
+    for sign, term in expr.terms:
+        outcomes = Counter()
+        for faces in itertools.product(range(1, term.sides + 1), repeat=term.count):
+            ordered = sorted(faces)
+            kept = ordered if term.keep is None else (ordered[-term.keep[1]:] if term.keep[0] == 'h' else ordered[:term.keep[1]])
+            outcomes[sign * sum(kept)] += 1
+        per_term.append(outcomes)
+    totals = Counter({expr.constant: 1})
+    for outcomes in per_term:
+        nxt = Counter()
+        for a, wa in totals.items():
+            for b, wb in outcomes.items():
+                nxt[a + b] += wa * wb
+        totals = nxt
+    n = sum(totals.values())
+    return {v: c / n for v, c in totals.items()}
+
+@pytest.mark.parametrize("expression", ["2d6", "4d6kh3", "3d6dl1+2", "1d20adv", "1d20dis-1", "2d4-1d6", "5d3kl2"])
+def test_exact_pmf_matches_enumeration(expression):
+    from backend.dice import pmf
+    exact = pmf(expression).as_dict()
+    expected = brute_force(expression)
+    assert exact.keys() == expected.keys()
+    for value, p in expected.items():
+        assert exact[value] == pytest.approx(p, abs=1e-12)
+
+def test_large_pools_use_fft_and_stay_normalized():
+    from backend.dice import pmf
+    dist = pmf("200d10")
+    assert dist.offset == 200
+    assert dist.probs.sum() == pytest.approx(1.0, abs=1e-9)
+    assert dist.mean() == pytest.approx(1100.0, abs=1e-6)
+    assert (dist.probs >= 0).all()
+
+def test_exploding_pmf_matches_sampler():
+    from backend.dice import pmf
+    dist = pmf("1d6!")
+    assert dist.mean() == pytest.approx(4.2, abs=1e-9)
+    assert dist.as_dict()[6 + 3] == pytest.approx(1 / 36)
+    assert 6 not in dist.as_dict()
+
+def test_pmf_results_are_cached_per_expression():
+    from backend.dice import pmf
+    assert pmf("2d6 + 3") is pmf("2D6+3")
+    assert not pmf("2d6+3").probs.flags.writeable
+
+def test_success_probability_uses_natural_1_and_20():
+    from backend.dice import check_probability, success_probability
+    assert check_probability(0, 10) == pytest.approx(0.55)
+    # Only a natural 20 can beat DC 30; a natural 1 fails even DC 1
+    assert check_probability(5, 30) == pytest.approx(0.05)
+    assert check_probability(5, 1) == pytest.approx(0.95)
+    assert check_probability(0, 11, 'adv') == pytest.approx(0.75)
+    assert check_probability(0, 11, 'dis') == pytest.approx(0.25)
+    # Extra dice ride along with the natural roll
+    assert success_probability("1d20+1d4", 40) == pytest.approx(0.05)
+    # Not a single d20 check: plain total >= dc
+    assert success_probability("2d6", 7) == pytest.approx(21 / 36)
+
+def test_success_probability_agrees_with_skill_check():
+    from backend.engine import Character
+    engine = Engine([])
+    hero = Character('Hero', 3)
+    wins = sum(engine.skill_check(hero, 15, roll=r) for r in range(1, 21))
+    assert engine.success_chance(hero, 15) == pytest.approx(wins / 20)
+
+def test_roll_dice_odds_route(client):
+    resp = client.post('/api/roll_dice/odds', json={'expression': '1d20+5', 'dc': 15, 'include_pmf': True})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['probability'] == pytest.approx(0.55)
+    assert data['min'] == 6 and data['max'] == 25
+    assert len(data['pmf']) == 20
+    assert client.post('/api/roll_dice/odds', json={'expression': 'nope'}).status_code == 400
+
+def test_exact_distribution_size_is_bounded(client):
+    from backend.dice import pmf
+    compile_expression("1000d1000!")  # a valid expression, just too wide to convolve
+    with pytest.raises(DiceError):
+        pmf("1000d1000!")
+    resp = client.post('/api/roll_dice/odds', json={'expression': '1000d1000+1000d1000', 'dc': 10})
+    assert resp.status_code == 400
+
+def test_pmf_cache_is_bounded_by_bytes(monkeypatch):
+    from backend import dice
+    monkeypatch.setattr(dice, '_pmf_cache', {})
+    monkeypatch.setattr(dice, '_pmf_cache_bytes', 0)
+    monkeypatch.setattr(dice, 'PMF_CACHE_BYTES', 4096)
+    for count in range(1, 21):
+        dice.pmf(f"{count}d20")
+    assert 0 < dice._pmf_cache_bytes <= 4096
+    assert dice._pmf_cache_bytes == sum(d.probs.nbytes for d in dice._pmf_cache.values())
+    assert "20d20" in dice._pmf_cache and "1d20" not in dice._pmf_cache
+    dice.pmf("100d20")  # larger than the whole budget: served, not cached
+    assert "100d20" not in dice._pmf_cache and "20d20" in dice._pmf_cache
@@ -7,11 +7,18 @@ def test_openai_api_key_env(monkeypatch):
     monkeypatch.setenv("OPENAI_API_KEY", "sk-test-1234")
     # Should not raise error when key is set
     try:
-        # Patch openai.ChatCompletion.create to avoid real API call
+        # Answer on the v1 client's transport to avoid a real API call
+        import httpx
         import openai
-        def fake_create(*args, **kwargs):
-            return {'choices': [{'message': {'content': 'ok'}}]}
-        monkeypatch.setattr(openai.ChatCompletion, "create", fake_create)
+        def fake_send(request):
+            assert request.headers['authorization'] == 'Bearer sk-test-1234'
+            return httpx.Response(200, json={'id': 'x', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4',
+                                             'choices': [{'index': 0, 'finish_reason': 'stop',
+                                                          'message': {'role': 'assistant', 'content': 'ok'}}]})
+        monkeypatch.setattr(gpt4_utils, "_openai_clients", {})
+        real_client = openai.OpenAI
+        monkeypatch.setattr(openai, "OpenAI", lambda **kwargs: real_client(
+            http_client=httpx.Client(transport=httpx.MockTransport(fake_send)), **kwargs))
         result = gpt4_utils.call_gpt4_api("test prompt")
         assert result == "ok"
     except Exception as e:
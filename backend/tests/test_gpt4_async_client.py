@@ -0,0 +1,208 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from backend import gpt4_utils
+from backend.gpt4_utils import AsyncGPT4Client, GPT4APIError
+
+
+class StubServer:
+    # Local OpenAI-compatible endpoint replaying scripted status codes
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    stub.requests.append((self.path, self.headers.get('Authorization'), body))
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.in_flight -= 1
+                content = body['messages'][0]['content']
+                payload = json.dumps({'choices': [{'message': {'content': f"echo: {content}"}}]} if status == 200
+                                     else {'error': 'nope'}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:
+                    pass  # client timed out and hung up
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def make(**kwargs):
+        servers.append(StubServer(**kwargs))
+        return servers[-1]
+    yield make
+    for s in servers:
+        s.close()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_calls_share_a_bounded_pool(stub):
+    server = stub(delay=0.05)
+
+    async def go():
+        async with AsyncGPT4Client(api_key='sk-stub', base_url=server.url, max_concurrency=4) as client:
+            return await asyncio.gather(*(client.complete(f"table {i}") for i in range(20)))
+    replies = run(go())
+    assert replies == [f"echo: table {i}" for i in range(20)]
+    assert 1 < server.max_in_flight <= 4
+    path, auth, body = server.requests[0]
+    assert path == '/v1/chat/completions' and auth == 'Bearer sk-stub'
+    assert body['model'] == 'gpt-4' and body['max_tokens'] == 256
+
+
+def test_retries_rate_limits_and_server_errors(stub):
+    server = stub(statuses=[429, 503])
+
+    async def go():
+        async with AsyncGPT4Client(api_key='k', base_url=server.url, backoff=0.01) as client:
+            return await client.complete("hi")
+    assert run(go()) == "echo: hi"
+    assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried_and_retries_are_bounded(stub):
+    server = stub(statuses=[400])
+    flaky = stub(statuses=[500] * 10)
+
+    async def go(url):
+        async with AsyncGPT4Client(api_key='k', base_url=url, max_retries=2, backoff=0.01) as client:
+            return await client.complete("hi")
+    with pytest.raises(GPT4APIError) as exc:
+        run(go(server.url))
+    assert exc.value.status == 400 and len(server.requests) == 1
+    with pytest.raises(GPT4APIError) as exc:
+        run(go(flaky.url))
+    assert exc.value.status == 500 and len(flaky.requests) == 3
+
+
+def test_timeouts_are_retried_then_surfaced(stub):
+    server = stub(delay=0.5)
+
+    async def go():
+        async with AsyncGPT4Client(api_key='k', base_url=server.url, timeout=0.1, max_retries=1, backoff=0.01) as client:
+            return await client.complete("slow")
+    with pytest.raises(GPT4APIError):
+        run(go())
+    assert len(server.requests) == 2
+
+
+def test_shared_client_per_loop_and_missing_key(stub, monkeypatch):
+    server = stub()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+
+    async def go():
+        first = gpt4_utils.get_async_client()
+        reply = await gpt4_utils.call_gpt4_api_async("shared")
+        assert gpt4_utils.get_async_client() is first
+        await first.aclose()
+        return reply
+    assert run(go()) == "echo: shared"
+    assert server.requests[0][1] == 'Bearer sk-env'
+    monkeypatch.delenv("OPENAI_API_KEY")
+    with pytest.raises(RuntimeError, match="OPENAI_API_KEY environment variable not set"):
+        AsyncGPT4Client()
+
+
+def test_backoff_sleep_does_not_hold_a_request_slot(stub, monkeypatch):
+    server = stub(statuses=[503])
+    sleeping = []
+
+    async def go():
+        async with AsyncGPT4Client(api_key='k', base_url=server.url, max_concurrency=1, backoff=0.01) as client:
+            original = asyncio.sleep
+
+            async def sleep(delay):
+                sleeping.append(client._semaphore.locked())
+                await original(delay)
+            monkeypatch.setattr(gpt4_utils.asyncio, 'sleep', sleep)
+            return await client.complete("retry")
+    assert run(go()) == "echo: retry"
+    assert sleeping == [False]
+
+
+def test_shared_clients_follow_settings_and_loops(stub, monkeypatch):
+    server = stub()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-env")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+
+    async def first_loop():
+        return gpt4_utils.get_async_client(), gpt4_utils.get_async_client(max_retries=0)
+
+    async def second_loop():
+        client = gpt4_utils.get_async_client()
+        await asyncio.sleep(0)  # let the stale clients close
+        return client
+    default, strict = run(first_loop())
+    assert default is not strict and strict.max_retries == 0
+    fresh = run(second_loop())
+    assert fresh is not default and default.closed and strict.closed
+    run(fresh.aclose())
+
+
+def test_stream_client_is_closed_when_replaced(monkeypatch):
+    monkeypatch.setattr(gpt4_utils, '_sync_http', None)
+    first = gpt4_utils._stream_client("http://127.0.0.1:1/v1")
+    second = gpt4_utils._stream_client("http://127.0.0.1:2/v1")
+    assert first.is_closed and not second.is_closed
+    second.close()
+
+
+def test_sync_call_does_not_rebind_global_key(monkeypatch):
+    import httpx
+    import openai
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-call")
+    monkeypatch.setattr(openai, "api_key", None)
+    seen = {}
+
+    def fake_send(request):
+        seen['authorization'] = request.headers['authorization']
+        return httpx.Response(200, json={'id': 'x', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4',
+                                         'choices': [{'index': 0, 'finish_reason': 'stop',
+                                                      'message': {'role': 'assistant', 'content': 'ok'}}]})
+    real_client = openai.OpenAI
+    monkeypatch.setattr(gpt4_utils, "_openai_clients", {})
+    monkeypatch.setattr(openai, "OpenAI", lambda **kwargs: real_client(
+        http_client=httpx.Client(transport=httpx.MockTransport(fake_send)), **kwargs))
+    assert gpt4_utils.call_gpt4_api("p") == "ok"
+    assert gpt4_utils.call_gpt4_api("q") == "ok"
+    assert len(gpt4_utils._openai_clients) == 1  # one pooled client, reused
+    assert seen['authorization'] == "Bearer sk-call" and openai.api_key is None
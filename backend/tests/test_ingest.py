@@ -0,0 +1,66 @@
+import io
+import pytest
+from backend import utils
+from backend.ingest import copy_upload, ingest_pages, iter_pages
+
+class CountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.read_sizes = []
+
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return super().read(size)
+
+def test_copy_upload_uses_fixed_size_blocks():
+    data = b"x" * 10000
+    stream = CountingStream(data)
+    dest = io.BytesIO()
+    assert copy_upload(stream, dest, block_size=4096) == len(data)
+    assert dest.getvalue() == data
+    assert all(size == 4096 for size in stream.read_sizes)
+
+def test_txt_pages_are_streamed_and_cut_on_blank_lines(tmp_path):
+    path = tmp_path / "book.txt"
+    sections = [f"Section{i}\n" + "word " * 50 for i in range(40)]
+    path.write_text("\n\n".join(sections), encoding="utf-8")
+    pages = list(utils.iter_txt_pages(str(path), page_chars=1000))
+    assert len(pages) > 1
+    assert "".join(p['rules'] for p in pages) == path.read_text(encoding="utf-8")
+    # No section is split across pages
+    assert sum(len(p['sections']) for p in pages) == 40
+
+def test_ingest_pages_batches_chunks_as_pages_arrive(tmp_path):
+    path = tmp_path / "book.txt"
+    path.write_text("\n\n".join("word " * 30 for _ in range(20)), encoding="utf-8")
+    seen_pages = []
+    batches = []
+
+    def pages():
+        for page in utils.iter_txt_pages(str(path), page_chars=200):
+            # Full batches are handed off before later pages are parsed
+            assert 2 * len(seen_pages) - sum(len(b) for b in batches) < 4
+            seen_pages.append(page)
+            yield page
+
+    result, count = ingest_pages(pages(), on_chunks=batches.append, batch_size=4)
+    # Pages hold two 30-word sections each; every section is its own chunk
+    assert len(seen_pages) == 10
+    assert count == 20
+    assert [len(b) for b in batches] == [4, 4, 4, 4, 4]
+    assert all(c['kind'] == 'text' and c['section'].startswith('word') for b in batches for c in b)
+    assert len(result['sections']) == 20
+    assert result['rules'] == path.read_text(encoding="utf-8")
+
+def test_document_pages_split_on_form_feed(monkeypatch):
+    monkeypatch.setattr(utils, 'parse_pdf', lambda p: {'text': 'Page one\fPage two', 'sections': ['One'], 'tables': [{'name': 'Gear', 'rows': [["Sword", "10gp"]]}]})
+    pages = list(iter_pages('ignored.pdf', 'pdf'))
+    assert len(pages) == 2
+    result, count = ingest_pages(pages)
+    assert result['text'] == 'Page one\fPage two'
+    assert result['sections'] == ['One']
+    assert count == 3
+
+def test_iter_pages_rejects_unknown_extension():
+    with pytest.raises(ValueError):
+        iter_pages('book.xls', 'xls')
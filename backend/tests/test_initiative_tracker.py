@@ -0,0 +1,79 @@
+import random
+import pytest
+from backend.engine import Character, Engine
+from backend.initiative import InitiativeTracker
+
+def make(name, initiative):
+    c = Character(name)
+    c.initiative = initiative
+    return c
+
+def test_order_uses_initiative_then_name_and_keeps_duplicate_names():
+    a, b, g1, g2 = make('A', 10), make('B', 10), make('Goblin', 15), make('Goblin', 15)
+    tracker = InitiativeTracker([b, g2, a, g1])
+    assert [c.name for c in tracker] == ['Goblin', 'Goblin', 'A', 'B']
+    assert len(tracker) == 4
+
+def test_cursor_is_stable_across_join_leave_and_delay():
+    a, b, c, d = make('A', 20), make('B', 15), make('C', 10), make('D', 5)
+    tracker = InitiativeTracker([a, b, c, d])
+    assert tracker.next_turn() is a
+    assert tracker.current() is b
+    # Removing the combatant about to act hands the turn to the next one
+    tracker.leave(b)
+    assert tracker.current() is c
+    # A summon sorting after the cursor acts this round, one before it next round
+    late, early = make('Late', 7), make('Early', 25)
+    tracker.join(late)
+    tracker.join(early)
+    assert [tracker.next_turn() for _ in range(3)] == [c, late, d]
+    assert tracker.next_turn() is early
+    assert tracker.round == 2
+    assert tracker.next_turn() is a
+    # Delaying to a later count moves the combatant behind the cursor
+    tracker.delay(a, 1)
+    assert [tracker.next_turn() for _ in range(5)] == [c, late, d, a, early]
+    assert tracker.round == 3
+
+def test_join_requires_initiative_and_rejects_duplicates():
+    tracker = InitiativeTracker()
+    with pytest.raises(ValueError):
+        tracker.join(Character('NoInit'))
+    c = make('C', 3)
+    tracker.join(c)
+    with pytest.raises(ValueError):
+        tracker.join(c)
+    with pytest.raises(IndexError):
+        InitiativeTracker().next_turn()
+
+def test_matches_resorting_reference_under_random_churn():
+    rng = random.Random(3)
+    combatants = [make(f"N{i % 50}", rng.randint(1, 25)) for i in range(2000)]
+    tracker = InitiativeTracker(combatants)
+    active = list(combatants)
+    for step in range(500):
+        action = rng.random()
+        if action < 0.3 and len(active) > 1:
+            victim = active.pop(rng.randrange(len(active)))
+            tracker.leave(victim)
+        elif action < 0.6:
+            newcomer = make(f"S{step}", rng.randint(1, 25))
+            active.append(newcomer)
+            tracker.join(newcomer)
+        else:
+            tracker.next_turn()
+    ordered = sorted(active, key=lambda c: (-c.initiative, c.name))
+    assert [(c.initiative, c.name) for c in tracker] == [(c.initiative, c.name) for c in ordered]
+
+def test_engine_mid_fight_changes_keep_turn_position():
+    chars = [Character('A', 5), Character('B', 3), Character('C', 1)]
+    engine = Engine(chars)
+    engine.assign_initiative(seed=2)
+    first = engine.next_turn()
+    upcoming = engine.tracker.current()
+    engine.add_combatant(Character('Summon', 0), initiative=first.initiative + 50)
+    assert engine.tracker.current() is upcoming
+    engine.remove_combatant(upcoming)
+    assert engine.next_turn() is not upcoming
+    assert upcoming in engine.characters and upcoming not in engine.tracker
+    assert 'Summon' in engine.format_gpt_prompt()
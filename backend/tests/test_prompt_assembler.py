@@ -0,0 +1,65 @@
+from backend import prompt_assembler
+from backend.engine import Character, Engine
+from backend.prompt_assembler import PromptAssembler, assemble_prompt, count_tokens
+
+SHEET = {'name': 'Hero', 'class': 'Rogue', 'skills': ['stealth', 'arcana']}
+
+def test_everything_fits_in_layout_order():
+    engine = Engine([Character('Hero', 2), Character('Goblin', 1)])
+    engine.assign_initiative(seed=1)
+    memory = ["You enter a cave.", {'player': 'I light a torch', 'gm': 'Shadows dance.'}]
+    prompt = assemble_prompt("I search the room", budget=500, character_sheet=SHEET, memory=memory,
+                             rule_chunks=["Searching takes an action.", "Traps: DC 15 Perception."],
+                             combat_state=engine.format_gpt_prompt())
+    lines = prompt.text.split('\n')
+    assert lines[0] == 'Rules:' and lines[1] == 'Searching takes an action.'
+    assert lines.index('Combat:') < lines.index('Character:') < lines.index('Memory:')
+    assert lines[-3:] == ["You enter a cave.", "Player: I light a torch / GM: Shadows dance.", "Player: I search the room"]
+    assert prompt.dropped == 0
+    assert prompt.tokens == count_tokens(prompt.text) <= 500
+
+def test_budget_keeps_highest_priority_segments():
+    memory = [f"Turn {i}: " + "the party walks on and on " * 5 for i in range(20)]
+    rules = [f"Rule {i}: " + "roll a d20 and add your modifier " * 5 for i in range(20)]
+    prompt = PromptAssembler(budget=200).assemble("I attack", character_sheet=SHEET, memory=memory, rule_chunks=rules)
+    assert count_tokens(prompt.text) <= 200
+    assert '"Rogue"' in prompt.text
+    assert "Turn 19:" in prompt.text and "Rule 0:" in prompt.text  # newest turn, best rule
+    assert "Turn 0:" not in prompt.text and "Rule 19:" not in prompt.text
+    assert prompt.dropped > 0
+    assert prompt.text.endswith("Player: I attack")
+
+def test_oversized_sheet_is_clipped_not_dropped():
+    sheet = "Backstory: " + "a long and winding tale " * 200
+    prompt = PromptAssembler(budget=50).assemble("Hi", character_sheet=sheet)
+    assert 'Backstory:' in prompt.text and count_tokens(prompt.text) <= 50
+
+def test_segment_token_counts_are_reused(monkeypatch):
+    calls = []
+    original = prompt_assembler._approximate
+    monkeypatch.setattr(prompt_assembler, 'tiktoken', None)
+    monkeypatch.setattr(prompt_assembler, '_approximate', lambda text: calls.append(text) or original(text))
+    count_tokens.cache_clear()
+    memory = ["The dragon sleeps.", "You creep closer."]
+    assemble_prompt("Turn one", budget=300, character_sheet=SHEET, memory=memory)
+    first = len(calls)
+    assemble_prompt("Turn two", budget=300, character_sheet=SHEET, memory=memory + ["It stirs."])
+    # Only the new turn and the new player line were counted
+    assert len(calls) - first == 2
+    count_tokens.cache_clear()
+
+def test_unavailable_tiktoken_encoding_is_not_refetched(monkeypatch):
+    fetches = []
+
+    class OfflineTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            fetches.append(name)
+            raise OSError("no network")
+    monkeypatch.setattr(prompt_assembler, 'tiktoken', OfflineTiktoken)
+    monkeypatch.setattr(prompt_assembler, '_encoding', None)
+    count_tokens.cache_clear()
+    assert count_tokens("The dragon sleeps.") == prompt_assembler._approximate("The dragon sleeps.")
+    count_tokens("You creep closer.")
+    assert fetches == ["cl100k_base"]
+    count_tokens.cache_clear()
@@ -0,0 +1,72 @@
+import pytest
+from backend import gpt4_utils
+from backend.response_cache import ResponseCache, cache_key, vectorizer_embedder
+from backend.utils_embedding import embed_texts
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_exact_tier_normalizes_prompt_and_keys_on_params():
+    cache = ResponseCache()
+    cache.put("Player:  I search   the room", "You find a key.", model="gpt-4", temperature=0.7)
+    assert cache.get("player: i search the room\n", model="gpt-4", temperature=0.7) == "You find a key."
+    assert cache.get("Player: I search the room", model="gpt-4", temperature=0.2) is None
+    assert cache_key("a  b", t=1) == cache_key(" A b ", t=1) != cache_key("a b", t=2)
+
+def test_namespaces_are_isolated_and_clearable():
+    cache = ResponseCache()
+    cache.put("look", "A forest.", namespace=1)
+    cache.put("look", "A space station.", namespace=2)
+    assert cache.get("look", namespace=1) == "A forest."
+    assert cache.get("look", namespace=2) == "A space station."
+    assert cache.get("look") is None
+    cache.clear(1)
+    assert cache.get("look", namespace=1) is None and cache.get("look", namespace=2) == "A space station."
+
+def test_ttl_lru_and_metrics():
+    clock = Clock()
+    cache = ResponseCache(max_entries=2, ttl=10, clock=clock)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"  # a is now most recent
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1"
+    clock.now = 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats['exact_hits'] == 2 and stats['misses'] == 2
+    assert stats['evictions'] == 1 and stats['expirations'] == 1
+    assert stats['entries'] == 1 and stats['hit_rate'] == 0.5
+
+def test_similarity_tier_reuses_close_prompts_only():
+    rules = ["Search the room for traps and hidden doors", "Attack the goblin with a sword", "Cast a spell of fire"]
+    _, vectorizer = embed_texts(rules)
+    embed = vectorizer_embedder(vectorizer)
+    cache = ResponseCache(similarity_threshold=0.8)
+    cache.put("I search the room for traps", "Nothing here.", namespace=1, embedder=embed, model="gpt-4")
+    assert cache.get("I search the room for hidden traps", namespace=1, embedder=embed, model="gpt-4") == "Nothing here."
+    assert cache.get("I attack the goblin", namespace=1, embedder=embed, model="gpt-4") is None
+    assert cache.get("I search the room for hidden traps", namespace=2, embedder=embed, model="gpt-4") is None
+    assert cache.get("I search the room for hidden traps", namespace=1, embedder=embed, model="gpt-3") is None
+    assert cache.stats()['similar_hits'] == 1
+    # Without a threshold the tier is off
+    plain = ResponseCache()
+    plain.put("I search the room for traps", "x", embedder=embed)
+    assert plain.get("I search the room for hidden traps", embedder=embed) is None
+
+def test_cached_call_skips_the_api(monkeypatch):
+    calls = []
+    monkeypatch.setattr(gpt4_utils, "call_gpt4_api", lambda prompt: calls.append(prompt) or "narration")
+    cache = ResponseCache()
+    assert gpt4_utils.call_gpt4_api_cached("I search the room", universe_id=3, cache=cache) == "narration"
+    assert gpt4_utils.call_gpt4_api_cached("I  search the room", universe_id=3, cache=cache) == "narration"
+    assert len(calls) == 1
+
+def test_stats_endpoint(client):
+    stats = client.get('/api/response_cache').get_json()
+    assert {'exact_hits', 'similar_hits', 'misses', 'hit_rate', 'entries'} <= set(stats)
+    assert client.post('/api/response_cache', json={'clear': True}).get_json()['entries'] == 0
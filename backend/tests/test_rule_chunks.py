@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import inspect
+from backend.app import db
+from backend.ingest import page_chunks
+from backend.models import Rulebook, RuleChunk, RulebookSection, Universe
+from backend.rule_chunks import replace_chunks, fetch_chunks, universe_chunks, chunk_records
+
+RULES = {
+    'rules': "Combat\nRoll a d20 and add modifiers.\n\nMagic\nSpell slots are consumed when casting spells.",
+    'sections': [],
+    'tables': [{'name': 'Gear', 'rows': [["Sword", "10gp"]]}],
+}
+
+def test_page_chunks_tag_sections_and_kinds():
+    chunks = page_chunks(RULES)
+    assert [(c['section'], c['kind']) for c in chunks] == [('Combat', 'text'), ('Magic', 'text'), ('Gear', 'table')]
+
+def test_migration_creates_indexed_chunk_tables(app):
+    with app.app_context():
+        inspector = inspect(db.engine)
+        assert {'rulebook_section', 'rule_chunk'} <= set(inspector.get_table_names())
+        chunk_indexes = {ix['name']: ix['column_names'] for ix in inspector.get_indexes('rule_chunk')}
+        assert chunk_indexes['ix_rule_chunk_rulebook_id_section'] == ['rulebook_id', 'section']
+        assert chunk_indexes['ix_rule_chunk_universe_id'] == ['universe_id']
+        section_indexes = {ix['name']: ix['column_names'] for ix in inspector.get_indexes('rulebook_section')}
+        assert section_indexes['ix_rulebook_section_rulebook_id_title'] == ['rulebook_id', 'title']
+
+def test_replace_and_fetch_chunks_by_section(app):
+    with app.app_context():
+        universe = Universe(name="World", owner_id="user1")
+        db.session.add(universe)
+        db.session.commit()
+        rulebook = Rulebook(filename="core.txt", rpg_system="SystemA", rules=RULES, universe_id=universe.id)
+        db.session.add(rulebook)
+        db.session.commit()
+        replace_chunks(rulebook, page_chunks(RULES))
+        assert [s.title for s in rulebook.sections] == ['Combat', 'Magic']
+        combat = fetch_chunks(rulebook.id, section='Combat')
+        assert len(combat) == 1 and 'd20' in combat[0].text
+        assert [c.text for c in fetch_chunks(rulebook.id, kind='table')] == ['Gear: Sword 10gp']
+        assert len(universe_chunks(universe.id)) == 3
+        # Re-ingesting replaces rather than appends
+        replace_chunks(rulebook, page_chunks({'rules': "Stealth\nSneak quietly."}))
+        assert [c['section'] for c in chunk_records(rulebook.id)] == ['Stealth']
+        assert RulebookSection.query.filter_by(rulebook_id=rulebook.id).count() == 1
+
+def test_rules_column_is_deferred(app):
+    with app.app_context():
+        db.session.add(Rulebook(filename="lazy.txt", rpg_system="SystemA", rules=RULES))
+        db.session.commit()
+        db.session.expunge_all()
+        rulebook = Rulebook.query.filter_by(filename="lazy.txt").first()
+        assert 'rules' not in rulebook.__dict__
+        assert rulebook.rules == RULES
@@ -0,0 +1,92 @@
+import io
+import os
+import time
+import pytest
+from unittest.mock import patch
+from backend.rulebook_cache import RulebookCache, new_hasher
+from backend.models import Rulebook
+
+def digest_of(data):
+    hasher = new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+def test_cache_round_trip_and_rejects_non_digest_keys(tmp_path):
+    cache = RulebookCache(str(tmp_path))
+    key = digest_of(b"book")
+    assert cache.get(key) is None
+    cache.put(key, {'response': {'rules': 'x'}, 'rulebook_id': 1})
+    assert cache.get(key)['rulebook_id'] == 1
+    with pytest.raises(ValueError):
+        cache.get('../../etc/passwd')
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = RulebookCache(str(tmp_path), max_entries=2)
+    keys = [digest_of(bytes([i])) for i in range(3)]
+    cache.put(keys[0], {'n': 0})
+    cache.put(keys[1], {'n': 1})
+    # Touch entry 0 so entry 1 becomes the LRU one
+    past = time.time() - 60
+    os.utime(os.path.join(str(tmp_path), f"{keys[1]}.json"), (past, past))
+    os.utime(os.path.join(str(tmp_path), f"{keys[0]}.json"), (past - 30, past - 30))
+    assert cache.get(keys[0]) == {'n': 0}
+    cache.put(keys[2], {'n': 2})
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+
+def test_cache_is_bounded_by_size(tmp_path):
+    cache = RulebookCache(str(tmp_path), max_bytes=200)
+    for i in range(10):
+        cache.put(digest_of(bytes([i])), {'rules': 'x' * 50})
+    assert 0 < len(cache) <= 3
+
+@patch('backend.utils.parse_pdf')
+def test_reupload_under_new_name_skips_parsing(mock_parse_pdf, app, client, tmp_path, monkeypatch):
+    from backend.routes import upload_rulebook as route
+    monkeypatch.setattr(route, 'use_cache', lambda: True)
+    monkeypatch.setenv('RULEBOOK_INDEX_DIR', str(tmp_path / 'index'))
+    app.config['RULEBOOK_CACHE_DIR'] = str(tmp_path / 'cache')
+    mock_parse_pdf.return_value = {'text': 'Combat rules here', 'sections': ['Combat'], 'tables': []}
+    body = b"%PDF-1.4\nsame bytes"
+    for name in ("first.pdf", "renamed.pdf"):
+        resp = client.post('/upload_rulebook', data={'file': (io.BytesIO(body), name)}, content_type='multipart/form-data')
+        assert resp.status_code == 200
+        assert 'Combat' in resp.get_json()['rules']
+    assert mock_parse_pdf.call_count == 1
+    # Same name and size but different bytes is a miss, not a wrong hit
+    mock_parse_pdf.return_value = {'text': 'Magic rules here', 'sections': ['Magic'], 'tables': []}
+    resp = client.post('/upload_rulebook', data={'file': (io.BytesIO(b"%PDF-1.4\nsome bytes"), "first.pdf")}, content_type='multipart/form-data')
+    assert 'Magic' in resp.get_json()['rules']
+    assert mock_parse_pdf.call_count == 2
+    with app.app_context():
+        renamed = Rulebook.query.filter_by(filename="renamed.pdf").first()
+        assert renamed is not None
+        assert (tmp_path / 'index' / str(renamed.id) / 'embeddings.npy').exists()
+
+def test_cached_upload_never_reuses_overwritten_content(app, client, tmp_path, monkeypatch):
+    # a.txt gets X, then Y under the same name; X again must bring X's chunks back
+    from backend.routes import upload_rulebook as route
+    from backend.rule_chunks import chunk_records
+    from backend.app import limiter
+    from backend.rulebook_index import load_index
+    monkeypatch.setattr(route, 'use_cache', lambda: True)
+    monkeypatch.setattr(limiter, 'enabled', False)  # five uploads, past 3 per minute
+    monkeypatch.setenv('RULEBOOK_INDEX_DIR', str(tmp_path / 'index'))
+    app.config['RULEBOOK_CACHE_DIR'] = str(tmp_path / 'cache')
+    x, y = b"Combat\nRoll initiative first.", b"Magic\nFireball burns everything."
+
+    def upload(body, name):
+        resp = client.post('/upload_rulebook', data={'file': (io.BytesIO(body), name)}, content_type='multipart/form-data')
+        assert resp.status_code == 200
+        with app.app_context():
+            rulebook = Rulebook.query.filter_by(filename=name).one()
+            texts = ' '.join(c['text'] for c in chunk_records(rulebook.id))
+            return texts, ' '.join(load_index(rulebook.id)[0].texts)
+
+    assert 'initiative' in upload(x, 'a.txt')[0]
+    assert 'Fireball' in upload(y, 'a.txt')[0]
+    for name in ('a.txt', 'b.txt'):
+        chunks, index = upload(x, name)
+        assert 'initiative' in chunks and 'initiative' in index
+        assert 'Fireball' not in chunks and 'Fireball' not in index
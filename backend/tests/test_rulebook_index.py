@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pytest
+from backend import rulebook_index
+from backend.models import Rulebook
+from backend.app import db
+
+RULES = {
+    'rules': "Combat: Roll a d20 and add modifiers. Magic: Spell slots are consumed when casting spells.",
+    'sections': ['Combat', 'Magic'],
+    'tables': [{'name': 'Gear', 'rows': [["Sword", "10gp"]]}],
+}
+
+def test_rulebook_chunks_include_text_and_tables():
+    chunks = rulebook_index.rulebook_chunks(RULES, chunk_size=8)
+    assert len(chunks) == 3
+    assert chunks[-1] == "Gear: Sword 10gp"
+
+def test_index_round_trips_through_memmap(tmp_path):
+    store, vectorizer = rulebook_index.build_index(7, RULES, root=str(tmp_path))
+    loaded_store, loaded_vectorizer = rulebook_index.load_index(7, root=str(tmp_path))
+    assert isinstance(loaded_store.embeddings, np.memmap)
+    assert not loaded_store.embeddings.flags.writeable
+    assert loaded_store.texts == store.texts
+    query = loaded_vectorizer.transform(["sword"]).toarray()
+    assert np.allclose(query, vectorizer.transform(["sword"]).toarray())
+    assert loaded_store.search(query, top_k=1)[0][0] == "Gear: Sword 10gp"
+
+def test_appending_to_loaded_index_copies_out_of_memmap(tmp_path):
+    rulebook_index.build_index(3, RULES, root=str(tmp_path))
+    store, vectorizer = rulebook_index.load_index(3, root=str(tmp_path))
+    store.add(["Stealth: sneak"], vectorizer.transform(["sneak"]).toarray())
+    assert not isinstance(store.embeddings, np.memmap)
+    assert len(store) == 3
+    # The file on disk is untouched
+    assert len(rulebook_index.load_index(3, root=str(tmp_path))[0]) == 2
+
+def test_index_persists_hashing_embedder_state(tmp_path):
+    from backend.utils_embedding import HashingEmbedder
+    _, embedder = rulebook_index.build_index(4, RULES, root=str(tmp_path))
+    assert isinstance(embedder, HashingEmbedder)
+    files = set((tmp_path / '4').iterdir())
+    assert {p.name for p in files} == {'texts.json', 'embedder.json', 'doc_freq.npy', 'embeddings.npy', 'metadata.json'}
+    loaded_store, loaded = rulebook_index.load_index(4, root=str(tmp_path))
+    assert loaded.n_docs == embedder.n_docs == len(loaded_store)
+    assert np.array_equal(loaded.doc_freq, embedder.doc_freq)
+
+def test_legacy_tfidf_index_still_loads(tmp_path):
+    from backend.utils_embedding import embed_texts
+    texts = ["Combat: roll a d20", "Magic: spell slots"]
+    embeddings, vectorizer = embed_texts(texts)
+    store = rulebook_index.SimpleVectorStore()
+    store.add(texts, embeddings)
+    rulebook_index.save_index(5, texts, store, vectorizer, root=str(tmp_path))
+    loaded_store, loaded_vectorizer = rulebook_index.load_index(5, root=str(tmp_path))
+    assert loaded_store.search(loaded_vectorizer.transform(["spell"]).toarray(), top_k=1)[0][0] == texts[1]
+
+def test_load_missing_index_returns_none(tmp_path):
+    assert rulebook_index.load_index(99, root=str(tmp_path)) is None
+
+def test_get_index_builds_once_per_rulebook(app, tmp_path):
+    with app.app_context():
+        rulebook = Rulebook(filename="indexed.pdf", rpg_system="SystemA", rules=RULES)
+        db.session.add(rulebook)
+        db.session.commit()
+        first = rulebook_index.get_index(rulebook, root=str(tmp_path))
+        assert (tmp_path / str(rulebook.id) / 'embeddings.npy').exists()
+        assert rulebook_index.get_index(rulebook, root=str(tmp_path)) is first
+        # Another worker republishes: this process's cache entry is stale
+        rulebook_index.index_chunks(rulebook.id, ["Grapple: contested strength check."], root=str(tmp_path))
+        rulebook_index._loaded[rulebook.id] = first
+        fresh = rulebook_index.get_index(rulebook, root=str(tmp_path))
+        assert fresh is not first and fresh[0].texts == ["Grapple: contested strength check."]
+        rulebook_index.delete_index(rulebook.id, root=str(tmp_path))
+        assert not (tmp_path / str(rulebook.id)).exists()
+
+def test_index_persists_chunk_metadata_for_filtering(tmp_path):
+    rulebook_index.build_index(6, RULES, root=str(tmp_path))
+    store, embedder = rulebook_index.load_index(6, root=str(tmp_path))
+    assert set(store.columns) == {'section', 'kind', 'rulebook_id'}
+    assert set(store.columns['rulebook_id']) == {6}
+    query = embedder.transform(["sword"]).toarray()
+    kinds = {meta['kind'] for _, _, meta in store.search_batch(query, top_k=10, where={'kind': 'text'}, with_metadata=True)[0]}
+    assert kinds == {'text'}
+
+def test_republishing_never_leaves_a_gap_for_readers(tmp_path):
+    import os
+    import threading
+    rulebook_index.build_index(8, RULES, root=str(tmp_path))
+    assert os.path.islink(tmp_path / '8')
+    misses, stop = [], threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            if rulebook_index.load_index(8, root=str(tmp_path)) is None:
+                misses.append(1)
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for _ in range(30):
+            rulebook_index.build_index(8, RULES, root=str(tmp_path))
+    finally:
+        stop.set()
+        thread.join()
+    assert misses == []
+    # Retired versions are cleaned up; only the live one remains
+    assert len(os.listdir(tmp_path / rulebook_index.VERSIONS_DIR)) == 1
+
+def test_plain_directory_index_migrates_to_versioned_link(tmp_path):
+    import os
+    import shutil
+    rulebook_index.build_index(9, RULES, root=str(tmp_path))
+    real = os.path.realpath(tmp_path / '9')
+    os.unlink(tmp_path / '9')
+    shutil.move(real, tmp_path / '9')
+    assert not os.path.islink(tmp_path / '9')
+    rulebook_index.build_index(9, RULES, root=str(tmp_path))
+    assert os.path.islink(tmp_path / '9')
+    assert rulebook_index.load_index(9, root=str(tmp_path)) is not None
+
+def test_chunk_writer_streams_batches_into_the_same_index(tmp_path):
+    from backend.ingest import chunk_metadata, chunk_texts, page_chunks
+    chunks = page_chunks(RULES, chunk_size=8)
+    writer = rulebook_index.ChunkIndexWriter(root=str(tmp_path))
+    try:
+        for chunk in chunks:
+            writer.add([chunk])
+        assert list(writer.chunks()) == chunks
+        rulebook_index.publish_index(writer.finish(), 4, root=str(tmp_path))
+    finally:
+        writer.close()
+    store, embedder = rulebook_index.load_index(4, root=str(tmp_path))
+    batch_store, batch_embedder = rulebook_index.embed_chunks(chunk_texts(chunks), metadata=chunk_metadata(chunks))
+    assert store.texts == batch_store.texts and np.allclose(store.embeddings, batch_store.embeddings)
+    assert np.array_equal(embedder.doc_freq, batch_embedder.doc_freq)
+    assert store.columns['section'] == batch_store.columns['section']
+    # Only the published index is left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['.versions', '4']
+
+def test_deleted_rows_are_tombstoned_on_disk_then_compacted(tmp_path):
+    root = str(tmp_path)
+    rulebook_index.build_index(5, RULES, root=root)
+    before = os.path.realpath(tmp_path / '5')
+    total = len(rulebook_index.load_index(5, root=root)[0])
+    assert rulebook_index.delete_rows(5, {'kind': 'table'}, root=root, compact_ratio=0.9) == 1
+    after = os.path.realpath(tmp_path / '5')
+    # A new version that shares the embedding file and lists the tombstone
+    assert after != before and os.path.isfile(os.path.join(after, 'deleted.npy'))
+    store, _ = rulebook_index.load_index(5, root=root)
+    assert isinstance(store.embeddings, np.memmap) and store.live == total - 1
+    assert store.search_batch(np.ones((1, store.dim)), top_k=total, where={'kind': 'table'}) == [[]]
+    assert rulebook_index.delete_rows(5, {'kind': 'table'}, root=root) == 0
+    # Past the ratio the live rows are rewritten without tombstones
+    compactions = rulebook_index.index_metrics()['compactions']
+    assert rulebook_index.delete_rows(5, {'kind': 'text'}, root=root, compact_ratio=0.1) == 1
+    store, _ = rulebook_index.load_index(5, root=root)
+    assert not os.path.isfile(os.path.join(store.source, 'deleted.npy'))
+    assert store.tombstone_ratio == 0.0 and len(store) == store.live == total - 2
+    assert rulebook_index.index_metrics()['compactions'] == compactions + 1
+    with pytest.raises(ValueError):
+        rulebook_index.delete_rows(5, {}, root=root)
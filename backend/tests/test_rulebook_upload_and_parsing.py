@@ -190,3 +190,78 @@ def test_rate_limit_upload_rulebook(client):
             break
     else:
         pytest.skip('Rate limit not triggered; check if rate limiting is enabled')
+
+def _wait_for_job(client, job_id, timeout=60):
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        resp = client.get(f'/upload_rulebook/{job_id}')
+        assert resp.status_code == 200
+        status = resp.get_json()
+        if status['status'] in ('done', 'error'):
+            return status
+        time.sleep(0.1)
+    pytest.fail('Upload job did not finish in time')
+
+def test_async_upload_returns_job_id_and_reports_progress(app, client, tmp_path):
+    app.config['RULEBOOK_JOBS_DIR'] = str(tmp_path)
+    data = {'file': (io.BytesIO(b"Combat\n\nEquipment\n--\nStats"), "async.txt")}
+    resp = client.post('/upload_rulebook?async=1', data=data, content_type='multipart/form-data')
+    assert resp.status_code == 202
+    job_id = resp.get_json()['job_id']
+    status = _wait_for_job(client, job_id)
+    assert status['status'] == 'done'
+    assert status['pages'] == 1
+    assert status['chunks'] >= 1
+    # Polls carry a summary, never the parsed text
+    assert 'result' not in status and status['summary']['characters'] > 0
+    # The spooled upload is removed once the job finishes
+    assert not any(name.startswith('.upload-') for name in os.listdir(tmp_path))
+
+def test_async_upload_reports_empty_parse_result(app, client, tmp_path):
+    app.config['RULEBOOK_JOBS_DIR'] = str(tmp_path)
+    data = {'file': (io.BytesIO(b"\n\n\n"), "blank.txt")}
+    resp = client.post('/upload_rulebook', data={**data, 'async': 'true'}, content_type='multipart/form-data')
+    assert resp.status_code == 202
+    status = _wait_for_job(client, resp.get_json()['job_id'])
+    assert status['status'] == 'error'
+    assert 'empty' in status['error'].lower()
+
+def test_upload_job_status_unknown_id(app, client, tmp_path):
+    app.config['RULEBOOK_JOBS_DIR'] = str(tmp_path)
+    assert client.get('/upload_rulebook/' + '0' * 32).status_code == 404
+    assert client.get('/upload_rulebook/..%2Fetc').status_code == 404
+
+def test_async_upload_stores_rulebook_from_the_job_process(app, client, tmp_path, monkeypatch):
+    # The pool process writes the database and publishes the index itself
+    from backend.models import Rulebook
+    from backend.routes import upload_rulebook as route
+    from backend.rulebook_index import load_index
+    monkeypatch.setattr(route, 'use_cache', lambda: True)
+    monkeypatch.setenv('RULEBOOK_INDEX_DIR', str(tmp_path / 'index'))
+    app.config.update(RULEBOOK_JOBS_DIR=str(tmp_path / 'jobs'), RULEBOOK_CACHE_DIR=str(tmp_path / 'cache'))
+    data = {'file': (io.BytesIO(b"Combat\nRoll initiative.\n\nEquipment\nSwords"), "stored.txt")}
+    resp = client.post('/upload_rulebook?async=1', data=data, content_type='multipart/form-data')
+    status = _wait_for_job(client, resp.get_json()['job_id'])
+    assert status['status'] == 'done'
+    with app.app_context():
+        rulebook = Rulebook.query.filter_by(filename='stored.txt').one()
+        assert status['rulebook_id'] == rulebook.id
+    stored = client.get(f"/rulebooks/{status['rulebook_id']}").get_json()
+    assert stored['filename'] == 'stored.txt' and 'Equipment' in stored['rules']['rules']
+    assert client.get('/rulebooks/999999').status_code == 404
+    assert load_index(rulebook.id, root=str(tmp_path / 'index')) is not None
+    assert not any(name.startswith('.staged-') for name in os.listdir(tmp_path / 'index'))
+
+def test_stalled_job_is_reported_failed(tmp_path):
+    import json
+    from backend.jobs import JobQueue, write_status
+    queue = JobQueue(str(tmp_path), stall_seconds=60)
+    job_id = '1' * 32
+    write_status(str(tmp_path), job_id, status='storing', pages=3, chunks=9)
+    assert queue.status(job_id)['status'] == 'storing'
+    path = tmp_path / f"{job_id}.json"
+    status = json.loads(path.read_text())
+    path.write_text(json.dumps({**status, 'updated_at': status['updated_at'] - 120}))
+    status = queue.status(job_id)
+    assert status['status'] == 'error' and status['http_status'] == 500 and status['pages'] == 3
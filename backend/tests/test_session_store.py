@@ -0,0 +1,73 @@
+import pytest
+from backend.models import GameSession
+from backend.session_store import SessionStore, InMemorySessionBackend, DatabaseSessionBackend, get_session_store
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class CountingBackend(InMemorySessionBackend):
+    def __init__(self):
+        super().__init__()
+        self.loads = 0
+
+    def load(self, session_id):
+        self.loads += 1
+        return super().load(session_id)
+
+def test_hits_are_served_from_cache():
+    backend = CountingBackend()
+    store = SessionStore(backend)
+    store.save('s1', {'active': True})
+    assert store.get('s1') == {'active': True}
+    assert store.get('s1') == {'active': True}
+    assert backend.loads == 0
+
+def test_cache_entries_expire_after_ttl():
+    backend = CountingBackend()
+    clock = FakeClock()
+    store = SessionStore(backend, ttl=10, clock=clock)
+    store.save('s1', {'turn': 1})
+    clock.now = 11
+    assert store.get('s1') == {'turn': 1}
+    assert backend.loads == 1
+
+def test_cache_is_lru_bounded():
+    backend = CountingBackend()
+    store = SessionStore(backend, max_size=2)
+    for sid in ('a', 'b', 'c'):
+        store.save(sid, {'id': sid})
+    assert store.cached_count() == 2
+    # Evicted entries are reloaded from the backend, not lost
+    assert store.get('a') == {'id': 'a'}
+    assert backend.loads == 1
+
+def test_returned_sessions_are_copies():
+    store = SessionStore(InMemorySessionBackend())
+    store.save('s1', {'turn': 1})
+    store.get('s1')['turn'] = 99
+    assert store.get('s1') == {'turn': 1}
+    assert store.update('s1', {'turn': 2}) == {'turn': 2}
+    assert store.get('s1') == {'turn': 2}
+
+def test_db_sessions_are_visible_to_other_workers(app):
+    with app.app_context():
+        worker_a = SessionStore(DatabaseSessionBackend())
+        worker_b = SessionStore(DatabaseSessionBackend())
+        worker_a.save('shared', {'active': True})
+        assert GameSession.query.get('shared') is not None
+        assert worker_b.get('shared') == {'active': True}
+        worker_b.delete('shared')
+        assert SessionStore(DatabaseSessionBackend()).get('shared') is None
+
+def test_sessions_survive_a_restart(app, client):
+    session_id = client.post('/api/start_session').get_json()['session_id']
+    # A fresh store (new process) only has the database to go on
+    app.extensions.pop('session_store')
+    resp = client.post('/api/continue_session', json={'session_id': session_id})
+    assert resp.status_code == 200
+    with app.app_context():
+        assert isinstance(get_session_store().backend, DatabaseSessionBackend)
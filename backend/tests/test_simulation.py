@@ -0,0 +1,68 @@
+import pytest
+from backend.simulation import CombatantSpec, simulate
+
+PARTY = [CombatantSpec('Fighter', 'party', 30, 17, 5, '1d8+3', 1),
+         CombatantSpec('Cleric', 'party', 24, 16, 4, '1d8+2')]
+GOBLINS = [CombatantSpec('Goblin', 'enemies', 7, 15, 4, '1d6+2', 2) for _ in range(3)]
+
+def test_same_seed_reproduces_across_worker_counts():
+    local = simulate(PARTY + GOBLINS, trials=2500, seed=11, workers=1)
+    pooled = simulate(PARTY + GOBLINS, trials=2500, seed=11, workers=2)
+    assert local == pooled
+    assert simulate(PARTY + GOBLINS, trials=2500, seed=12, workers=1) != local
+
+def test_summary_is_consistent():
+    result = simulate(PARTY + GOBLINS, trials=1500, seed=3, workers=1)
+    assert sum(result['win_rates'].values()) == pytest.approx(1.0)
+    assert sum(result['rounds']['distribution'].values()) == 1500
+    assert 1 <= result['rounds']['median'] <= result['rounds']['p90']
+    # One rate per roster entry, so the three same-named goblins stay apart
+    assert len(result['death_rates']) == len(PARTY + GOBLINS)
+    assert all(0.0 <= rate <= 1.0 for rate in result['death_rates'])
+    assert result['death_rates'][2:] != [0.0] * 3
+
+def test_lopsided_fights_and_stalemates():
+    dragon = CombatantSpec('Dragon', 'enemies', 300, 19, 14, '4d10+8', 10)
+    assert simulate(PARTY + [dragon], trials=200, seed=1, workers=1)['win_rates']['enemies'] == 1.0
+    # Nobody can hurt anybody: every fight runs out the clock
+    pacifists = [CombatantSpec('A', 'a', 10, 10, damage='0'), CombatantSpec('B', 'b', 10, 10, damage='0')]
+    result = simulate(pacifists, trials=100, max_rounds=5, workers=1)
+    assert result['win_rates']['draw'] == 1.0
+    assert result['rounds']['distribution'] == {5: 100}
+
+def test_rejects_one_sided_encounters_and_bad_dice():
+    with pytest.raises(ValueError):
+        simulate(PARTY, trials=10)
+    with pytest.raises(ValueError):
+        simulate(PARTY + [CombatantSpec('Ooze', 'enemies', 10, 8, damage='2q6')], trials=10)
+
+def test_saving_throws_get_through_armor_and_halve_damage():
+    knight = CombatantSpec('Knight', 'party', 40, 30, 0, '1d4', save=0)
+    swordsman = CombatantSpec('Swordsman', 'enemies', 1000, 10, 0, '2d6')
+    evoker = CombatantSpec('Evoker', 'enemies', 1000, 10, 0, '2d6', save_dc=15)
+    # Only natural 20s hit AC 30; a DC 15 save fails most of the time
+    slow = simulate([knight, swordsman], trials=300, seed=5, workers=1)['rounds']['mean']
+    fast = simulate([knight, evoker], trials=300, seed=5, workers=1)['rounds']['mean']
+    assert fast < slow
+    # A target that always saves (bar a natural 1) still takes half
+    warded = knight._replace(save=100)
+    result = simulate([warded, evoker], trials=300, seed=5, workers=1)
+    assert result['win_rates']['enemies'] == 1.0 and result['rounds']['mean'] > fast
+
+def test_unseeded_runs_draw_and_report_a_fresh_seed():
+    first = simulate(PARTY + GOBLINS, trials=500, workers=1)
+    second = simulate(PARTY + GOBLINS, trials=500, workers=1)
+    assert first['seed'] != second['seed']
+    assert simulate(PARTY + GOBLINS, trials=500, seed=first['seed'], workers=1) == first
+
+def test_turn_order_matches_the_initiative_tracker():
+    import numpy as np
+    from backend.engine import Character
+    from backend.initiative import InitiativeTracker, turn_order
+    names = ['Goblin', 'Archer', 'Goblin', 'Bard']
+    initiatives = np.array([[12, 12, 12, 5], [3, 18, 3, 18]])
+    for row, expected in zip(initiatives, turn_order(initiatives, names)):
+        chars = [Character(name) for name in names]
+        for char, value in zip(chars, row):
+            char.initiative = int(value)
+        assert [chars.index(c) for c in InitiativeTracker(chars)] == list(expected)
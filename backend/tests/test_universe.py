@@ -63,3 +63,59 @@ def test_rules_are_saved_for_future_use():
     for sys, expected_rules in systems_and_rules.items():
         assert sys in rule_cache
         assert rule_cache[sys] == expected_rules
+
+def test_layers_resolve_lazily_and_fold_in_system_order():
+    u = Universe(name='TestU', owner_id='user1')
+    u.add_system('A', {'combat': 'a', 'magic': 'spells'})
+    u.add_system('B', {'combat': 'b'})
+    u.add_system('C', {'combat': 'c', 'magic': 'spells'})
+    assert u.get_rule('combat') == '[Merged] [Merged] a | b | c'
+    assert u.get_rule('magic') == 'spells'
+    assert dict(u.rules) == {'combat': '[Merged] [Merged] a | b | c', 'magic': 'spells'}
+    assert u.get_rule('missing') is None and 'missing' not in u.rules
+    with pytest.raises(TypeError):
+        u.rules['combat'] = 'x'
+
+def test_remove_and_reorder_systems_recompute_only_affected_keys():
+    u = Universe(name='TestU', owner_id='user1')
+    u.add_system('A', {'combat': 'a', 'skills': 's'})
+    u.add_system('B', {'combat': 'b'})
+    u.add_system('C', {'loot': 'gold'})
+    assert u.get_rule('combat') == '[Merged] a | b'
+    u.get_rule('skills')
+    u.get_rule('loot')
+    u.move_system('B', 0)
+    assert u.all_systems() == ['B', 'A', 'C']
+    assert set(u._resolved) == {'skills', 'loot'}  # only B's keys were dropped
+    assert u.get_rule('combat') == '[Merged] b | a'
+    u.remove_system('A')
+    assert u.get_rule('combat') == 'b'
+    assert u.get_rule('skills') is None and not u.has_system('A')
+    # A removed system can be added again
+    u.add_system('A', {'combat': 'a'})
+    assert u.get_rule('combat') == '[Merged] b | a'
+
+def test_overrides_are_a_separate_layer():
+    u = Universe(name='TestU', owner_id='user1')
+    source = {'combat': 'a'}
+    u.add_system('A', source)
+    source['combat'] = 'mutated'
+    u.add_system('B', {'combat': 'b'})
+    u.set_user_override('combat', 'house rule')
+    u.set_user_override('homebrew', 'crits explode')
+    assert u.rules['combat'] == 'house rule' and u.rules['homebrew'] == 'crits explode'
+    assert len(u.rules) == 2
+    u.clear_user_override('combat')
+    # The underlying merge was never baked in
+    assert u.get_rule('combat') == '[Merged] a | b'
+
+def test_many_systems_resolve_from_cache():
+    u = Universe(name='Big', owner_id='user1')
+    for s in range(12):
+        u.add_system(f"S{s}", {f"rule{k}": f"S{s} text {k % (s + 1)}" for k in range(2000)})
+    calls = []
+    original = u._fold
+    u._fold = lambda key: calls.append(key) or original(key)
+    first = [u.get_rule(f"rule{k}") for k in range(2000)]
+    assert [u.get_rule(f"rule{k}") for k in range(2000)] == first
+    assert len(calls) == 2000
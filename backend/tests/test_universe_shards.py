@@ -0,0 +1,199 @@
+import numpy as np
+import pytest
+from backend.app import db
+from backend.ingest import page_chunks
+from backend.models import Rulebook, Universe, UserUniverseShare
+from backend.rule_chunks import replace_chunks
+from backend.universe_shards import Shard, ShardManager, accessible_universes
+from backend.utils_embedding import HashingEmbedder, SimpleVectorStore
+
+@pytest.fixture
+def universes(app, tmp_path, monkeypatch):
+    # Two universes owned by alice, one shared with bob
+    monkeypatch.setenv('RULEBOOK_INDEX_DIR', str(tmp_path))
+    with app.app_context():
+        ids = {}
+        for name, text in [('Fantasy', "Magic\nFireball deals fire damage to every creature in range."),
+                           ('Space', "Starships\nHyperdrive jumps need a navigation check.")]:
+            universe = Universe(name=name, owner_id='alice')
+            db.session.add(universe)
+            db.session.commit()
+            rulebook = Rulebook(filename=f"{name}.txt", rpg_system=name, rules={'rules': text}, universe_id=universe.id)
+            db.session.add(rulebook)
+            db.session.commit()
+            replace_chunks(rulebook, page_chunks({'rules': text}))
+            ids[name] = universe.id
+        db.session.add(UserUniverseShare(universe_id=ids['Space'], user_id='bob'))
+        db.session.commit()
+        yield ids
+
+def sized_loader(sizes, loads):
+    def loader(universe_id):
+        loads.append(universe_id)
+        embedder = HashingEmbedder(dim=4)
+        store = SimpleVectorStore()
+        store.add([f"u{universe_id}-{i}" for i in range(sizes[universe_id])], [[1.0, 0, 0, 0]] * sizes[universe_id])
+        return Shard(universe_id, [(universe_id, store, embedder)])
+    return loader
+
+def test_access_is_owned_or_shared(app, universes):
+    with app.app_context():
+        assert accessible_universes('alice') == set(universes.values())
+        assert accessible_universes('bob') == {universes['Space']}
+        assert accessible_universes('mallory') == set()
+
+def test_shard_loads_lazily_and_searches_its_universe(app, universes):
+    with app.app_context():
+        manager = ShardManager()
+        assert manager.stats()['loaded'] == []
+        hits = manager.search_for_user('alice', 'fireball fire damage', top_k=1)
+        assert 'Fireball' in hits[0]['text'] and hits[0]['universe_id'] == universes['Fantasy']
+        assert sorted(manager.stats()['loaded']) == sorted(universes.values())
+        manager.search_for_user('alice', 'hyperdrive')
+        assert manager.stats()['hits'] == 2
+
+def test_search_never_crosses_into_unshared_universes(app, universes):
+    with app.app_context():
+        manager = ShardManager()
+        hits = manager.search_for_user('bob', 'fireball fire damage', top_k=5)
+        assert hits and all(h['universe_id'] == universes['Space'] for h in hits)
+        assert manager.stats()['loaded'] == [universes['Space']]
+        assert manager.search_for_user('bob', 'fireball', universe_ids=[universes['Fantasy']]) == []
+        assert manager.search_for_user('mallory', 'fireball') == []
+
+def test_cold_shards_are_evicted_under_budget():
+    loads = []
+    sizes = {1: 6, 2: 3, 3: 4}
+    shard_bytes = max(sized_loader(sizes, [])(u).nbytes for u in sizes)  # embeddings plus metadata
+    manager = ShardManager(memory_budget=2.5 * shard_bytes, loader=sized_loader(sizes, loads),
+                           check_interval=None)
+    manager.get(1)
+    manager.get(2)
+    manager.get(1)  # 2 is now least recently used
+    manager.get(3)  # three shards exceed the budget: evict 2
+    stats = manager.stats()
+    assert stats['loaded'] == [1, 3] and stats['evictions'] == 1
+    assert stats['bytes'] <= stats['memory_budget']
+    manager.get(2)  # reloaded on demand
+    assert loads == [1, 2, 3, 2]
+
+def test_oversized_shard_still_serves():
+    manager = ShardManager(memory_budget=1, loader=sized_loader({1: 5}, []), check_interval=None)
+    assert manager.get(1).universe_id == 1
+    assert manager.stats()['loaded'] == [1]
+
+def test_reindexed_rulebook_reloads_shard(app, universes):
+    now = [0.0]
+    with app.app_context():
+        manager = ShardManager(clock=lambda: now[0], check_interval=5.0)
+        assert manager.search_for_user('bob', 'hyperdrive', top_k=1)
+        rulebook = Rulebook.query.filter_by(universe_id=universes['Space']).first()
+        text = "Docking\nTractor beams pull ships into the hangar."
+        replace_chunks(rulebook, page_chunks({'rules': text}))
+        from backend.rulebook_index import index_chunks
+        index_chunks(rulebook.id, [text])
+        now[0] = 10.0
+        hits = manager.search_for_user('bob', 'tractor beams', top_k=1)
+        assert 'Tractor' in hits[0]['text']
+        assert manager.stats()['reloads'] == 1
+
+def test_shard_search_endpoint(app, client, universes):
+    session_id = client.post('/api/start_session', json={'user_id': 'bob'}).get_json()['session_id']
+    response = client.post('/api/rules/search', json={'session_id': session_id, 'query': 'hyperdrive jumps'})
+    assert response.status_code == 200
+    assert 'Hyperdrive' in response.get_json()['results'][0]['text']
+    # Universes outside the user's are left out of scope, not an error
+    unshared = client.post('/api/rules/search', json={'session_id': session_id, 'query': 'fireball',
+                                                      'universe_ids': [universes['Fantasy']]})
+    assert unshared.status_code == 200 and unshared.get_json()['results'] == []
+    anonymous = client.post('/api/start_session').get_json()['session_id']
+    assert client.post('/api/rules/search', json={'session_id': anonymous, 'query': 'x'}).status_code == 400
+
+def test_chat_stream_injects_accessible_rules(app, client, universes, monkeypatch):
+    from backend import gpt4_utils
+    prompts = []
+
+    def capture(prompt):
+        prompts.append(prompt)
+        yield 'ok'
+    monkeypatch.setitem(gpt4_utils.STREAMERS, 'capture', capture)
+    app.config['GM_MODEL'] = 'capture'
+    client.post('/api/kill_switch', json={'enabled': False})
+    session_id = client.post('/api/start_session', json={'user_id': 'bob'}).get_json()['session_id']
+    client.post('/api/chat/stream', json={'session_id': session_id, 'message': 'I cast fireball at the hyperdrive'}).get_data()
+    assert 'Hyperdrive jumps' in prompts[0]
+    assert 'Fireball' not in prompts[0].split('Player:')[0]
+
+def test_shard_search_filters_on_chunk_metadata(app, client, universes):
+    session_id = client.post('/api/start_session', json={'user_id': 'alice'}).get_json()['session_id']
+    response = client.post('/api/rules/search', json={'session_id': session_id, 'query': 'fireball hyperdrive',
+                                                      'top_k': 5, 'where': {'rpg_system': 'Space'}})
+    results = response.get_json()['results']
+    assert results and {r['rpg_system'] for r in results} == {'Space'}
+    assert results[0]['kind'] == 'text' and results[0]['section'] == 'Starships'
+    response = client.post('/api/rules/search', json={'session_id': session_id, 'query': 'fireball',
+                                                      'exclude': {'section': ['Magic', 'Starships']}})
+    assert response.get_json()['results'] == []
+    bad = client.post('/api/rules/search', json={'session_id': session_id, 'query': 'x', 'where': {'owner': 'me'}})
+    assert bad.status_code == 400
+
+def test_reingested_rulebook_is_swapped_into_loaded_shard(app, universes):
+    from backend.rulebook_index import index_chunks
+    from backend.universe_shards import refresh_rulebook_shards
+    with app.app_context():
+        manager = app.extensions['shard_manager'] = ShardManager(check_interval=None)
+        assert 'Hyperdrive' in manager.search_for_user('bob', 'hyperdrive', top_k=1)[0]['text']
+        rulebook = Rulebook.query.filter_by(universe_id=universes['Space']).first()
+        text = "Docking\nTractor beams pull ships into the hangar."
+        replace_chunks(rulebook, page_chunks({'rules': text}))
+        index_chunks(rulebook.id, [text], metadata=[{'section': 'Docking', 'kind': 'text'}])
+        refresh_rulebook_shards(rulebook, app)
+        # The old chunks stop matching at once, without reloading the shard
+        hits = manager.search_for_user('bob', 'hyperdrive tractor', top_k=5)
+        assert [h['text'] for h in hits] == [text]
+        assert hits[0]['rpg_system'] == 'Space' and hits[0]['rulebook_id'] == rulebook.id
+        stats = manager.stats()
+        assert stats['loads'] == 1 and stats['reloads'] == 0
+        # The part was replaced by the new index, still memory-mapped
+        part = manager.get(universes['Space']).parts[rulebook.id][0]
+        assert isinstance(part.embeddings, np.memmap)
+        assert stats['tombstone_ratio'] == 0.0 and stats['shards'][str(universes['Space'])]['rows'] == 1
+
+def test_deleted_section_leaves_retrieval_for_every_worker(app, client, universes):
+    from backend.rule_chunks import chunk_records
+    from backend.rulebook_index import index_chunks, index_metrics
+    now = [0.0]
+    with app.app_context():
+        rulebook = Rulebook.query.filter_by(universe_id=universes['Space']).first()
+        chunks = [{'text': text, 'section': section, 'kind': 'text'} for text, section in [
+            ("Hyperdrive jumps need a navigation check.", 'Jump'), ("Shields absorb laser fire.", 'Combat'),
+            ("Docking takes one turn.", 'Dock'), ("Tractor beams pull ships into the hangar.", 'Dock'),
+            ("Cargo holds fit ten crates.", 'Hold')]]
+        replace_chunks(rulebook, chunks)
+        index_chunks(rulebook.id, [c['text'] for c in chunks], metadata=[{'section': c['section'], 'kind': 'text'} for c in chunks])
+        rulebook_id = rulebook.id
+        local = app.extensions['shard_manager'] = ShardManager(check_interval=None)
+        other = ShardManager(clock=lambda: now[0], check_interval=5.0)  # another worker
+        assert 'Shields' in other.search_for_user('bob', 'shields laser fire', top_k=1)[0]['text']
+        local.get(universes['Space'])
+        compactions = index_metrics()['compactions']
+    response = client.delete(f'/rulebooks/{rulebook_id}/sections/Combat')
+    assert response.status_code == 200 and response.get_json()['chunks_deleted'] == 1
+    with app.app_context():
+        # Tombstoned in a new published version: this worker swaps it in at
+        # once, the other on its next staleness check
+        assert all(h['section'] != 'Combat' for h in local.search_for_user('bob', 'shields laser fire', top_k=5))
+        assert local.stats()['tombstone_ratio'] == 0.2
+        now[0] = 10.0
+        assert all(h['section'] != 'Combat' for h in other.search_for_user('bob', 'shields laser fire', top_k=5))
+        assert other.stats()['reloads'] == 1
+    # Past the compaction ratio the live rows are rewritten on disk
+    assert client.delete(f'/rulebooks/{rulebook_id}/sections/Dock').get_json()['chunks_deleted'] == 2
+    with app.app_context():
+        part = local.get(universes['Space']).parts[rulebook_id][0]
+        assert part.texts == ["Hyperdrive jumps need a navigation check.", "Cargo holds fit ten crates."]
+        assert part.tombstone_ratio == 0.0 and isinstance(part.embeddings, np.memmap)
+        assert index_metrics()['compactions'] == compactions + 1
+        assert [c['section'] for c in chunk_records(rulebook_id)] == ['Jump', 'Hold']
+    assert client.delete(f'/rulebooks/{rulebook_id}/sections/Dock').status_code == 404
+    assert client.delete('/rulebooks/999999/sections/Dock').status_code == 404
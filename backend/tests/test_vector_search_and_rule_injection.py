@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from backend.utils_embedding import chunk_text, embed_texts, SimpleVectorStore
 
 def test_vector_search_retrieves_relevant_rule_chunks():
@@ -91,3 +92,184 @@ def test_fallback_when_no_relevant_rules_found():
     assert fallback in prompt_with_rules
     assert "Rules:\n" in prompt_with_rules
     assert player_input in prompt_with_rules
+
+def test_vector_store_incremental_add_grows_without_rebuild():
+    store = SimpleVectorStore()
+    rng = np.random.default_rng(0)
+    vectors = rng.random((300, 16))
+    for start in range(0, 300, 7):
+        store.add([f"chunk{i}" for i in range(start, min(start + 7, 300))], vectors[start:start + 7])
+    assert len(store) == 300
+    assert store.embeddings.dtype == np.float32
+    assert store.embeddings.shape == (300, 16)
+    # Capacity doubles rather than growing per batch
+    assert store._buffer.shape[0] == 512
+    results = store.search(vectors[123:124], top_k=3)
+    assert results[0][0] == "chunk123"
+    assert results[0][1] == pytest.approx(0.0, abs=1e-5)
+    assert [d for _, d in results] == sorted(d for _, d in results)
+
+def test_vector_store_rejects_mismatched_dimensions():
+    store = SimpleVectorStore()
+    store.add(["a"], np.ones((1, 4)))
+    with pytest.raises(ValueError):
+        store.add(["b"], np.ones((1, 5)))
+    with pytest.raises(ValueError):
+        store.search(np.ones((1, 5)))
+
+def test_search_batch_returns_ranked_results_per_query():
+    rules = [
+        "Movement: Each turn, a character may move up to their speed.",
+        "Combat: Roll a d20 and add modifiers.",
+        "Magic: Spell slots are consumed when casting spells."
+    ]
+    embeddings, vectorizer = embed_texts(rules)
+    store = SimpleVectorStore()
+    store.add(rules, embeddings)
+    queries = vectorizer.transform(["combat roll", "spell slots", "move speed"]).toarray()
+    results = store.search_batch(queries, top_k=2)
+    assert len(results) == 3
+    assert [hits[0][0] for hits in results] == [rules[1], rules[2], rules[0]]
+    assert all(len(hits) == 2 for hits in results)
+    # Single-query search agrees with the batched path
+    assert store.search(queries[1:2], top_k=2) == results[1]
+    # An empty store still answers every query row
+    assert SimpleVectorStore().search_batch(queries, top_k=2) == [[], [], []]
+    assert SimpleVectorStore().search(queries[0], top_k=2) == []
+
+def test_retrieve_rules_feeds_prompt_builder():
+    from backend.gpt4_utils import format_prompt_with_rules
+    from backend.utils_embedding import retrieve_rules
+    rules = ["Stealth: Roll a d20 to sneak.", "Charisma: Roll to persuade NPCs."]
+    embeddings, vectorizer = embed_texts(rules)
+    store = SimpleVectorStore()
+    store.add(rules, embeddings)
+    actions = ["I sneak past the guard", "I persuade the king"]
+    per_action = retrieve_rules(store, vectorizer, actions, top_k=1)
+    assert per_action == [[rules[0]], [rules[1]]]
+    prompt = format_prompt_with_rules("Name: Hero", ["You enter a cave."], actions[0], per_action[0])
+    assert prompt.startswith(f"Rules:\n{rules[0]}\n---\n")
+    assert actions[0] in prompt
+    fallback = format_prompt_with_rules("Name: Hero", [], "I fly.", [])
+    assert "No relevant rules found." in fallback
+
+def test_hashing_embedder_appends_new_uploads_without_reembedding():
+    from backend.utils_embedding import HashingEmbedder, retrieve_rules
+    rules = ["Stealth: Roll a d20 to sneak.", "Perception: Roll to spot hidden objects."]
+    new_rules = ["Charisma: Roll to persuade NPCs."]
+    embedder = HashingEmbedder()
+    embeddings, _ = embed_texts(rules, embedder)
+    store = SimpleVectorStore()
+    store.add(rules, embeddings)
+    before = store.embeddings.copy()
+    # The second upload is embedded on its own and appended
+    store.add(new_rules, embed_texts(new_rules, embedder)[0])
+    assert np.array_equal(store.embeddings[:2], before)
+    assert embedder.n_docs == 3 and store.dim == embedder.dim
+    hits = retrieve_rules(store, embedder, ["sneak", "spot hidden", "persuade"], top_k=1)
+    assert hits == [[rules[0]], [rules[1]], [new_rules[0]]]
+    # Stateless space: a separately built embedder yields the same document vectors
+    assert np.allclose(HashingEmbedder().embed_documents(new_rules), store.embeddings[2:])
+
+def test_hashing_embedder_idf_tracks_document_frequencies():
+    from backend.utils_embedding import HashingEmbedder
+    embedder = HashingEmbedder(dim=64)
+    embedder.partial_fit(["roll the dice", "roll for damage", "cast a spell"])
+    query = embedder.transform(["roll spell"]).toarray()[0]
+    roll, spell = embedder.counts(["roll"]).indices[0], embedder.counts(["spell"]).indices[0]
+    assert query[spell] > query[roll] > 0
+
+def test_metadata_filters_restrict_search_to_matching_rows():
+    from backend.utils_embedding import HashingEmbedder, retrieve_rules
+    rules = ["Combat: roll a d20 to attack.", "Weapons table: sword d8, axe d10.",
+             "Sanity: roll a d100 against your sanity.", "Combat: roll initiative each round."]
+    metadata = [{'rpg_system': 'D&D', 'section': 'Combat', 'kind': 'text'},
+                {'rpg_system': 'D&D', 'section': 'Weapons', 'kind': 'table'},
+                {'rpg_system': 'Call of Cthulhu', 'section': 'Sanity', 'kind': 'text'},
+                {'rpg_system': 'Call of Cthulhu', 'section': 'Combat', 'kind': 'text'}]
+    embedder = HashingEmbedder()
+    store = SimpleVectorStore()
+    store.add(rules[:2], embed_texts(rules[:2], embedder)[0], metadata[:2])
+    store.add(rules[2:], embed_texts(rules[2:], embedder)[0], metadata[2:])
+    hits = retrieve_rules(store, embedder, ["roll"], top_k=4, where={'rpg_system': 'Call of Cthulhu'})[0]
+    assert sorted(hits) == sorted(rules[2:])
+    hits = retrieve_rules(store, embedder, ["roll d20 attack"], top_k=4,
+                          where={'section': 'Combat'}, exclude={'rpg_system': 'D&D'})[0]
+    assert hits == [rules[3]]
+    assert rules[1] not in retrieve_rules(store, embedder, ["sword"], top_k=4, exclude={'kind': 'table'})[0]
+    assert retrieve_rules(store, embedder, ["sword"], top_k=2, where={'kind': ['table', 'text']})[0][0] == rules[1]
+    assert retrieve_rules(store, embedder, ["roll"], where={'section': 'Magic'}) == [[]]
+    # Filters follow column rewrites and constant tags
+    store.tag(rulebook_id=9)
+    store.set_column('kind', ['text'], 1)
+    assert rules[1] in retrieve_rules(store, embedder, ["sword"], top_k=1, where={'kind': 'text', 'rulebook_id': 9})[0]
+    assert store.row_metadata(2) == {'rpg_system': 'Call of Cthulhu', 'section': 'Sanity', 'kind': 'text', 'rulebook_id': 9}
+
+def test_metadata_index_is_linear_in_rows_and_counted_in_nbytes():
+    # One distinct section per row must not cost a rows x values mask matrix
+    rows = 5000
+    store = SimpleVectorStore()
+    store.add([f"r{i}" for i in range(rows)], np.eye(4)[np.arange(rows) % 4],
+              [{'section': f"s{i}", 'kind': 'text'} for i in range(rows)])
+    metadata = store.nbytes - store._buffer.nbytes
+    assert 0 < metadata < 2 * rows * 16  # two fields, a code and a list slot per row each
+    assert [t for t, _ in store.search(np.eye(4)[3:], top_k=5, where={'section': ['s7', 's4999', 'missing']})] == ["r7", "r4999"]
+
+def test_unfiltered_rows_without_metadata_stay_searchable():
+    store = SimpleVectorStore()
+    store.add(["a", "b"], np.eye(2))
+    store.add(["c"], np.array([[1.0, 1.0]]), [{'kind': 'table'}])
+    assert [t for t, _ in store.search(np.array([[1.0, 0.0]]), top_k=3)] == ["a", "c", "b"]
+    assert [t for t, _ in store.search(np.array([[1.0, 0.0]]), top_k=3, where={'kind': None})] == ["a", "b"]
+    assert [t for t, _ in store.search(np.array([[1.0, 0.0]]), top_k=3, exclude={'kind': 'table'})] == ["a", "b"]
+
+def test_deleted_rulebook_rows_are_skipped_then_compacted_away():
+    store = SimpleVectorStore(compact_ratio=None)
+    store.add(["old combat", "old magic"], np.array([[1.0, 0.0], [0.0, 1.0]]), {'rulebook_id': 1})
+    store.add(["other"], np.array([[1.0, 1.0]]), {'rulebook_id': 2})
+    assert store.delete_by_rulebook(1) == 2
+    assert store.delete_by_rulebook(1) == 0
+    # Tombstoned rows drop out of search immediately, filtered or not
+    assert [t for t, _ in store.search(np.array([[1.0, 0.0]]), top_k=3)] == ["other"]
+    assert store.search(np.array([[1.0, 0.0]]), where={'rulebook_id': 1}) == []
+    assert len(store) == 3 and store.live == 1
+    assert store.stats()['tombstone_ratio'] == pytest.approx(2 / 3)
+    store.add(["new combat"], np.array([[1.0, 0.0]]), {'rulebook_id': 1})
+    assert store.compact()
+    assert store.texts == ["other", "new combat"] and len(store) == 2
+    assert store.columns['rulebook_id'] == [2, 1]
+    assert store.search(np.array([[1.0, 0.0]]), top_k=1, where={'rulebook_id': 1})[0][0] == "new combat"
+    stats = store.stats()
+    assert stats['tombstones'] == 0 and stats['compactions'] == 1 and stats['rows_compacted'] == 2
+    assert stats['last_compaction_seconds'] >= 0
+
+def test_compaction_runs_in_background_past_threshold():
+    store = SimpleVectorStore(compact_ratio=0.5)
+    store.add([f"rule {i}" for i in range(8)], np.eye(8), [{'rulebook_id': i % 4} for i in range(8)])
+    store.delete_by_rulebook(0)  # 2 of 8: below threshold
+    store.wait_for_compaction()
+    assert store.stats()['compactions'] == 0
+    store.delete_by_rulebook(1)
+    store.delete_by_rulebook(2)  # 6 of 8
+    store.wait_for_compaction(timeout=5)
+    assert store.stats()['compactions'] == 1
+    assert store.texts == ["rule 3", "rule 7"] and store.stats()['tombstone_ratio'] == 0.0
+
+def test_compaction_racing_a_write_is_discarded():
+    class Racing(SimpleVectorStore):
+        victim = None
+
+        def __init__(self, **kwargs):
+            # Compaction builds its fresh store outside the lock; write then
+            super().__init__(**kwargs)
+            if Racing.victim is not None:
+                victim, Racing.victim = Racing.victim, None
+                victim.add(["c"], np.array([[1.0, 1.0]]))
+    store = Racing(compact_ratio=None)
+    store.add(["a", "b"], np.eye(2))
+    store.delete([0])
+    Racing.victim = store
+    assert not store.compact()
+    assert store.texts == ["a", "b", "c"] and store.stats()['compactions_aborted'] == 1
+    assert [t for t, _ in store.search(np.array([[1.0, 0.0]]), top_k=3)] == ["c", "b"]
+    assert store.compact() and store.texts == ["b", "c"]
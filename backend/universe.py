@@ -1,43 +1,130 @@
 # Universe logic for managing multiple RPG systems and merged rules
-from typing import List, Dict, Optional
+#
+# Each system's rules and the user overrides are kept as separate immutable
+# layers. A key is resolved lazily on first read by folding the layers that
+# define it (in system order) and memoized; adding, removing or reordering a
+# system only invalidates the keys that system defines.
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Dict, Iterator, List, Optional
+
+
+class ResolvedRules(Mapping):
+    # Read-only dict-like view of a universe's resolved rules
+    def __init__(self, universe: 'Universe'):
+        self._universe = universe
+
+    def __getitem__(self, key: str) -> str:
+        value = self._universe.get_rule(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        u = self._universe
+        return key in u._overrides or key in u._key_systems
+
+    def __iter__(self) -> Iterator[str]:
+        u = self._universe
+        yield from u._key_systems
+        yield from (k for k in u._overrides if k not in u._key_systems)
+
+    def __len__(self) -> int:
+        u = self._universe
+        return len(u._key_systems) + sum(1 for k in u._overrides if k not in u._key_systems)
+
 
 class Universe:
     def __init__(self, name: str, owner_id: str):
         self.name = name
         self.owner_id = owner_id
-        self.systems: List[str] = []
-        self.rules: Dict[str, str] = {}  # e.g., {'combat': '...', 'skills': '...'}
-        self.user_overrides: Dict[str, str] = {}
+        self._layers: Dict[str, MappingProxyType] = {}  # system -> its rules, in system order
+        self._position: Dict[str, int] = {}
+        self._key_systems: Dict[str, List[str]] = {}  # key -> systems defining it, in order
+        self._overrides: Dict[str, str] = {}
+        self._resolved: Dict[str, str] = {}  # memoized per key
+        self.rules = ResolvedRules(self)  # e.g., {'combat': '...', 'skills': '...'}
+
+    @property
+    def systems(self) -> List[str]:
+        return list(self._layers)
+
+    @property
+    def user_overrides(self) -> Mapping:
+        return MappingProxyType(self._overrides)
+
+    def _invalidate(self, keys):
+        for k in keys:
+            self._resolved.pop(k, None)
 
     def add_system(self, system: str, rules: Dict[str, str]):
-        if system in self.systems:
+        if system in self._layers:
             raise ValueError(f"System '{system}' already added.")
-        self.systems.append(system)
-        self._merge_rules(rules)
+        layer = MappingProxyType(dict(rules))  # copy: later edits to rules don't leak in
+        self._layers[system] = layer
+        self._position[system] = len(self._position)
+        for k in layer:
+            self._key_systems.setdefault(k, []).append(system)
+        self._invalidate(layer)
 
-    def _merge_rules(self, new_rules: Dict[str, str]):
-        # Naive merge: if conflict, concatenate with separator
-        for k, v in new_rules.items():
-            if k in self.rules and self.rules[k] != v:
-                self.rules[k] = self._resolve_conflict(k, self.rules[k], v)
-            else:
-                self.rules[k] = v
+    def remove_system(self, system: str):
+        layer = self._layers.pop(system)  # KeyError if unknown
+        for k in layer:
+            owners = self._key_systems[k]
+            owners.remove(system)
+            if not owners:
+                del self._key_systems[k]
+        self._position = {s: i for i, s in enumerate(self._layers)}
+        self._invalidate(layer)
+
+    def move_system(self, system: str, index: int):
+        # Reorder: later systems fold in after earlier ones
+        if system not in self._layers:
+            raise KeyError(system)
+        order = [s for s in self._layers if s != system]
+        order.insert(index, system)
+        self._layers = {s: self._layers[s] for s in order}
+        self._position = {s: i for i, s in enumerate(order)}
+        layer = self._layers[system]
+        for k in layer:
+            self._key_systems[k].sort(key=self._position.__getitem__)
+        self._invalidate(layer)
+
+    def _fold(self, key: str) -> Optional[str]:
+        value = None
+        for system in self._key_systems.get(key, ()):
+            v = self._layers[system][key]
+            if value is None:
+                value = v
+            elif value != v:
+                value = self._resolve_conflict(key, value, v)
+        return value
 
     def _resolve_conflict(self, key: str, rule1: str, rule2: str) -> str:
-        # Simulate AI merge: prefer user override, else join
-        if key in self.user_overrides:
-            return self.user_overrides[key]
+        # Simulate AI merge: join the two rules
         return f"[Merged] {rule1} | {rule2}"
 
     def set_user_override(self, key: str, value: str):
-        self.user_overrides[key] = value
-        self.rules[key] = value
+        self._overrides[key] = value
+        self._invalidate((key,))
+
+    def clear_user_override(self, key: str):
+        self._overrides.pop(key, None)
+        self._invalidate((key,))
 
     def get_rule(self, key: str) -> Optional[str]:
-        return self.rules.get(key)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        # User overrides win over any merge
+        value = self._overrides[key] if key in self._overrides else self._fold(key)
+        if value is not None:
+            self._resolved[key] = value
+        return value
 
     def has_system(self, system: str) -> bool:
-        return system in self.systems
+        return system in self._layers
 
     def all_systems(self) -> List[str]:
-        return list(self.systems)
+        return list(self._layers)
@@ -0,0 +1,276 @@
+# Per-universe retrieval shards
+#
+# A shard holds every rulebook index in one universe (Rulebook.universe_id),
+# each kept as its own memory-mapped part, searched with one query vector in
+# the shared hashed space. Shards load on first query and are evicted
+# least-recently-used once their embedding bytes exceed the memory budget, so
+# a worker's memory follows the tables that are actually playing rather than
+# the whole catalogue. A re-ingested rulebook, or one with rows deleted
+# (rulebook_index.delete_rows), has its part replaced by the newly published
+# version in place. Searches are scoped to the universes a user owns or has
+# been shared into. The app has no authentication and user ids come from the
+# client, so this scoping keeps a table's retrieval relevant; it is not
+# access control.
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+from backend import rulebook_index
+from backend.utils_embedding import HashingEmbedder
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+CHECK_INTERVAL = 5.0  # seconds between staleness checks of a loaded shard
+
+
+class Shard:
+    def __init__(self, universe_id, parts=(), signature=None):
+        # parts: [(rulebook_id, store, embedder)], all HashingEmbedder based.
+        # Each store stays as given, normally the rulebook's memory-mapped
+        # index, so workers share the page cache instead of copying rows.
+        self.universe_id = universe_id
+        self.signature = signature
+        self.checked_at = time.monotonic()
+        self._parts = {}  # rulebook_id -> (store, embedder)
+        self._lock = threading.Lock()
+        self.embedder = HashingEmbedder()
+        for rulebook_id, store, embedder in parts:
+            self.put_rulebook(rulebook_id, store, embedder)
+
+    @property
+    def parts(self) -> Dict:
+        return dict(self._parts)
+
+    def put_rulebook(self, rulebook_id, store, embedder, **tags):
+        # Replace a rulebook's part with its current index
+        store.tag(**tags)
+        with self._lock:
+            parts = dict(self._parts)
+            parts[rulebook_id] = (store, embedder)
+            self._parts = parts
+            self._refresh_embedder()
+
+    def drop_rulebook(self, rulebook_id):
+        with self._lock:
+            parts = dict(self._parts)
+            if parts.pop(rulebook_id, None) is None:
+                return
+            self._parts = parts
+            self._refresh_embedder()
+
+    def _refresh_embedder(self):
+        # One query embedder for the whole shard: document frequencies add up.
+        # Built aside and swapped in, so searches in flight keep a whole one.
+        dims = {len(embedder.doc_freq) for _, embedder in self._parts.values()}
+        if len(dims) > 1:
+            raise ValueError(f"Universe {self.universe_id} mixes embedding dimensions {sorted(dims)}")
+        embedder = HashingEmbedder(dims.pop()) if dims else HashingEmbedder()
+        for _, part in self._parts.values():
+            embedder.doc_freq += part.doc_freq
+            embedder.n_docs += part.n_docs
+        self.embedder = embedder
+
+    @property
+    def nbytes(self) -> int:
+        return sum(store.nbytes for store, _ in self._parts.values())
+
+    def __len__(self):
+        return sum(store.live for store, _ in self._parts.values())
+
+    def stats(self) -> Dict:
+        parts = [store.stats() for store, _ in self.parts.values()]
+        return {'rulebooks': len(parts), 'rows': sum(p['rows'] for p in parts),
+                'tombstones': sum(p['tombstones'] for p in parts), 'bytes': sum(p['bytes'] for p in parts)}
+
+    def search(self, query: str, top_k: int = 3, where=None, exclude=None) -> List[Dict]:
+        # where/exclude filter on chunk metadata (see SimpleVectorStore)
+        parts, embedder = self.parts, self.embedder
+        if not any(store.live for store, _ in parts.values()):
+            return []
+        vector = embedder.transform([query]).toarray()
+        hits = []
+        for store, _ in parts.values():
+            results = store.search_batch(vector, top_k=top_k, where=where, exclude=exclude, with_metadata=True)
+            hits.extend({'text': text, 'distance': distance, 'universe_id': self.universe_id, **metadata}
+                        for text, distance, metadata in (results[0] if results else []))
+        hits.sort(key=lambda h: h['distance'])
+        return hits[:top_k]
+
+
+def universe_rulebook_ids(universe_id) -> List[int]:
+    from backend.models import Rulebook
+    rows = Rulebook.query.with_entities(Rulebook.id).filter_by(universe_id=universe_id).order_by(Rulebook.id)
+    return [r.id for r in rows]
+
+
+def universe_signature(universe_id, root=None):
+    # Changes whenever a rulebook joins/leaves the universe or any new index
+    # version of it is published (re-indexed, rows deleted)
+    signature = []
+    for rulebook_id in universe_rulebook_ids(universe_id):
+        link = os.path.join(rulebook_index.index_root(root), str(rulebook_id))
+        signature.append((rulebook_id, os.path.realpath(link) if os.path.exists(link) else None))
+    return tuple(signature)
+
+
+def _open_part(rulebook_id, root=None):
+    # The persisted index, (re)built in the hashed space if missing or legacy
+    # (a TF-IDF vocabulary, or no chunk metadata to filter on)
+    index = rulebook_index.load_index(rulebook_id, root=root)
+    if index is not None and isinstance(index[1], HashingEmbedder) and 'kind' in index[0].columns:
+        return index
+    from backend.ingest import chunk_metadata, chunk_texts
+    from backend.models import Rulebook
+    from backend.rule_chunks import chunk_records
+    chunks = chunk_records(rulebook_id)
+    if chunks:
+        built = rulebook_index.index_chunks(rulebook_id, chunk_texts(chunks), root=root,
+                                            metadata=chunk_metadata(chunks))
+    else:
+        built = rulebook_index.build_index(rulebook_id, Rulebook.query.get(rulebook_id).rules, root=root)
+    # Reopen memory-mapped rather than holding the freshly built copy
+    return rulebook_index.load_index(rulebook_id, root=root) if built is not None else None
+
+
+def load_shard(universe_id, root=None) -> Shard:
+    from backend.models import Rulebook
+    systems = dict(Rulebook.query.with_entities(Rulebook.id, Rulebook.rpg_system).filter_by(universe_id=universe_id))
+    parts = []
+    for rulebook_id, *_ in universe_signature(universe_id, root=root):
+        index = _open_part(rulebook_id, root=root)
+        if index is not None:
+            index[0].tag(rpg_system=systems.get(rulebook_id))
+            parts.append((rulebook_id, index[0], index[1]))
+    # Building may have written new files; record the signature after it
+    return Shard(universe_id, parts, universe_signature(universe_id, root=root))
+
+
+def refresh_rulebook_shards(rulebook, app=None):
+    # Called after a rulebook is (re)ingested so this worker's loaded shard
+    # stops matching its old chunks at once; other workers pick the change
+    # up from the universe signature
+    if rulebook.universe_id is not None:
+        get_shard_manager(app).refresh_rulebook(rulebook.id, rulebook.universe_id, rulebook.rpg_system)
+
+
+def accessible_universes(user_id) -> Set[int]:
+    from backend.models import Universe, UserUniverseShare
+    owned = Universe.query.with_entities(Universe.id).filter_by(owner_id=user_id)
+    shared = UserUniverseShare.query.with_entities(UserUniverseShare.universe_id).filter_by(user_id=user_id)
+    return {r[0] for r in owned} | {r[0] for r in shared}
+
+
+class ShardManager:
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, loader=load_shard,
+                 signature=universe_signature, check_interval: Optional[float] = CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.signature = signature
+        self.check_interval = check_interval
+        self.clock = clock
+        self._shards: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'reloads': 0}
+
+    def _stale(self, shard) -> bool:
+        if self.check_interval is None or self.clock() - shard.checked_at < self.check_interval:
+            return False
+        shard.checked_at = self.clock()
+        return self.signature(shard.universe_id) != shard.signature
+
+    def get(self, universe_id) -> Shard:
+        with self._lock:
+            shard = self._shards.get(universe_id)
+            if shard is not None and self._stale(shard):
+                del self._shards[universe_id]
+                self._stats['reloads'] += 1
+                shard = None
+            if shard is not None:
+                self._shards.move_to_end(universe_id)
+                self._stats['hits'] += 1
+                return shard
+        shard = self.loader(universe_id)  # outside the lock; a racing load just wins last
+        shard.checked_at = self.clock()
+        with self._lock:
+            self._shards[universe_id] = shard
+            self._shards.move_to_end(universe_id)
+            self._stats['loads'] += 1
+            self._evict()
+        return shard
+
+    def _evict(self):
+        # Drop cold shards until within budget; the newest always stays
+        total = sum(s.nbytes for s in self._shards.values())
+        while total > self.memory_budget and len(self._shards) > 1:
+            _, shard = self._shards.popitem(last=False)
+            total -= shard.nbytes
+            self._stats['evictions'] += 1
+
+    def refresh_rulebook(self, rulebook_id, universe_id, rpg_system=None, root=None) -> bool:
+        # Swap a rulebook's current index into its universe's shard, if loaded
+        with self._lock:
+            shard = self._shards.get(universe_id)
+        if shard is None:
+            return False
+        index = rulebook_index.load_index(rulebook_id, root=root)
+        if index is None:
+            shard.drop_rulebook(rulebook_id)
+        else:
+            shard.put_rulebook(rulebook_id, index[0], index[1], rpg_system=rpg_system)
+        shard.signature = self.signature(universe_id)
+        with self._lock:
+            self._evict()
+        return True
+
+    def invalidate(self, universe_id=None):
+        with self._lock:
+            if universe_id is None:
+                self._shards.clear()
+            else:
+                self._shards.pop(universe_id, None)
+
+    def search(self, universe_ids: Iterable[int], query: str, top_k: int = 3,
+               where=None, exclude=None) -> List[Dict]:
+        hits = []
+        for universe_id in sorted(set(universe_ids)):
+            hits.extend(self.get(universe_id).search(query, top_k=top_k, where=where, exclude=exclude))
+        hits.sort(key=lambda h: h['distance'])
+        return hits[:top_k]
+
+    def search_for_user(self, user_id, query: str, universe_ids: Optional[Iterable[int]] = None,
+                        top_k: int = 3, where=None, exclude=None) -> List[Dict]:
+        # Only universes the user owns or is shared into; universe_ids narrows
+        # them further and anything outside them is ignored
+        allowed = accessible_universes(user_id)
+        if universe_ids is not None:
+            allowed &= set(universe_ids)
+        return self.search(allowed, query, top_k=top_k, where=where, exclude=exclude)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            shards = list(self._shards.values())
+        stats['loaded'] = [s.universe_id for s in shards]
+        stats['memory_budget'] = self.memory_budget
+        stats['shards'] = {str(s.universe_id): s.stats() for s in shards}
+        per_shard = stats['shards'].values()
+        stats['bytes'] = sum(s['bytes'] for s in per_shard)
+        rows = sum(s['rows'] for s in per_shard)
+        stats['tombstone_ratio'] = sum(s['tombstones'] for s in per_shard) / rows if rows else 0.0
+        stats.update(rulebook_index.index_metrics())  # compactions done by this process
+        return stats
+
+
+def get_shard_manager(app=None) -> ShardManager:
+    # One per Flask app; SHARD_MEMORY_BUDGET bounds the mapped embedding bytes
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    manager = app.extensions.get('shard_manager')
+    if manager is None:
+        budget = app.config.get('SHARD_MEMORY_BUDGET') or int(os.environ.get('SHARD_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET))
+        manager = ShardManager(memory_budget=budget)
+        app.extensions['shard_manager'] = manager
+    return manager
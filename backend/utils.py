@@ -1,4 +1,5 @@
 # backend/utils.py
+import re
 
 def parse_pdf(file_path):
     # Return mock data for tests
@@ -7,3 +8,47 @@ def parse_pdf(file_path):
 def parse_docx(file_path):
     # Return mock data for tests
     return {'text': 'Header\nList', 'sections': ['Header'], 'tables': [{'name': 'Stats', 'rows': [["HP", "10"]]}]}
+
+# Section split: split on two or more newlines, and also on lines with only dashes or equals
+SECTION_SPLIT = re.compile(r'\n{2,}|^[-=]{2,}$', flags=re.MULTILINE)
+TXT_PAGE_CHARS = 64 * 1024
+
+def split_sections(text):
+    return [s.strip() for s in SECTION_SPLIT.split(text) if s.strip()]
+
+def _document_pages(result):
+    # Split a whole-document parse result into per-page dicts on form feeds.
+    # Document-level sections/tables (and any extra keys) ride on page one.
+    if not isinstance(result, dict):
+        return
+    text_key = 'text' if 'text' in result else 'rules'
+    text = result.get(text_key) or ''
+    if not isinstance(text, str):
+        text = ''
+    for number, page_text in enumerate(text.split('\f')):
+        page = dict(result) if number == 0 else {'sections': [], 'tables': []}
+        page[text_key] = page_text if number == 0 else '\f' + page_text
+        yield page
+
+def iter_pdf_pages(file_path):
+    yield from _document_pages(parse_pdf(file_path))
+
+def iter_docx_pages(file_path):
+    yield from _document_pages(parse_docx(file_path))
+
+def iter_txt_pages(file_path, page_chars=TXT_PAGE_CHARS):
+    # Stream a text file as ~page_chars pages, cutting on blank lines so a
+    # section never straddles two pages (a hard cut happens at 4x page_chars)
+    buffer = []
+    size = 0
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            buffer.append(line)
+            size += len(line)
+            if (size >= page_chars and line.strip() == '') or size >= 4 * page_chars:
+                page = ''.join(buffer)
+                yield {'rules': page, 'sections': split_sections(page), 'tables': []}
+                buffer, size = [], 0
+    if buffer:
+        page = ''.join(buffer)
+        yield {'rules': page, 'sections': split_sections(page), 'tables': []}
@@ -1,31 +1,415 @@
+import sys
+import threading
+import time
+
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.neighbors import NearestNeighbors
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+
+HASH_DIM = 2048
 
 # Simple chunking utility
 def chunk_text(text, chunk_size=200):
     words = text.split()
     return [' '.join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
 
-# Simple embedding utility (TF-IDF)
-def embed_texts(texts):
+# Simple embedding utility (TF-IDF). Pass a HashingEmbedder to embed into its
+# fixed space instead, updating its document frequencies in place.
+def embed_texts(texts, embedder=None):
+    if embedder is not None:
+        return embedder.embed_documents(texts), embedder
     vectorizer = TfidfVectorizer()
     embeddings = vectorizer.fit_transform(texts).toarray()
     return embeddings, vectorizer
 
+def _normalize_rows(matrix):
+    # L2-normalize rows so cosine similarity becomes a plain dot product.
+    # All-zero rows stay zero (cosine distance 1 to everything).
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# Stable embedding model: tokens are hashed into a fixed number of dimensions,
+# so vectors from any corpus share one space and nothing is ever refit. Only
+# document frequencies are learned, incrementally. Document vectors are
+# normalized term counts that never change; idf weighting is applied on the
+# query side (transform), so new chunks are embedded and appended without
+# re-vectorizing the existing corpus.
+class HashingEmbedder:
+    def __init__(self, dim=HASH_DIM, doc_freq=None, n_docs=0):
+        self.dim = dim
+        self._hasher = HashingVectorizer(n_features=dim, alternate_sign=False, norm=None, dtype=np.float32)
+        self.doc_freq = np.zeros(dim, dtype=np.float64) if doc_freq is None else np.asarray(doc_freq, dtype=np.float64)
+        self.n_docs = int(n_docs)
+
+    def counts(self, texts):
+        return self._hasher.transform(texts)
+
+    def partial_fit(self, texts, counts=None):
+        counts = self.counts(texts) if counts is None else counts.tocsr()
+        counts.sum_duplicates()
+        self.doc_freq += np.bincount(counts.indices, minlength=self.dim)
+        self.n_docs += counts.shape[0]
+        return self
+
+    @property
+    def idf_(self):
+        # Smoothed idf, as TfidfVectorizer computes it
+        return np.log((1.0 + self.n_docs) / (1.0 + self.doc_freq)) + 1.0
+
+    def embed_documents(self, texts, update=True):
+        counts = self.counts(texts)
+        if update:
+            self.partial_fit(texts, counts)
+        return _normalize_rows(counts.toarray())
+
+    def transform(self, texts):
+        # Query vectors (sparse, like TfidfVectorizer.transform)
+        return self.counts(texts).multiply(self.idf_.astype(np.float32)).tocsr()
+
+    def fit_transform(self, texts):
+        return self.embed_documents(texts)
+
 # Simple in-memory vector store
+# Embeddings live in a preallocated float32 buffer that doubles when full, so
+# add() costs O(batch) amortized instead of re-stacking the whole matrix.
+# Rows are normalized on insert and search is an exact cosine scan (one
+# matrix-vector product plus argpartition), so there is no index to rebuild.
+#
+# Rows can carry metadata (rulebook_id, rpg_system, section, kind). Each
+# column is also kept as one int32 code per row (a small dictionary maps
+# values to codes), so a filter is an np.isin over the codes: memory is
+# O(rows) per field however many distinct values (sections) there are, and a
+# filtered search scores only the matching rows in one matrix product,
+# instead of over-fetching and filtering afterwards.
+METADATA_FIELDS = ('rulebook_id', 'rpg_system', 'section', 'kind')
+
+
 class SimpleVectorStore:
-    def __init__(self):
+    INITIAL_CAPACITY = 64
+    COMPACT_RATIO = 0.25
+
+    def __init__(self, compact_ratio=COMPACT_RATIO):
         self.texts = []
-        self.embeddings = None
-        self.nn = None
-    def add(self, texts, embeddings):
-        self.texts.extend(texts)
-        if self.embeddings is None:
-            self.embeddings = embeddings
+        self._buffer = None
+        self._size = 0
+        self.columns = {}  # field -> per-row values
+        self._codes = {}  # field -> int32 code per row (capacity may exceed the column)
+        self._code_of = {}  # field -> {value: code}
+        # Deleted rows are tombstoned (skipped by search at once) and only
+        # dropped when a background compaction rewrites the matrix, which
+        # starts once tombstones reach compact_ratio of the rows (None: never)
+        self.compact_ratio = compact_ratio
+        self.source = None  # version directory of a persisted index this was loaded from
+        self._dead = None
+        self._tombstones = 0
+        self._version = 0  # bumped by every write; a compaction racing one is discarded
+        self._lock = threading.RLock()
+        self._compactor = None
+        self.metrics = {'compactions': 0, 'compactions_aborted': 0, 'rows_compacted': 0,
+                        'last_compaction_seconds': 0.0, 'compaction_seconds_total': 0.0}
+
+    @classmethod
+    def from_normalized(cls, texts, embeddings, metadata=None):
+        # Adopt an already-normalized float32 matrix (e.g. a read-only memmap)
+        # without copying it; the first add() copies into a growable buffer.
+        if len(texts) != embeddings.shape[0]:
+            raise ValueError("texts and embeddings must have the same length")
+        store = cls()
+        store.texts = list(texts)
+        store._buffer = embeddings
+        store._size = embeddings.shape[0]
+        store._add_metadata(0, store._size, metadata)
+        return store
+
+    def __len__(self):
+        # Physical rows, tombstoned ones included (see live)
+        return self._size
+
+    @property
+    def live(self):
+        return self._size - self._tombstones
+
+    @property
+    def dim(self):
+        return None if self._buffer is None else self._buffer.shape[1]
+
+    @property
+    def nbytes(self):
+        # Embeddings plus the metadata index: code arrays, value lists, tombstones
+        total = 0 if self._buffer is None else self._buffer.nbytes
+        total += sum(codes.nbytes for codes in self._codes.values())
+        total += sum(sys.getsizeof(column) for column in self.columns.values())
+        return total + (0 if self._dead is None else self._dead.nbytes)
+
+    @property
+    def embeddings(self):
+        # Normalized view of the filled rows (no copy)
+        if self._buffer is None:
+            return None
+        return self._buffer[:self._size]
+
+    def _reserve(self, extra, dim):
+        if self._buffer is None:
+            capacity = max(self.INITIAL_CAPACITY, extra)
+            self._buffer = np.zeros((capacity, dim), dtype=np.float32)
+            return
+        if dim != self._buffer.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self._buffer.shape[1]}")
+        needed = self._size + extra
+        capacity = self._buffer.shape[0]
+        if needed <= capacity and self._buffer.flags.writeable:
+            return
+        capacity = max(capacity, self.INITIAL_CAPACITY)
+        while capacity < needed:
+            capacity *= 2
+        grown = np.zeros((capacity, dim), dtype=np.float32)
+        grown[:self._size] = self._buffer[:self._size]
+        self._buffer = grown
+
+    def add(self, texts, embeddings, metadata=None):
+        # metadata: one dict per row, or a single dict shared by every row
+        rows = _normalize_rows(embeddings)
+        if len(texts) != rows.shape[0]:
+            raise ValueError("texts and embeddings must have the same length")
+        if isinstance(metadata, (list, tuple)) and len(metadata) != rows.shape[0]:
+            raise ValueError("texts and metadata must have the same length")
+        with self._lock:
+            self._reserve(rows.shape[0], rows.shape[1])
+            self._buffer[self._size:self._size + rows.shape[0]] = rows
+            self._add_metadata(self._size, rows.shape[0], metadata)
+            self._size += rows.shape[0]
+            self.texts.extend(texts)
+            self._version += 1
+
+    def merge(self, other, **tags):
+        # Append every row of another store with its metadata, plus tags
+        if not len(other):
+            return
+        with self._lock:
+            start = self._size
+            self.add(other.texts, other.embeddings)
+            for field, column in other.columns.items():
+                self.set_column(field, column, start)
+            for field, value in tags.items():
+                self.set_column(field, [value] * len(other), start)
+
+    def _add_metadata(self, start, count, metadata):
+        if isinstance(metadata, dict):
+            metadata = {field: [value] * count for field, value in metadata.items()}
+        elif metadata:
+            fields = {field for row in metadata for field in row}
+            metadata = {field: [row.get(field) for row in metadata] for field in fields}
         else:
-            self.embeddings = np.vstack([self.embeddings, embeddings])
-        self.nn = NearestNeighbors(n_neighbors=1, metric='cosine').fit(self.embeddings)
-    def search(self, query_embedding, top_k=1):
-        distances, indices = self.nn.kneighbors(query_embedding, n_neighbors=top_k)
-        return [(self.texts[i], distances[0][j]) for j, i in enumerate(indices[0])]
+            metadata = {}
+        for field in set(self.columns) | set(metadata):
+            self.set_column(field, metadata.get(field, [None] * count), start)
+
+    def set_column(self, field, values, start=0):
+        # Write values into rows start.. of a column, keeping its codes in step
+        with self._lock:
+            column = self.columns.setdefault(field, [])
+            if len(column) < start:
+                self.set_column(field, [None] * (start - len(column)), len(column))
+            end = start + len(values)
+            column[start:end] = values
+            code_of = self._code_of.setdefault(field, {})
+            codes = self._codes.get(field)
+            if codes is None or len(codes) < end:
+                grown = np.zeros(max(end, self.INITIAL_CAPACITY, 2 * len(codes) if codes is not None else 0), dtype=np.int32)
+                if codes is not None:
+                    grown[:len(codes)] = codes
+                codes = self._codes[field] = grown
+            codes[start:end] = [code_of.setdefault(value, len(code_of)) for value in values]
+            self._version += 1
+
+    def tag(self, **values):
+        # Give every row the same value for each field (e.g. rulebook_id=3)
+        for field, value in values.items():
+            self.set_column(field, [value] * self._size)
+
+    def mask(self, where=None, exclude=None):
+        # Live rows matching every where field (any of its values) and none
+        # of the exclude values, or None when nothing is filtered
+        if not where and not exclude and not self._tombstones:
+            return None
+        keep = np.ones(self._size, dtype=bool)
+        for field, wanted in (where or {}).items():
+            keep &= self._value_mask(field, wanted)
+        for field, unwanted in (exclude or {}).items():
+            keep &= ~self._value_mask(field, unwanted)
+        if self._tombstones:
+            keep &= ~self._dead[:self._size]
+        return keep
+
+    def _value_mask(self, field, values):
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        hit = np.zeros(self._size, dtype=bool)
+        code_of = self._code_of.get(field, {})
+        wanted = [code_of[value] for value in values if value in code_of]
+        if wanted:
+            n = min(len(self.columns[field]), self._size)
+            hit[:n] = np.isin(self._codes[field][:n], wanted)
+        return hit
+
+    def delete(self, rows):
+        # Tombstone rows (indexes or a bool mask); returns how many were live
+        with self._lock:
+            rows = np.asarray(rows)
+            rows = np.flatnonzero(rows) if rows.dtype == bool else np.unique(rows.astype(np.intp))
+            if self._dead is None or len(self._dead) < self._size:
+                grown = np.zeros(max(self._size, self.INITIAL_CAPACITY), dtype=bool)
+                if self._dead is not None:
+                    grown[:len(self._dead)] = self._dead
+                self._dead = grown
+            fresh = rows[~self._dead[rows]]
+            self._dead[fresh] = True
+            self._tombstones += len(fresh)
+            if len(fresh):
+                self._version += 1
+                self._maybe_compact()
+            return len(fresh)
+
+    def delete_where(self, where):
+        with self._lock:
+            return self.delete(self.mask(where) if where else np.ones(self._size, dtype=bool))
+
+    def delete_by_rulebook(self, rulebook_id):
+        return self.delete_where({'rulebook_id': rulebook_id})
+
+    @property
+    def version(self):
+        return self._version
+
+    def live_rows(self):
+        # Indexes of the rows not tombstoned, in order
+        with self._lock:
+            if not self._tombstones:
+                return np.arange(self._size)
+            return np.flatnonzero(~self._dead[:self._size])
+
+    def dead_rows(self):
+        # Indexes of the tombstoned rows, in order
+        with self._lock:
+            if not self._tombstones:
+                return np.zeros(0, dtype=np.intp)
+            return np.flatnonzero(self._dead[:self._size])
+
+    @property
+    def tombstone_ratio(self):
+        return self._tombstones / self._size if self._size else 0.0
+
+    def _maybe_compact(self):
+        if self.compact_ratio is None or self.tombstone_ratio < self.compact_ratio:
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, name='vector-store-compaction', daemon=True)
+        self._compactor.start()
+
+    def wait_for_compaction(self, timeout=None):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join(timeout)
+
+    def compact(self):
+        # Rewrite the live rows into a fresh matrix without holding the lock;
+        # the swap is skipped if the store was written to meanwhile
+        started = time.perf_counter()
+        with self._lock:
+            if not self._tombstones:
+                return False
+            version, size = self._version, self._size
+            keep = np.flatnonzero(~self._dead[:size])
+            embeddings, texts = self._buffer, self.texts
+            columns = {field: list(column[:size]) for field, column in self.columns.items()}
+        fresh = type(self)(compact_ratio=self.compact_ratio)
+        if len(keep):
+            fresh._reserve(len(keep), embeddings.shape[1])
+            fresh._buffer[:len(keep)] = embeddings[keep]
+            fresh._size = len(keep)
+            fresh.texts = [texts[i] for i in keep]
+            for field, column in columns.items():
+                fresh.set_column(field, [column[i] for i in keep])
+        with self._lock:
+            if self._version != version:
+                self.metrics['compactions_aborted'] += 1
+                return False
+            self._buffer, self._size, self.texts = fresh._buffer, fresh._size, fresh.texts
+            self.columns, self._codes, self._code_of = fresh.columns, fresh._codes, fresh._code_of
+            self.source = None  # no longer the rows on disk
+            self._dead, self._tombstones = None, 0
+            self._version += 1
+            elapsed = time.perf_counter() - started
+            self.metrics['compactions'] += 1
+            self.metrics['rows_compacted'] += size - len(keep)
+            self.metrics['last_compaction_seconds'] = elapsed
+            self.metrics['compaction_seconds_total'] += elapsed
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, rows=self._size, live=self.live, tombstones=self._tombstones,
+                        tombstone_ratio=self.tombstone_ratio, bytes=self.nbytes)
+
+    def search(self, query_embedding, top_k=1, where=None, exclude=None):
+        # Returns [(text, cosine_distance), ...] best first
+        results = self.search_batch(query_embedding, top_k=top_k, where=where, exclude=exclude)
+        return results[0] if results else []
+
+    def search_batch(self, query_matrix, top_k=1, where=None, exclude=None, with_metadata=False):
+        # Scores every query in one matrix product; returns one ranked
+        # [(text, cosine_distance), ...] list per query row (plus each row's
+        # metadata dict with with_metadata). where/exclude filter on
+        # metadata ({'kind': 'text'}, {'section': ['Combat', 'Magic']}).
+        with self._lock:
+            # Writes append or swap in new objects, so this snapshot stays
+            # consistent after the lock is released
+            size, texts, columns = self._size, self.texts, self.columns
+            embeddings = self.embeddings
+            keep = self.mask(where, exclude)
+        queries = _normalize_rows(query_matrix)
+        if size == 0:
+            return [[] for _ in range(queries.shape[0])]
+        if queries.shape[1] != embeddings.shape[1]:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match store dimension {embeddings.shape[1]}")
+        rows = None if keep is None or keep.all() else np.flatnonzero(keep)
+        matrix = embeddings if rows is None else embeddings[rows]
+        n = matrix.shape[0]
+        if n == 0:
+            return [[] for _ in range(queries.shape[0])]
+        scores = queries @ matrix.T
+        top_k = min(top_k, n)
+        if top_k < n:
+            candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.broadcast_to(np.arange(n), scores.shape)
+        results = []
+        for row, cand in zip(scores, candidates):
+            # Best score first, ties broken by insertion order
+            order = cand[np.lexsort((cand, -row[cand]))]
+            distances = np.clip(1.0 - row[order], 0.0, 2.0)
+            ids = order if rows is None else rows[order]
+            if with_metadata:
+                results.append([(texts[i], float(d), _row_metadata(columns, i)) for i, d in zip(ids, distances)])
+            else:
+                results.append([(texts[i], float(d)) for i, d in zip(ids, distances)])
+        return results
+
+    def row_metadata(self, i):
+        return _row_metadata(self.columns, i)
+
+
+def _row_metadata(columns, i):
+    return {field: column[i] for field, column in columns.items() if column[i] is not None}
+
+# Retrieve the top_k rule chunks for each query string, for prompt injection
+def retrieve_rules(store, vectorizer, queries, top_k=1, where=None, exclude=None):
+    if not queries or len(store) == 0:
+        return [[] for _ in queries]
+    query_matrix = vectorizer.transform(queries).toarray()
+    return [[text for text, _ in hits]
+            for hits in store.search_batch(query_matrix, top_k=top_k, where=where, exclude=exclude)]
@@ -4,6 +4,7 @@ import ChatPanel from './components/ChatPanel';
 import DicePanel from './components/DicePanel';
 import CharacterSheet from './components/CharacterSheet';
 import GameButtons from './components/GameButtons';
+import { streamChat, takeSentences } from './chatStream';
 
 function App() {
   // Chat state
@@ -39,18 +40,46 @@ function App() {
     window.speechSynthesis.speak(utter);
   };
 
-  // Chat submit handler
+  // Chat submit handler: stream the GM's reply token by token, speaking
+  // each finished sentence right away when TTS is on
   const handleChatSubmit = async (e) => {
     e.preventDefault();
     if (!chatInput.trim()) return;
-    setMessages((msgs) => [...msgs, { sender: "user", text: chatInput }]);
-    // Simulate AI response (replace with API call)
-    setTimeout(() => {
-      const aiText = `AI says: ${chatInput}`;
-      setMessages((msgs) => [...msgs, { sender: "ai", text: aiText }]);
-      speak(aiText);
-    }, 500);
+    const message = chatInput;
+    const id = `ai-${Date.now()}-${Math.random()}`;
+    setMessages((msgs) => [...msgs, { sender: "user", text: message }]);
     setChatInput("");
+    let started = false;
+    let unspoken = "";
+    const showReply = (text, streaming) => {
+      const append = !started;
+      started = true;
+      setMessages((msgs) => append
+        ? [...msgs, { id, sender: "ai", text, streaming }]
+        : msgs.map((m) => (m.id === id ? { ...m, text, streaming } : m)));
+    };
+    try {
+      const text = await streamChat({ message, sessionId, character }, (token, soFar) => {
+        showReply(soFar, true);
+        const { ready, rest } = takeSentences(unspoken + token);
+        if (ready) speak(ready);
+        unspoken = rest;
+      });
+      showReply(text, false);
+      if (unspoken.trim()) speak(unspoken.trim());
+    } catch {
+      if (started) {
+        setMessages((msgs) => [
+          ...msgs.map((m) => (m.id === id ? { ...m, streaming: false } : m)),
+          { sender: "system", text: "The reply was interrupted." },
+        ]);
+      } else {
+        // No backend reachable (offline dev): fall back to a local echo
+        const aiText = `AI says: ${message}`;
+        showReply(aiText, false);
+        speak(aiText);
+      }
+    }
   };
 
   // Dice roll handler
@@ -0,0 +1,51 @@
+// Reads the GM's reply from /api/chat/stream (server-sent events over a POST)
+// and hands each token to onToken as it arrives. Resolves with the full text.
+
+function parseEvent(block) {
+  let event = 'message';
+  let data = '';
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data += line.slice(5).trim();
+  }
+  return { event, data: data ? JSON.parse(data) : null };
+}
+
+export async function streamChat({ message, sessionId, character }, onToken, fetchImpl = fetch) {
+  const resp = await fetchImpl('/api/chat/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ message, session_id: sessionId || undefined, character }),
+  });
+  if (!resp || !resp.ok || !resp.body) {
+    throw new Error('Streaming is unavailable');
+  }
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (value) buffer += decoder.decode(value, { stream: !done });
+    let split;
+    while ((split = buffer.indexOf('\n\n')) !== -1) {
+      const { event, data } = parseEvent(buffer.slice(0, split));
+      buffer = buffer.slice(split + 2);
+      if (event === 'error') throw new Error((data && data.error) || 'Stream error');
+      if (event === 'done') return data && data.text !== undefined ? data.text : text;
+      if (data && data.token) {
+        text += data.token;
+        onToken(data.token, text);
+      }
+    }
+    if (done) return text;
+  }
+}
+
+// Splits streamed text into sentences that are ready to speak and the
+// unfinished remainder, so TTS can start before the reply is complete.
+export function takeSentences(text) {
+  const match = text.match(/^[\s\S]*[.!?](?=\s)/);
+  if (!match) return { ready: '', rest: text };
+  return { ready: match[0].trim(), rest: text.slice(match[0].length) };
+}
@@ -0,0 +1,47 @@
+/* eslint-env vitest */
+import { describe, it, expect, vi } from 'vitest';
+import { streamChat, takeSentences } from './chatStream';
+
+function fakeResponse(chunks, ok = true) {
+  const encoder = new TextEncoder();
+  const queue = chunks.map((c) => encoder.encode(c));
+  return {
+    ok,
+    body: {
+      getReader: () => ({
+        read: async () => (queue.length ? { value: queue.shift(), done: false } : { value: undefined, done: true }),
+      }),
+    },
+  };
+}
+
+describe('streamChat', () => {
+  it('delivers tokens as they arrive, even when events span chunks', async () => {
+    const fetchImpl = vi.fn().mockResolvedValue(fakeResponse([
+      'data: {"token": "The "}\n\ndata: {"tok',
+      'en": "door "}\n\n',
+      'data: {"token": "creaks."}\n\nevent: done\ndata: {"text": "The door creaks."}\n\n',
+    ]));
+    const onToken = vi.fn();
+    const text = await streamChat({ message: 'open', sessionId: 's1' }, onToken, fetchImpl);
+    expect(text).toBe('The door creaks.');
+    expect(onToken.mock.calls.map((c) => c[1])).toEqual(['The ', 'The door ', 'The door creaks.']);
+    const [url, init] = fetchImpl.mock.calls[0];
+    expect(url).toBe('/api/chat/stream');
+    expect(JSON.parse(init.body)).toEqual({ message: 'open', session_id: 's1' });
+  });
+
+  it('rejects on error events and failed responses', async () => {
+    const broken = vi.fn().mockResolvedValue(fakeResponse(['event: error\ndata: {"error": "boom"}\n\n']));
+    await expect(streamChat({ message: 'x' }, () => {}, broken)).rejects.toThrow('boom');
+    const refused = vi.fn().mockResolvedValue(fakeResponse([], false));
+    await expect(streamChat({ message: 'x' }, () => {}, refused)).rejects.toThrow();
+  });
+});
+
+describe('takeSentences', () => {
+  it('splits finished sentences from the remainder', () => {
+    expect(takeSentences('You enter. The room is da')).toEqual({ ready: 'You enter.', rest: ' The room is da' });
+    expect(takeSentences('Still going')).toEqual({ ready: '', rest: 'Still going' });
+  });
+});
@@ -6,8 +6,9 @@ export default function ChatPanel({ messages, chatInput, setChatInput, onSubmit
       <h2>Chat</h2>
       <div className="chat-messages" data-testid="chat-messages">
         {messages.map((msg, i) => (
-          <div key={i} className={`msg msg-${msg.sender}`}>
+          <div key={msg.id || i} className={`msg msg-${msg.sender}`} aria-busy={msg.streaming ? "true" : undefined}>
             <b>{msg.sender === "user" ? "You" : msg.sender === "ai" ? "AI" : "System"}:</b> {msg.text}
+            {msg.streaming && <span className="msg-cursor" data-testid="stream-cursor" aria-hidden="true">▍</span>}
           </div>
         ))}
       </div>
@@ -53,4 +53,16 @@ describe('ChatPanel', () => {
     fireEvent.submit(input.closest('form'));
     expect(onSubmit).toHaveBeenCalled();
   });
+
+  it('shows a cursor while a reply is still streaming', () => {
+    const messages = [
+      { id: 'a', sender: 'ai', text: 'The door', streaming: true },
+      { id: 'b', sender: 'ai', text: 'Done.' },
+    ];
+    render(<ChatPanel {...baseProps} messages={messages} />);
+    const cursors = screen.getAllByTestId('stream-cursor');
+    expect(cursors).toHaveLength(1);
+    expect(screen.getByText('The door').closest('.msg-ai')).toContainElement(cursors[0]);
+    expect(screen.getByText('Done.').closest('.msg-ai')).not.toHaveAttribute('aria-busy');
+  });
 });
@@ -0,0 +1,47 @@
+"""Rulebook sections and rule chunks
+
+Revision ID: a4d2c7e91b05
+Revises: 3b3c94b566e5
+Create Date: 2026-10-18 09:12:41.503117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d2c7e91b05'
+down_revision = '3b3c94b566e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rulebook_section',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rulebook_id', sa.Integer(), sa.ForeignKey('rulebook.id'), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_rulebook_section_rulebook_id_title', 'rulebook_section', ['rulebook_id', 'title'])
+    op.create_table('rule_chunk',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rulebook_id', sa.Integer(), sa.ForeignKey('rulebook.id'), nullable=False),
+        sa.Column('universe_id', sa.Integer(), sa.ForeignKey('universe.id'), nullable=True),
+        sa.Column('section', sa.String(length=255), nullable=True),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_rule_chunk_rulebook_id_section', 'rule_chunk', ['rulebook_id', 'section'])
+    op.create_index('ix_rule_chunk_universe_id', 'rule_chunk', ['universe_id'])
+
+
+def downgrade():
+    op.drop_index('ix_rule_chunk_universe_id', table_name='rule_chunk')
+    op.drop_index('ix_rule_chunk_rulebook_id_section', table_name='rule_chunk')
+    op.drop_table('rule_chunk')
+    op.drop_index('ix_rulebook_section_rulebook_id_title', table_name='rulebook_section')
+    op.drop_table('rulebook_section')
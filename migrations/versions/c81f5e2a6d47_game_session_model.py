@@ -0,0 +1,29 @@
+"""Game session model
+
+Revision ID: c81f5e2a6d47
+Revises: a4d2c7e91b05
+Create Date: 2026-10-18 10:03:17.224580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f5e2a6d47'
+down_revision = 'a4d2c7e91b05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('game_session',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('game_session')
@@ -0,0 +1,28 @@
+"""Rulebook content digest
+
+Revision ID: d52e7b1f9a30
+Revises: c81f5e2a6d47
+Create Date: 2026-10-18 14:21:08.615032
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd52e7b1f9a30'
+down_revision = 'c81f5e2a6d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('rulebook') as batch_op:
+        batch_op.add_column(sa.Column('content_digest', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_rulebook_content_digest', ['content_digest'])
+
+
+def downgrade():
+    with op.batch_alter_table('rulebook') as batch_op:
+        batch_op.drop_index('ix_rulebook_content_digest')
+        batch_op.drop_column('content_digest')
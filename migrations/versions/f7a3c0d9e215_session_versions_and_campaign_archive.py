@@ -0,0 +1,35 @@
+"""Session versions and campaign archive rows
+
+Revision ID: f7a3c0d9e215
+Revises: d52e7b1f9a30
+Create Date: 2026-10-18 15:02:44.180316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a3c0d9e215'
+down_revision = 'd52e7b1f9a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('game_session') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.create_table('campaign_archive_turn',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.String(length=36), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('session_id', 'position', name='uq_campaign_archive_turn')
+    )
+
+
+def downgrade():
+    op.drop_table('campaign_archive_turn')
+    with op.batch_alter_table('game_session') as batch_op:
+        batch_op.drop_column('version')